@@ -0,0 +1,179 @@
+"""Load-tests the real analyzers, or the enricher on a synthetic vault, against the stub server.
+
+Reports the throughput, the p50/p95/p99 latency of the analyzer calls and how they ended.
+
+PYTHONPATH=. python benchmarks/load.py --analyzer grok --calls 200 --concurrency 8 \
+    --latency-ms 800 --latency-distribution lognormal --rate-429 0.05 --wrong-count-rate 0.05
+PYTHONPATH=. python benchmarks/load.py --enricher --years 1 --concurrency 4 --latency-ms 800
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import perf_counter
+
+import anthropic
+import openai
+from stub_server import StubServer, add_fault_arguments, get_faults
+from vault import FOODS, NUTRITION_DIR, make_vault
+
+from nutrition101.domain import NBreakdown
+from nutrition101.llm import (
+    ClaudeNAnalyzer,
+    GrokAnalyzer,
+    HedgedAnalyzer,
+    ILLMAnalyzer,
+    IncompleteOutputError,
+)
+from nutrition101.obsidian import ObsidianNotesEnricher
+
+
+class TimedAnalyzer(ILLMAnalyzer):
+    """Records how long each call of the wrapped analyzer took and how it ended."""
+
+    def __init__(self, analyzer: ILLMAnalyzer) -> None:
+        self._analyzer = analyzer
+        self._lock = threading.Lock()
+        self.latencies: list[float] = []
+        self.outcomes: Counter[str] = Counter()
+        self.meals = 0
+
+    @property
+    def name(self) -> str:
+        return self._analyzer.name
+
+    @property
+    def max_tokens(self) -> int | None:
+        return self._analyzer.max_tokens
+
+    def close(self) -> None:
+        self._analyzer.close()
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        start = perf_counter()
+        outcome = "ok"
+        try:
+            breakdowns = self._analyzer.get_meal_breakdowns(
+                meal_descriptions, knowledge_base_section
+            )
+            if len(breakdowns) != len(meal_descriptions):
+                outcome = "wrong count"
+            return breakdowns
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            with self._lock:
+                self.latencies.append(perf_counter() - start)
+                self.outcomes[outcome] += 1
+                self.meals += len(meal_descriptions)
+
+
+# how the stub's faults end a call, anything else is a bug and stops the run
+_CALL_ERRORS = (anthropic.APIError, openai.APIError, IncompleteOutputError)
+
+
+def _make_analyzer(name: str, server: StubServer, concurrency: int) -> ILLMAnalyzer:
+    if name == "hedged":
+        # both providers are served by the same stub, with the same faults
+        return HedgedAnalyzer(
+            _make_analyzer("claude", server, concurrency),
+            _make_analyzer("grok", server, concurrency),
+            max_concurrency=concurrency,
+        )
+    if name == "claude":
+        return ClaudeNAnalyzer(api_key="stub", base_url=server.url)
+    return GrokAnalyzer(api_key="stub", base_url=f"{server.url}/v1")
+
+
+def _call_analyzer(
+    analyzer: TimedAnalyzer, calls: int, concurrency: int, meals_per_call: int
+) -> None:
+    def call(idx: int) -> None:
+        meals = [FOODS[(idx + n) % len(FOODS)] for n in range(meals_per_call)]
+        try:
+            analyzer.get_meal_breakdowns(meals, None)
+        except _CALL_ERRORS:
+            # counted by the analyzer
+            pass
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(call, range(calls)))
+
+
+def _enrich_vault(analyzer: TimedAnalyzer, years: int, concurrency: int) -> None:
+    with tempfile.TemporaryDirectory() as vault_dir:
+        notes_files = make_vault(Path(vault_dir), years, enriched_share=0)
+        enricher = ObsidianNotesEnricher(analyzer=analyzer, max_concurrency=concurrency)
+        # the enricher prints every day it processes
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for notes_file in notes_files:
+                enricher.enrich_notes(
+                    notes_file=str(notes_file),
+                    knowledge_base="",
+                    nutrition_dir=NUTRITION_DIR,
+                    only_date=None,
+                    write_notes_to=None,
+                    override_existing=False,
+                )
+
+
+def _print_report(analyzer: TimedAnalyzer, seconds: float, server: StubServer) -> None:
+    latencies = analyzer.latencies
+    print(
+        f"{analyzer.name}: {len(latencies)} calls, {analyzer.meals} meals in {seconds:.2f}s"
+        f" ({len(latencies) / seconds:.1f} calls/s, {analyzer.meals / seconds:.1f} meals/s)"
+    )
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        print(
+            "latency: p50 {:.3f}s, p95 {:.3f}s, p99 {:.3f}s, max {:.3f}s".format(
+                percentiles[49], percentiles[94], percentiles[98], max(latencies)
+            )
+        )
+    print(f"calls: {dict(analyzer.outcomes)}")
+    # the SDKs retry 429s and 500s themselves, the server sees every attempt
+    print(f"stub responses: {dict(server.state.responses)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--analyzer", choices=["claude", "grok", "hedged"], default="claude"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--meals-per-call", type=int, default=3)
+    parser.add_argument(
+        "--enricher",
+        action="store_true",
+        help="Enrich a synthetic vault instead of calling the analyzer directly.",
+    )
+    parser.add_argument("--years", type=int, default=1)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(get_faults(args)).start()
+    analyzer = TimedAnalyzer(_make_analyzer(args.analyzer, server, args.concurrency))
+    start = perf_counter()
+    try:
+        if args.enricher:
+            _enrich_vault(analyzer, args.years, args.concurrency)
+        else:
+            _call_analyzer(analyzer, args.calls, args.concurrency, args.meals_per_call)
+    finally:
+        _print_report(analyzer, perf_counter() - start, server)
+        analyzer.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compares the streaming notes parser with the one it replaced on a synthetic notes file.
+
+PYTHONPATH=. python benchmarks/parser.py --years 5
+"""
+
+import argparse
+import re
+import statistics
+from datetime import date, datetime
+from time import perf_counter
+
+from vault import MEALS, make_notes
+
+from nutrition101.obsidian.markdown import (
+    DailyEntry,
+    DailyEntrySection,
+    parse_daily_entries,
+)
+
+
+def legacy_parse_daily_entries(content: str) -> list[DailyEntry]:
+    """`NotesManipulator._parse_daily_entries` before the streaming parser."""
+
+    def get_date_from_line(line: str) -> date | None:
+        date_pattern = r"\b(\d{1,2}/\d{1,2}/\d{4})\b"
+        match = re.search(date_pattern, line.strip())
+        return match and datetime.strptime(match.group(), "%m/%d/%Y").date()
+
+    content_lines = content.splitlines()
+    current_line = 0
+    entries, current_date, current_date_sections, current_section_lines = (
+        [],
+        None,
+        [],
+        [],
+    )
+    while current_line <= len(content_lines) - 1:
+        line = content_lines[current_line]
+        maybe_date = get_date_from_line(line)
+        if maybe_date:
+            if current_date is not None:
+                entries.append(
+                    DailyEntry(date=current_date, sections=current_date_sections)
+                )
+            current_date, current_date_sections = maybe_date, []
+        elif not line.strip(" \n"):
+            if current_section_lines:
+                current_date_sections.append(
+                    DailyEntrySection(content="\n".join(current_section_lines))
+                )
+                current_section_lines = []
+        else:
+            current_section_lines.append(line)
+        current_line += 1
+
+    if current_date:
+        if current_section_lines:
+            current_date_sections.append(
+                DailyEntrySection(content="\n".join(current_section_lines))
+            )
+        entries.append(DailyEntry(date=current_date, sections=current_date_sections))
+    return entries
+
+
+def _time(func, runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = perf_counter()
+        func()
+        durations.append(perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    content = make_notes(args.years, meals=len(MEALS))
+    assert list(parse_daily_entries(content)) == legacy_parse_daily_entries(content)
+    last_day = date(2024, 12, 31)
+
+    results = {
+        "legacy": _time(lambda: legacy_parse_daily_entries(content), args.runs),
+        "streaming": _time(lambda: list(parse_daily_entries(content)), args.runs),
+        "streaming, one day": _time(
+            lambda: list(parse_daily_entries(content, dates={last_day})), args.runs
+        ),
+    }
+    print(f"{len(content.splitlines())} lines, {len(content) / 1024:.0f} KiB")
+    for name, seconds in results.items():
+        print(
+            f"{name:>20}: {seconds * 1000:8.1f} ms ({results['legacy'] / seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measures the CLI startup: from the interpreter start to a command finishing.
+
+The command is a `--vault` pass over an empty vault, what a cron tick with no edits costs.
+
+    uv run benchmarks/startup.py --runs 20 --max-seconds 0.5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("anthropic", "magentic", "openai", "telethon")
+
+
+def _time_command(vault_dir: str) -> float:
+    start = perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "nutrition101.cli", "enrich-notes", vault_dir, "n101"]
+        + ["--vault"],
+        check=True,
+        capture_output=True,
+        cwd=vault_dir,
+        env=os.environ | {"PYTHONPATH": str(ROOT), "DEBUG_LOGS": "1"},
+    )
+    return perf_counter() - start
+
+
+def _get_heavy_imports() -> list[str]:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, nutrition101.cli; print(' '.join(sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    ).stdout
+    return [m for m in output.split() if m in HEAVY_MODULES]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--max-seconds", type=float, help="Fail if the median is slower than that."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as vault_dir:
+        durations = [_time_command(vault_dir) for _ in range(args.runs)]
+    median = statistics.median(durations)
+    print(
+        f"startup: median {median:.3f}s, min {min(durations):.3f}s, "
+        f"max {max(durations):.3f}s over {args.runs} runs"
+    )
+    if heavy_imports := _get_heavy_imports():
+        print(f"importing the CLI imports {', '.join(heavy_imports)}")
+    if args.max_seconds is not None and median > args.max_seconds:
+        sys.exit(f"startup is slower than {args.max_seconds}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""A local stand-in for the Anthropic messages and the OpenAI chat completions APIs.
+
+It answers the analyzers' tool calls with made-up breakdowns, one per meal description, after
+a random delay, and fails a share of the requests on purpose: 429 and 500 responses, outputs
+cut off at the token limit and answers with one breakdown too few.
+
+PYTHONPATH=. python benchmarks/stub_server.py --port 8101 --latency-ms 1500 --rate-429 0.05
+
+Point `ClaudeNAnalyzer(base_url="http://127.0.0.1:8101")` or
+`GrokAnalyzer(base_url="http://127.0.0.1:8101/v1")` at it.
+"""
+
+import argparse
+import json
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Literal
+
+from pydantic import BaseModel
+
+from nutrition101.domain import NBreakdown, NEntry
+
+
+class StubFaults(BaseModel):
+    latency_ms: float = 0.0
+    latency_distribution: Literal["constant", "exponential", "lognormal"] = "constant"
+    rate_429: float = 0.0
+    rate_500: float = 0.0
+    truncate_rate: float = 0.0
+    wrong_count_rate: float = 0.0
+    seed: int = 101
+
+
+def _sse(events: list[tuple[str | None, dict]]) -> bytes:
+    return "".join(
+        (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+        for event, data in events
+    ).encode()
+
+
+class _StubState:
+    def __init__(self, faults: StubFaults) -> None:
+        self.faults = faults
+        self.responses: Counter[str] = Counter()
+        self._rng = random.Random(faults.seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def get_latency(self) -> float:
+        mean = self.faults.latency_ms / 1000
+        with self._lock:
+            match self.faults.latency_distribution:
+                case "constant":
+                    return mean
+                case "exponential":
+                    return self._rng.expovariate(1 / mean) if mean else 0.0
+                case "lognormal":
+                    # sigma 0.5: the p99 is about 3 times the median, like the real APIs
+                    return mean * self._rng.lognormvariate(-0.125, 0.5)
+
+    def make_breakdowns(self, meal_descriptions: list[str]) -> list[NBreakdown]:
+        with self._lock:
+            return [
+                NBreakdown(
+                    entries=[
+                        NEntry(
+                            item=item.strip(),
+                            calories=self._rng.randint(10, 700),
+                            carbs_g=self._rng.randint(0, 80),
+                            sugars_g=(sugars := self._rng.randint(0, 30)),
+                            added_sugars_g=self._rng.randint(0, sugars),
+                            protein_g=self._rng.randint(0, 50),
+                            fat_g=self._rng.randint(0, 40),
+                            fiber_g=self._rng.randint(0, 15),
+                            sodium_mg=self._rng.randint(0, 900),
+                            used_knowledge_base=False,
+                        )
+                        for item in description.split(",")
+                    ]
+                )
+                for description in meal_descriptions
+            ]
+
+    def count(self, response: str) -> None:
+        with self._lock:
+            self.responses[response] += 1
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format: str, *args) -> None: ...
+
+    def _respond(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_error(self, status: int, error_type: str) -> None:
+        error = {"type": error_type, "message": f"Injected {status}."}
+        body = (
+            {"type": "error", "error": error}
+            if self._is_anthropic
+            else {"error": error}
+        )
+        self._respond(status, json.dumps(body).encode(), "application/json")
+
+    @property
+    def _is_anthropic(self) -> bool:
+        return self.path.endswith("/messages")
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        if not self.path.endswith(("/messages", "/chat/completions")):
+            self._respond(404, b"{}", "application/json")
+            return
+
+        state = self.server.state
+        sleep(state.get_latency())
+        roll = state.roll()
+        if roll < (threshold := state.faults.rate_429):
+            state.count("429")
+            self._respond_error(429, "rate_limit_error")
+            return
+        if roll < (threshold := threshold + state.faults.rate_500):
+            state.count("500")
+            self._respond_error(500, "api_error")
+            return
+
+        if self._is_anthropic:
+            tool_name = request["tools"][0]["name"]
+            content = request["messages"][-1]["content"]
+            text = content if isinstance(content, str) else content[-1]["text"]
+        else:
+            tool_name = request["tools"][0]["function"]["name"]
+            text = request["messages"][-1]["content"]
+        meal_descriptions = text.split(": ", 1)[-1].split("|||")
+
+        breakdowns = state.make_breakdowns(meal_descriptions)
+        is_truncated = False
+        if roll < (threshold := threshold + state.faults.truncate_rate):
+            is_truncated = True
+        elif roll < threshold + state.faults.wrong_count_rate:
+            breakdowns = breakdowns[:-1]
+        state.count(
+            "truncated"
+            if is_truncated
+            else "wrong count"
+            if len(breakdowns) < len(meal_descriptions)
+            else "ok"
+        )
+
+        tool_input = json.dumps({"value": [b.model_dump() for b in breakdowns]})
+        if is_truncated:
+            tool_input = tool_input[: len(tool_input) // 2]
+        input_tokens = len(json.dumps(request)) // 4
+        output_tokens = len(tool_input) // 4
+        make_events = (
+            self._make_anthropic_events
+            if self._is_anthropic
+            else self._make_openai_events
+        )
+        body = _sse(
+            make_events(
+                tool_name, tool_input, is_truncated, input_tokens, output_tokens
+            )
+        )
+        if not self._is_anthropic:
+            body += b"data: [DONE]\n\n"
+        self._respond(200, body, "text/event-stream")
+
+    @staticmethod
+    def _make_anthropic_events(
+        tool_name: str,
+        tool_input: str,
+        is_truncated: bool,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> list[tuple[str | None, dict]]:
+        message = {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "model": "stub",
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+        }
+        tool_use = {"type": "tool_use", "id": "toolu_stub", "name": tool_name}
+        delta = {"type": "input_json_delta", "partial_json": tool_input}
+        stop_reason = "max_tokens" if is_truncated else "tool_use"
+        return [
+            ("message_start", {"type": "message_start", "message": message}),
+            (
+                "content_block_start",
+                {
+                    "type": "content_block_start",
+                    "index": 0,
+                    "content_block": tool_use | {"input": {}},
+                },
+            ),
+            (
+                "content_block_delta",
+                {"type": "content_block_delta", "index": 0, "delta": delta},
+            ),
+            ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            (
+                "message_delta",
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                    "usage": {"output_tokens": output_tokens},
+                },
+            ),
+            ("message_stop", {"type": "message_stop"}),
+        ]
+
+    @staticmethod
+    def _make_openai_events(
+        tool_name: str,
+        tool_input: str,
+        is_truncated: bool,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> list[tuple[str | None, dict]]:
+        chunk = {
+            "id": "chunk_stub",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "stub",
+        }
+        tool_call = {
+            "index": 0,
+            "id": "call_stub",
+            "type": "function",
+            "function": {"name": tool_name, "arguments": tool_input},
+        }
+        choice = {"index": 0, "delta": {"role": "assistant", "tool_calls": [tool_call]}}
+        usage = {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        finish_reason = "length" if is_truncated else "tool_calls"
+        return [
+            (None, chunk | {"choices": [choice | {"finish_reason": None}]}),
+            (
+                None,
+                chunk
+                | {
+                    "choices": [
+                        {"index": 0, "delta": {}, "finish_reason": finish_reason}
+                    ]
+                },
+            ),
+            (None, chunk | {"choices": [], "usage": usage}),
+        ]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, faults: StubFaults, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), _StubHandler)
+        self.state = _StubState(faults)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = StubFaults()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=["constant", "exponential", "lognormal"],
+        default=defaults.latency_distribution,
+    )
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429)
+    parser.add_argument("--rate-500", type=float, default=defaults.rate_500)
+    parser.add_argument(
+        "--truncate-rate",
+        type=float,
+        default=defaults.truncate_rate,
+        help="The share of outputs cut off at the token limit.",
+    )
+    parser.add_argument(
+        "--wrong-count-rate",
+        type=float,
+        default=defaults.wrong_count_rate,
+        help="The share of outputs with one breakdown too few.",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def get_faults(args: argparse.Namespace) -> StubFaults:
+    return StubFaults.model_validate(
+        {field: getattr(args, field) for field in StubFaults.model_fields}
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8101)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(get_faults(args), args.port)
+    print(f"Serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.state.responses))
+
+
+if __name__ == "__main__":
+    main()
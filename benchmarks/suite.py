@@ -0,0 +1,183 @@
+"""Times parsing, reading breakdowns, enriching and writing notes on a synthetic vault.
+
+The results go to a JSON file; pass the file of a previous commit to compare with it.
+
+PYTHONPATH=. python benchmarks/suite.py --years 3 --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections.abc import Callable
+from contextlib import redirect_stdout
+from itertools import cycle
+from pathlib import Path
+from time import perf_counter
+
+from vault import NUTRITION_DIR, make_vault
+
+from nutrition101.domain import NBreakdown
+from nutrition101.llm import ILLMAnalyzer
+from nutrition101.obsidian import NotesManipulator, ObsidianNotesEnricher
+from nutrition101.obsidian.markdown import parse_daily_entries
+from tests.fixtures import NBreakdownFactory
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class ZeroLatencyAnalyzer(ILLMAnalyzer):
+    """Answers from a pool of prebuilt breakdowns, so only the enricher itself is timed."""
+
+    def __init__(self) -> None:
+        self._breakdowns = cycle(NBreakdownFactory.build_batch(100))
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        return [next(self._breakdowns) for _ in meal_descriptions]
+
+
+def _time(func: Callable[[], None], runs: int, setup: Callable[[], None]) -> dict:
+    durations = []
+    for _ in range(runs):
+        setup()
+        start = perf_counter()
+        func()
+        durations.append(perf_counter() - start)
+    return {
+        "median_s": statistics.median(durations),
+        "min_s": min(durations),
+        "max_s": max(durations),
+        "runs": runs,
+    }
+
+
+def _get_commit() -> str:
+    return subprocess.run(
+        ["git", "describe", "--always", "--dirty"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        check=True,
+    ).stdout.strip()
+
+
+def run_suite(vault_dir: Path, notes_files: list[Path], runs: int) -> dict[str, dict]:
+    n101_files = [
+        nf.parent / NUTRITION_DIR / nf.name
+        for nf in notes_files
+        if (nf.parent / NUTRITION_DIR / nf.name).exists()
+    ]
+    contents = [p.read_text() for p in notes_files + n101_files]
+
+    # enriching and writing change the vault, they run on a fresh copy every time
+    scratch_dir = vault_dir.parent / "scratch"
+
+    def copy_vault() -> None:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        shutil.copytree(vault_dir, scratch_dir)
+
+    def scratch(notes_file: Path) -> str:
+        return str(scratch_dir / notes_file.relative_to(vault_dir))
+
+    def parse() -> None:
+        for content in contents:
+            list(parse_daily_entries(content))
+
+    def get_meal_breakdowns() -> None:
+        for notes_file in notes_files:
+            nm = NotesManipulator(str(notes_file), NUTRITION_DIR)
+            for de in nm.source_entries:
+                nm.get_meal_breakdowns(de.date)
+
+    enricher = ObsidianNotesEnricher(analyzer=ZeroLatencyAnalyzer())
+
+    def enrich_notes() -> None:
+        # the enricher prints every day it processes
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for notes_file in notes_files:
+                enricher.enrich_notes(
+                    notes_file=scratch(notes_file),
+                    knowledge_base="",
+                    nutrition_dir=NUTRITION_DIR,
+                    only_date=None,
+                    write_notes_to=None,
+                    override_existing=False,
+                )
+
+    manipulators: list[NotesManipulator] = []
+    breakdown = NBreakdownFactory.build()
+
+    def edit_last_days() -> None:
+        # a new breakdown for the last day of every month, what a day of enriching leaves
+        copy_vault()
+        manipulators.clear()
+        for notes_file in notes_files:
+            nm = NotesManipulator(scratch(notes_file), NUTRITION_DIR)
+            last_day = nm.source_entries[-1]
+            meal = next(s for s in last_day.sections if s.is_meal)
+            nm.add_meal_breakdown(last_day.date, meal, breakdown)
+            manipulators.append(nm)
+
+    def write_notes() -> None:
+        for nm in manipulators:
+            nm.write_notes(None)
+
+    return {
+        "parse": _time(parse, runs, setup=lambda: None),
+        "get_meal_breakdowns": _time(get_meal_breakdowns, runs, setup=lambda: None),
+        "enrich_notes": _time(enrich_notes, runs, setup=copy_vault),
+        "write_notes": _time(write_notes, runs, setup=edit_last_days),
+    }
+
+
+def _print_results(results: dict[str, dict], baseline: dict | None) -> None:
+    for name, result in results.items():
+        line = f"{name:>20}: {result['median_s'] * 1000:9.1f} ms"
+        if baseline and name in baseline["results"]:
+            before = baseline["results"][name]["median_s"]
+            line += f"  ({before / result['median_s']:.2f}x vs {baseline['commit']})"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--meals", type=int, default=4)
+    parser.add_argument("--enriched-share", type=float, default=0.9)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--compare", type=Path, help="The JSON file of an earlier run.")
+    args = parser.parse_args()
+
+    params = {
+        "years": args.years,
+        "meals": args.meals,
+        "enriched_share": args.enriched_share,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    if baseline and baseline["params"] != params:
+        sys.exit(f"{args.compare} was run with {baseline['params']}, not {params}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vault_dir = Path(tmp_dir) / "vault"
+        notes_files = make_vault(vault_dir, args.years, args.meals, args.enriched_share)
+        results = run_suite(vault_dir, notes_files, args.runs)
+
+    report = {
+        "commit": _get_commit(),
+        "python": sys.version.split()[0],
+        "params": params,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    _print_results(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Generates a synthetic vault: `{year}/{%m %B}.md` daily notes files with their n101 files.
+
+PYTHONPATH=. python benchmarks/vault.py ~/n101-vault --years 3 --meals 4
+"""
+
+import argparse
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from factory.random import reseed_random
+
+from nutrition101.obsidian import NotesManipulator
+from tests.fixtures import NBreakdownFactory
+
+NUTRITION_DIR = "n101"
+MEALS = ["breakfast", "snack", "lunch", "dinner", "tea", "supper"]
+FOODS = [
+    "1 cup cottage cheese wi 25 blueberries",
+    "2 eggs, 1/2 large avocado, 1 slice sourdough bread",
+    "A cup of rice, 30g beef, 30g sauteed veggies",
+    "5 corn tortillas, 3/4 cup salad, 1tbsp mayo + hot sauce",
+    "a large cup of peppermint tea",
+    "Black coffee wi 3oz goat milk.",
+]
+
+
+def _make_day(rng: random.Random, day: date, meals: int) -> str:
+    sections = [day.strftime("%m/%d/%Y"), "S[l] slept well"]
+    for meal in MEALS[:meals]:
+        foods = rng.sample(FOODS, rng.randint(1, 3))
+        sections.append("\n".join([f"=={meal}==", *foods]))
+    return "\n\n".join(sections)
+
+
+def _get_days(years: int) -> list[date]:
+    last_day = date(2024, 12, 31)
+    return [last_day - timedelta(days=n) for n in reversed(range(365 * years))]
+
+
+def make_notes(years: int, meals: int = 4, seed: int = 101) -> str:
+    """Returns `years` years of daily notes, until the end of 2024, as a single notes file."""
+    rng = random.Random(seed)
+    return "\n\n".join(_make_day(rng, day, meals) for day in _get_days(years))
+
+
+def make_vault(
+    root: Path,
+    years: int,
+    meals: int = 4,
+    enriched_share: float = 0.9,
+    seed: int = 101,
+) -> list[Path]:
+    """Writes `years` years of daily notes, until the end of 2024, and returns the notes files.
+
+    Every day has `meals` meals, the oldest `enriched_share` of the days already have
+    breakdowns in the n101 files, the rest are left for the enricher.
+    """
+    rng = random.Random(seed)
+    reseed_random(seed)
+    days = _get_days(years)
+    enriched_until = days[0] + timedelta(days=int(365 * years * enriched_share))
+
+    months: dict[Path, list[date]] = {}
+    for day in days:
+        notes_file = root / str(day.year) / day.strftime("%m %B.md")
+        months.setdefault(notes_file, []).append(day)
+
+    for notes_file, days in months.items():
+        notes_file.parent.mkdir(parents=True, exist_ok=True)
+        notes_file.write_text("\n\n".join(_make_day(rng, d, meals) for d in days))
+        if days[0] >= enriched_until:
+            continue
+        nm = NotesManipulator(str(notes_file), NUTRITION_DIR)
+        for de in nm.source_entries:
+            if de.date >= enriched_until:
+                break
+            for section in [s for s in de.sections if s.is_meal]:
+                nm.add_meal_breakdown(de.date, section, NBreakdownFactory.build())
+        nm.write_notes(None)
+    return list(months)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument(
+        "--meals", type=int, default=4, choices=range(1, len(MEALS) + 1)
+    )
+    parser.add_argument("--enriched-share", type=float, default=0.9)
+    args = parser.parse_args()
+
+    notes_files = make_vault(args.root, args.years, args.meals, args.enriched_share)
+    print(f"{len(notes_files)} notes files in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
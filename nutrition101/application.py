@@ -1,20 +1,100 @@
 import configparser
 import logging
 import os
+from collections.abc import Callable
+from functools import cache
 
-from nutrition101.llm import ClaudeNAnalyzer, GrokAnalyzer
+from pydantic import ValidationError
+
+from nutrition101.llm import HttpSettings, ILLMAnalyzer
 from nutrition101.misc import TelegramLogHandler, DebuggingHandler
 
 
+class ConfigError(Exception):
+    """config.ini doesn't have a setting the command needs."""
+
+
+@cache
+def _get_config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    return config
+
+
+def _get_setting(section: str, key: str) -> str:
+    try:
+        return _get_config()[section][key]
+    except KeyError as e:
+        raise ConfigError(
+            f"config.ini is missing the [{section}] {key} setting."
+        ) from e
+
+
+# optional [LLM] settings, see `HttpSettings` for the defaults
+_HTTP_SETTINGS = {
+    "CONNECT_TIMEOUT_SECONDS": "connect_timeout_s",
+    "READ_TIMEOUT_SECONDS": "read_timeout_s",
+    "MAX_RETRIES": "max_retries",
+    "MAX_CONNECTIONS": "max_connections",
+}
+
+
+def _get_http_settings() -> HttpSettings:
+    config = _get_config()
+    llm_section = config["LLM"] if config.has_section("LLM") else {}
+    try:
+        return HttpSettings.model_validate(
+            {
+                field: llm_section[key]
+                for key, field in _HTTP_SETTINGS.items()
+                if key in llm_section
+            }
+        )
+    except ValidationError as e:
+        raise ConfigError(f"config.ini has invalid [LLM] HTTP settings: {e}") from e
+
+
+def _make_claude_analyzer() -> ILLMAnalyzer:
+    from nutrition101.llm import ClaudeNAnalyzer
+
+    return ClaudeNAnalyzer(
+        api_key=_get_setting("LLM", "ANTHROPIC_API_KEY"),
+        http_settings=_get_http_settings(),
+    )
+
+
+def _make_grok_analyzer() -> ILLMAnalyzer:
+    from nutrition101.llm import GrokAnalyzer
+
+    return GrokAnalyzer(
+        api_key=_get_setting("LLM", "GROK_API_KEY"),
+        http_settings=_get_http_settings(),
+    )
+
+
+# analyzers are imported and created on first use: only the selected one is needed,
+# and importing magentic and the provider SDKs dominates the startup time
+_ANALYZER_FACTORIES: dict[str, Callable[[], ILLMAnalyzer]] = {
+    "claude": _make_claude_analyzer,
+    "grok": _make_grok_analyzer,
+}
+ANALYZERS = list(_ANALYZER_FACTORIES)
+
+
+@cache
+def get_analyzer(name: str) -> ILLMAnalyzer:
+    return _ANALYZER_FACTORIES[name]()
+
+
 def _configure_logging():
     logger = logging.getLogger("n101")
     logging.basicConfig(level=logging.INFO)
     t_handler = TelegramLogHandler(
-        session=CONFIG["Telegram"]["TELETHON_SESSION_NAME"],
-        api_id=int(CONFIG["Telegram"]["API_ID"]),
-        api_hash=CONFIG["Telegram"]["API_HASH"],
-        group_id=int(CONFIG["Telegram"]["LOG_TO_GROUP_ID"]),
-        bot_token=CONFIG["Telegram"]["BOT_TOKEN"],
+        session=_get_setting("Telegram", "TELETHON_SESSION_NAME"),
+        api_id=int(_get_setting("Telegram", "API_ID")),
+        api_hash=_get_setting("Telegram", "API_HASH"),
+        group_id=int(_get_setting("Telegram", "LOG_TO_GROUP_ID")),
+        bot_token=_get_setting("Telegram", "BOT_TOKEN"),
     )
     logger.addHandler(t_handler)
 
@@ -25,13 +105,9 @@ def _configure_logging_debug():
     logger.addHandler(DebuggingHandler())
 
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read("config.ini")
-
-CLAUDE_LLM = ClaudeNAnalyzer(api_key=CONFIG["LLM"]["ANTHROPIC_API_KEY"])
-GROK_LLM = GrokAnalyzer(api_key=CONFIG["LLM"]["GROK_API_KEY"])
-
-if os.environ.get("DEBUG_LOGS"):
-    _configure_logging_debug()
-else:
-    _configure_logging()
+@cache
+def configure_logging() -> None:
+    if os.environ.get("DEBUG_LOGS"):
+        _configure_logging_debug()
+    else:
+        _configure_logging()
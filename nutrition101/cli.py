@@ -1,18 +1,272 @@
 import logging
 from pathlib import Path
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import chain
 from time import time
 
 import click
 
-from nutrition101.application import CLAUDE_LLM, GROK_LLM
-from nutrition101.obsidian import ObsidianNotesEnricher
+from nutrition101.application import (
+    ANALYZERS,
+    ConfigError,
+    configure_logging,
+    get_analyzer,
+)
+from nutrition101.llm import (
+    BreakdownCache,
+    HedgedAnalyzer,
+    ILLMAnalyzer,
+    MealIndex,
+    RunBudget,
+)
+from nutrition101.metrics import (
+    RunMetrics,
+    append_report,
+    get_token_prices,
+    write_prometheus_textfile,
+)
+from nutrition101.obsidian import (
+    NotesManifest,
+    NotesManipulator,
+    ObsidianNotesEnricher,
+    discover_notes_files,
+    make_notes_watcher,
+    watch_notes_files,
+)
 from nutrition101.misc import get_today_date
 
 log = logging.getLogger("n101." + __name__)
 
 
+def _configure_logging() -> None:
+    try:
+        configure_logging()
+    except ConfigError as e:
+        raise click.ClickException(str(e)) from e
+
+
+def _get_analyzer(name: str) -> ILLMAnalyzer:
+    try:
+        return get_analyzer(name)
+    except ConfigError as e:
+        raise click.ClickException(str(e)) from e
+
+
+def _get_hedged_analyzer(
+    name: str,
+    hedge_with: str | None,
+    hedge_after_seconds: float | None,
+    max_concurrency: int,
+) -> ILLMAnalyzer:
+    analyzer = _get_analyzer(name)
+    if hedge_with is None:
+        if hedge_after_seconds is not None:
+            raise click.UsageError("--hedge-after-seconds needs --hedge-with.")
+        return analyzer
+    if hedge_with == name:
+        raise click.UsageError("--hedge-with must be another analyzer than --analyzer.")
+    return HedgedAnalyzer(
+        analyzer,
+        _get_analyzer(hedge_with),
+        hedge_after_s=hedge_after_seconds,
+        max_concurrency=max_concurrency,
+    )
+
+
+def _read_knowledge_base(notes_file: Path, nutrition_dir: str) -> str:
+    # next to the n101 files the enricher writes for the notes file
+    knowledge_base = notes_file.parent / nutrition_dir / "knowledge_base.md"
+    return knowledge_base.read_text() if knowledge_base.exists() else ""
+
+
+def _open_cache(
+    cache_file: str | None, cache_max_age_days: int, cache_max_entries: int
+) -> BreakdownCache | None:
+    if not cache_file:
+        return None
+    return BreakdownCache(
+        cache_file,
+        max_entries=cache_max_entries,
+        max_age=timedelta(days=cache_max_age_days),
+    )
+
+
+def _enrich_notes_file(
+    notes_enricher: ObsidianNotesEnricher,
+    notes_file: Path,
+    nutrition_dir: str,
+    manifest: NotesManifest | None,
+    only_date: datetime | None = None,
+    write_notes_to: str | None = None,
+    override_existing: bool = False,
+    metrics: RunMetrics | None = None,
+    budget: RunBudget | None = None,
+) -> bool:
+    was_enriched = notes_enricher.enrich_notes(
+        notes_file=str(notes_file),
+        knowledge_base=_read_knowledge_base(notes_file, nutrition_dir),
+        nutrition_dir=nutrition_dir,
+        only_date=only_date,
+        write_notes_to=write_notes_to,
+        override_existing=override_existing,
+        metrics=metrics,
+        budget=budget,
+    )
+
+    retry_stats = notes_enricher.retry_stats
+    if retry_stats.mismatches:
+        log.info(
+            "Recovered from %d incomplete LLM responses with %d retries, %.2f extra seconds. %d meals left without breakdowns.",
+            retry_stats.mismatches,
+            retry_stats.retries,
+            retry_stats.retry_seconds,
+            retry_stats.failed_meals,
+        )
+    if notes_enricher.deferred_days:
+        log.info(
+            "The run budget is spent, %d days of %s are left for the next run.",
+            len(notes_enricher.deferred_days),
+            notes_file,
+        )
+    # files with meals left without breakdowns are picked up again by the next run
+    if (
+        manifest is not None
+        and not retry_stats.failed_meals
+        and not notes_enricher.deferred_days
+    ):
+        manifest.record(notes_file)
+    return was_enriched
+
+
+def _open_meal_index(
+    meal_index_file: str | None, similarity_threshold: float
+) -> MealIndex | None:
+    if not meal_index_file:
+        return None
+    return MealIndex(meal_index_file, threshold=similarity_threshold)
+
+
+def _log_usage(
+    llm: ILLMAnalyzer,
+    cache: BreakdownCache | None,
+    meal_index: MealIndex | None = None,
+) -> None:
+    if llm.usage is not None and llm.usage.calls:
+        log.info(
+            "%s: %d calls, %d input tokens (%d read from cache, %d written to cache), %d output tokens",
+            llm.name,
+            llm.usage.calls,
+            llm.usage.input_tokens,
+            llm.usage.cache_read_input_tokens,
+            llm.usage.cache_creation_input_tokens,
+            llm.usage.output_tokens,
+        )
+    if cache is not None and cache.hits + cache.misses:
+        log.info("Breakdown cache: %d hits, %d misses", cache.hits, cache.misses)
+    if meal_index is not None and meal_index.hits + meal_index.misses:
+        log.info(
+            "Meal index: %d similar meals reused, %d misses",
+            meal_index.hits,
+            meal_index.misses,
+        )
+
+
+def _report_metrics(
+    metrics: RunMetrics,
+    command: str,
+    metrics_file: str | None,
+    prometheus_file: str | None,
+) -> None:
+    report = metrics.get_report(command)
+    for analyzer, stats in report.analyzers.items():
+        log.info(
+            "%s: %d calls (%d failed), p50 %.2fs, p95 %.2fs, cost $%s",
+            analyzer,
+            stats.calls,
+            stats.failed_calls,
+            stats.latency_p50_s,
+            stats.latency_p95_s,
+            "?" if stats.cost_usd is None else f"{stats.cost_usd:.4f}",
+        )
+    try:
+        if metrics_file:
+            append_report(report, metrics_file)
+        if prometheus_file:
+            write_prometheus_textfile(report, prometheus_file)
+    except OSError:
+        log.exception("Can't write the run metrics.")
+
+
+def _make_budget(
+    llm: ILLMAnalyzer, max_run_tokens: int | None, max_run_cost: float | None
+) -> RunBudget | None:
+    if max_run_tokens is None and max_run_cost is None:
+        return None
+    prices = get_token_prices(llm.name)
+    if max_run_cost is not None and prices is None:
+        raise click.ClickException(
+            f"The token prices of {llm.name} aren't known, use --max-run-tokens instead."
+        )
+    return RunBudget(
+        max_tokens=max_run_tokens, max_cost_usd=max_run_cost, prices=prices
+    )
+
+
+def _budget_options(command):
+    command = click.option(
+        "--max-run-tokens",
+        type=click.IntRange(min=1),
+        help="Stop sending meals to the analyzer once a run is estimated to spend this many tokens; the rest waits for the next run.",
+    )(command)
+    return click.option(
+        "--max-run-cost",
+        type=click.FloatRange(min=0),
+        help="Like --max-run-tokens, in estimated US dollars.",
+    )(command)
+
+
+def _hedge_options(command):
+    command = click.option(
+        "--hedge-with",
+        type=click.Choice(ANALYZERS),
+        help="Ask this analyzer too when --analyzer is slow or fails, the first complete answer wins.",
+    )(command)
+    return click.option(
+        "--hedge-after-seconds",
+        type=click.FloatRange(min=0),
+        help="How long to wait for --analyzer before asking --hedge-with, defaults to its observed p90 latency.",
+    )(command)
+
+
+def _meal_index_options(command):
+    command = click.option(
+        "--meal-index-file",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Reuse the breakdowns of near-identical past meals indexed in this file instead of asking the analyzer.",
+    )(command)
+    return click.option(
+        "--similarity-threshold",
+        type=click.FloatRange(min=0, max=1, min_open=True),
+        default=0.9,
+        show_default=True,
+        help="How similar a meal's description must be to an indexed one to reuse its breakdown.",
+    )(command)
+
+
+def _metrics_options(command):
+    command = click.option(
+        "--metrics-file",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Append a JSON line with the stage timings, analyzer calls, tokens and cost of every run.",
+    )(command)
+    return click.option(
+        "--prometheus-file",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the last run's metrics to this node_exporter textfile.",
+    )(command)
+
+
 @click.group()
 def cli(): ...
 
@@ -20,10 +274,43 @@ def cli(): ...
 @click.command()
 @click.argument("daily-notes-dir")
 @click.argument("nutrition-dir")
-@click.option("--analyzer", type=click.Choice(["claude", "grok"]), default="claude")
+@click.option("--analyzer", type=click.Choice(ANALYZERS), default="claude")
 @click.option("--only-date", type=click.DateTime(["%m/%d/%Y"]))
 @click.option("--write-notes-to", type=click.Path(writable=True))
 @click.option("--override-existing", is_flag=True)
+@click.option("--cache-file", type=click.Path(dir_okay=False, writable=True))
+@click.option("--cache-max-age-days", type=int, default=180)
+@click.option("--cache-max-entries", type=int, default=10_000)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="How many days to analyze concurrently.",
+)
+@click.option(
+    "--batch-token-budget",
+    type=click.IntRange(min=1),
+    help="Pack meals from many days into LLM calls of up to this many prompt tokens.",
+)
+@click.option(
+    "--checkpoint",
+    is_flag=True,
+    help="Write the notes as soon as meal breakdowns are received in full, so a cut-off call keeps the finished meals.",
+)
+@click.option(
+    "--vault",
+    is_flag=True,
+    help="Enrich every daily notes file that changed since the last run, not only the current month's.",
+)
+@click.option(
+    "--manifest-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Where --vault keeps track of the processed files, defaults to DAILY_NOTES_DIR/.n101-manifest.json.",
+)
+@_meal_index_options
+@_hedge_options
+@_budget_options
+@_metrics_options
 def enrich_notes(
     daily_notes_dir: str,
     nutrition_dir: str,
@@ -31,37 +318,348 @@ def enrich_notes(
     write_notes_to: str | None,
     override_existing: bool,
     analyzer: str,
+    cache_file: str | None,
+    cache_max_age_days: int,
+    cache_max_entries: int,
+    max_concurrency: int,
+    batch_token_budget: int | None,
+    checkpoint: bool,
+    vault: bool,
+    manifest_file: str | None,
+    metrics_file: str | None,
+    prometheus_file: str | None,
+    max_run_tokens: int | None,
+    max_run_cost: float | None,
+    hedge_with: str | None,
+    hedge_after_seconds: float | None,
+    meal_index_file: str | None,
+    similarity_threshold: float,
 ):
+    _configure_logging()
     start = time()
-    today = get_today_date()
-    notes_file = Path(f"{daily_notes_dir}/{today.year}/{today.strftime('%m %B.md')}")
-    if not notes_file.exists():
-        log.info(f"The notes files {notes_file} couldn't be found.")
-        sys.exit(1)
+    metrics = RunMetrics()
+    manifest = None
+    if vault:
+        if write_notes_to:
+            raise click.UsageError("--write-notes-to can't be used with --vault.")
+        manifest = NotesManifest(
+            manifest_file or f"{daily_notes_dir}/.n101-manifest.json"
+        )
+        notes_files = manifest.get_changed(
+            discover_notes_files(daily_notes_dir, nutrition_dir)
+        )
+        # the current month goes first, its days are the ones waited on
+        today = get_today_date()
+        notes_files.sort(
+            key=lambda nf: (
+                (nf.parent.name, nf.name)
+                != (str(today.year), today.strftime("%m %B.md"))
+            )
+        )
+        if not notes_files:
+            manifest.save()
+            log.info("No daily notes files changed since the last run.")
+            return
+    else:
+        today = get_today_date()
+        notes_file = Path(
+            f"{daily_notes_dir}/{today.year}/{today.strftime('%m %B.md')}"
+        )
+        if not notes_file.exists():
+            log.info(f"The notes files {notes_file} couldn't be found.")
+            sys.exit(1)
+        notes_files = [notes_file]
 
-    knowledge_base = Path(f"{daily_notes_dir}/{today.year}/n101/knowledge_base.md")
+    cache = _open_cache(cache_file, cache_max_age_days, cache_max_entries)
+    meal_index = _open_meal_index(meal_index_file, similarity_threshold)
+    llm = _get_hedged_analyzer(
+        analyzer, hedge_with, hedge_after_seconds, max_concurrency
+    )
+    budget = _make_budget(llm, max_run_tokens, max_run_cost)
+    notes_enricher = ObsidianNotesEnricher(
+        analyzer=llm,
+        cache=cache,
+        max_concurrency=max_concurrency,
+        batch_token_budget=batch_token_budget,
+        checkpoint=checkpoint,
+        meal_index=meal_index,
+    )
+    was_enriched = False
     try:
-        was_enriched = ObsidianNotesEnricher(
-            analyzer=CLAUDE_LLM if analyzer == "claude" else GROK_LLM
-        ).enrich_notes(
-            notes_file=str(notes_file),
-            knowledge_base=knowledge_base.read_text()
-            if knowledge_base.exists()
-            else "",
-            nutrition_dir=nutrition_dir,
-            only_date=only_date,
-            write_notes_to=write_notes_to,
-            override_existing=override_existing,
-        )
+        for notes_file in notes_files:
+            if manifest is not None:
+                log.info("Enriching %s", notes_file)
+            was_enriched |= _enrich_notes_file(
+                notes_enricher,
+                notes_file,
+                nutrition_dir,
+                manifest,
+                only_date=only_date,
+                write_notes_to=write_notes_to,
+                override_existing=override_existing,
+                metrics=metrics,
+                budget=budget,
+            )
     except Exception:
         log.exception("Error enriching daily notes.")
         sys.exit(1)
+    finally:
+        llm.close()
+        if cache is not None:
+            cache.close()
+        if meal_index is not None:
+            meal_index.close()
+        if manifest is not None:
+            manifest.save()
+        _report_metrics(metrics, "enrich-notes", metrics_file, prometheus_file)
 
+    _log_usage(llm, cache, meal_index)
     if was_enriched:
         log.info("Done enriching daily notes. Took %.2f seconds", time() - start)
 
 
+@click.command()
+@click.argument("daily-notes-dir")
+@click.argument("nutrition-dir")
+@click.option("--analyzer", type=click.Choice(ANALYZERS), default="claude")
+@click.option("--cache-file", type=click.Path(dir_okay=False, writable=True))
+@click.option("--cache-max-age-days", type=int, default=180)
+@click.option("--cache-max-entries", type=int, default=10_000)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="How many days to analyze concurrently.",
+)
+@click.option(
+    "--batch-token-budget",
+    type=click.IntRange(min=1),
+    help="Pack meals from many days into LLM calls of up to this many prompt tokens.",
+)
+@click.option(
+    "--checkpoint",
+    is_flag=True,
+    help="Write the notes as soon as meal breakdowns are received in full, so a cut-off call keeps the finished meals.",
+)
+@click.option(
+    "--manifest-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Where to keep track of the processed files, defaults to DAILY_NOTES_DIR/.n101-manifest.json.",
+)
+@click.option(
+    "--debounce-seconds",
+    type=click.FloatRange(min=0),
+    default=5.0,
+    help="How long a changed file has to stay quiet before it's enriched.",
+)
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0.1),
+    default=10.0,
+    help="How often to look for changes when inotify isn't available.",
+)
+@_meal_index_options
+@_hedge_options
+@_budget_options
+@_metrics_options
+def watch(
+    daily_notes_dir: str,
+    nutrition_dir: str,
+    analyzer: str,
+    cache_file: str | None,
+    cache_max_age_days: int,
+    cache_max_entries: int,
+    max_concurrency: int,
+    batch_token_budget: int | None,
+    checkpoint: bool,
+    manifest_file: str | None,
+    debounce_seconds: float,
+    poll_interval: float,
+    metrics_file: str | None,
+    prometheus_file: str | None,
+    max_run_tokens: int | None,
+    max_run_cost: float | None,
+    hedge_with: str | None,
+    hedge_after_seconds: float | None,
+    meal_index_file: str | None,
+    similarity_threshold: float,
+):
+    """Enriches the daily notes files as they change, until interrupted.
+
+    Every batch of changes is a run, with its own --max-run-tokens/--max-run-cost budget.
+    """
+    _configure_logging()
+    manifest = NotesManifest(manifest_file or f"{daily_notes_dir}/.n101-manifest.json")
+    cache = _open_cache(cache_file, cache_max_age_days, cache_max_entries)
+    meal_index = _open_meal_index(meal_index_file, similarity_threshold)
+    # the analyzer, its HTTP client, the cache and the meal index stay warm between the changes
+    llm = _get_hedged_analyzer(
+        analyzer, hedge_with, hedge_after_seconds, max_concurrency
+    )
+    # only checks that the budget can be made
+    _make_budget(llm, max_run_tokens, max_run_cost)
+    notes_enricher = ObsidianNotesEnricher(
+        analyzer=llm,
+        cache=cache,
+        max_concurrency=max_concurrency,
+        batch_token_budget=batch_token_budget,
+        checkpoint=checkpoint,
+        meal_index=meal_index,
+    )
+    # the watcher is set up first so that nothing changed during the catch-up is missed
+    watcher = make_notes_watcher(daily_notes_dir, nutrition_dir, poll_interval)
+    log.info("Watching %s for changes with %s", daily_notes_dir, type(watcher).__name__)
+    try:
+        changes = chain(
+            [discover_notes_files(daily_notes_dir, nutrition_dir)],
+            watch_notes_files(watcher, debounce_seconds),
+        )
+        for notes_files in changes:
+            # the manifest filters out our own writes and files touched but not modified
+            changed_files = manifest.get_changed(notes_files)
+            metrics = RunMetrics()
+            budget = _make_budget(llm, max_run_tokens, max_run_cost)
+            for notes_file in changed_files:
+                start = time()
+                try:
+                    was_enriched = _enrich_notes_file(
+                        notes_enricher,
+                        notes_file,
+                        nutrition_dir,
+                        manifest,
+                        metrics=metrics,
+                        budget=budget,
+                    )
+                except Exception:
+                    log.exception("Error enriching %s.", notes_file)
+                    continue
+                if was_enriched:
+                    log.info(
+                        "Done enriching %s. Took %.2f seconds",
+                        notes_file,
+                        time() - start,
+                    )
+            manifest.save()
+            if changed_files:
+                _report_metrics(metrics, "watch", metrics_file, prometheus_file)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        llm.close()
+        manifest.save()
+        if cache is not None:
+            cache.close()
+        if meal_index is not None:
+            meal_index.close()
+        _log_usage(llm, cache, meal_index)
+
+
+@click.command()
+@click.argument("daily-notes-dir")
+@click.argument("nutrition-dir")
+@click.option("--from", "from_date", type=click.DateTime(["%m/%d/%Y"]))
+@click.option("--to", "to_date", type=click.DateTime(["%m/%d/%Y"]))
+@click.option(
+    "--window",
+    type=click.IntRange(min=1),
+    default=7,
+    help="How many days the rolling averages are over.",
+)
+def stats(
+    daily_notes_dir: str,
+    nutrition_dir: str,
+    from_date: datetime | None,
+    to_date: datetime | None,
+    window: int,
+):
+    """Prints averages, macro ratios and trends of the breakdowns in the vault."""
+    # numpy is only needed here
+    from nutrition101.store import NUTRIENTS, NutritionStore
+
+    store = NutritionStore.load(daily_notes_dir, nutrition_dir).select(
+        from_date and from_date.date(), to_date and to_date.date()
+    )
+    days, totals = store.daily_totals()
+    if not len(days):
+        click.echo("No breakdowns in the date range.")
+        return
+
+    click.echo(f"{len(days)} days with breakdowns, {days[0]} to {days[-1]}")
+    click.echo("Daily average:")
+    for nutrient in NUTRIENTS:
+        click.echo(f"  {nutrient:>15}: {totals[nutrient].mean():8.1f}")
+    ratios = store.macro_ratios()
+    click.echo(
+        "Calories from protein {:.0%}, carbs {:.0%}, fat {:.0%}".format(
+            ratios["protein_g"], ratios["carbs_g"], ratios["fat_g"]
+        )
+    )
+    for nutrient in ("protein_g", "fiber_g"):
+        click.echo(f"{nutrient} trend: {store.trend(nutrient) * 7:+.1f} per week")
+
+    click.echo(f"{window}-day rolling averages:")
+    click.echo(f"  {'until':>10}  {'calories':>8}  {'protein_g':>9}  {'fiber_g':>7}")
+    rolling = {
+        n: store.rolling_average(n, window)
+        for n in ("calories", "protein_g", "fiber_g")
+    }
+    until, _ = rolling["calories"]
+    # one line per window, the latest one last
+    for idx in range(len(until) - 1, -1, -window)[::-1]:
+        click.echo(
+            f"  {until[idx]!s:>10}  {rolling['calories'][1][idx]:8.0f}  "
+            f"{rolling['protein_g'][1][idx]:9.1f}  {rolling['fiber_g'][1][idx]:7.1f}"
+        )
+
+
+@click.command()
+@click.argument("daily-notes-dir")
+@click.argument("nutrition-dir")
+@click.argument("db-file")
+def export(daily_notes_dir: str, nutrition_dir: str, db_file: str):
+    """Exports the meal breakdown rows of the months that changed to a SQLite database."""
+    from nutrition101.export import SQLiteExporter
+
+    exporter = SQLiteExporter(db_file)
+    try:
+        exported = exporter.export(daily_notes_dir, nutrition_dir)
+        click.echo(
+            f"Exported {len(exported)} months, {db_file} has {len(exporter)} rows."
+        )
+    finally:
+        exporter.close()
+
+
+@click.command()
+@click.argument("daily-notes-dir")
+@click.argument("nutrition-dir")
+@click.argument("meal-index-file")
+def index_meals(daily_notes_dir: str, nutrition_dir: str, meal_index_file: str):
+    """Adds the meals that already have breakdowns in the vault to the meal index in MEAL_INDEX_FILE."""
+    meal_index = MealIndex(meal_index_file)
+    try:
+        added = 0
+        for notes_file in discover_notes_files(daily_notes_dir, nutrition_dir):
+            nm = NotesManipulator(str(notes_file), nutrition_dir)
+            added += meal_index.add(
+                (ms.get_meal_description(), n_b.breakdown)
+                for de in nm.source_entries
+                for ms, n_b in nm.get_meal_breakdowns(de.date)
+                if n_b is not None
+            )
+        click.echo(
+            f"Indexed {added} meals, {meal_index_file} has {len(meal_index)} meals."
+        )
+    finally:
+        meal_index.close()
+
+
 cli.add_command(enrich_notes)
+cli.add_command(watch)
+cli.add_command(stats)
+cli.add_command(export)
+cli.add_command(index_meals)
 
 
 if __name__ == "__main__":
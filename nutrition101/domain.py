@@ -16,6 +16,19 @@ class NEntry(BaseModel):
     used_knowledge_base: bool
 
 
+# the nutrient fields of `NEntry`, in the order of the breakdown tables' columns
+NUTRIENTS = (
+    "calories",
+    "carbs_g",
+    "sugars_g",
+    "added_sugars_g",
+    "protein_g",
+    "fat_g",
+    "fiber_g",
+    "sodium_mg",
+)
+
+
 class NBreakdown(BaseModel):
     entries: list[NEntry]
 
@@ -0,0 +1,125 @@
+"""Keeps a SQLite copy of the meal breakdown rows of the vault, for scripts that query the history."""
+
+import sqlite3
+from collections.abc import Iterator
+from hashlib import md5
+from pathlib import Path
+
+from nutrition101.domain import NUTRIENTS
+from nutrition101.obsidian.markdown import get_item_name, parse_meal_breakdown_entries
+from nutrition101.obsidian.vault import (
+    FileStamp,
+    check_file_stamp,
+    discover_notes_files,
+)
+
+
+class SQLiteExporter:
+    """Exports the meal breakdown rows of the n101 files into an `entries` table.
+
+    Every n101 file is a month. A month is only exported again when its n101 file's size or
+    mtime, and then its content, changed since the last export: its rows are replaced in one
+    transaction, inserted as they're parsed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "month TEXT NOT NULL, date TEXT NOT NULL, meal_name TEXT NOT NULL, "
+            "meal_hash TEXT NOT NULL, item TEXT NOT NULL, "
+            "used_knowledge_base INTEGER NOT NULL, "
+            + ", ".join(f"{n} INTEGER NOT NULL" for n in NUTRIENTS)
+            + ");"
+            "CREATE INDEX IF NOT EXISTS entries_month ON entries (month);"
+            "CREATE INDEX IF NOT EXISTS entries_date ON entries (date);"
+            "CREATE TABLE IF NOT EXISTS months ("
+            "month TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, md5 TEXT NOT NULL);"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _iter_rows(month: str, content: str) -> Iterator[tuple]:
+        for day, meal_name, meal_hash, entry in parse_meal_breakdown_entries(content):
+            yield (
+                month,
+                day.isoformat(),
+                meal_name,
+                meal_hash,
+                get_item_name(entry),
+                int(entry.used_knowledge_base),
+                *(getattr(entry, n) for n in NUTRIENTS),
+            )
+
+    def _save_stamp(self, month: str, stamp: FileStamp) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)",
+            (month, stamp.size, stamp.mtime_ns, stamp.md5),
+        )
+
+    def _has_changed(self, month: str, n101_notes: Path) -> bool:
+        row = self._db.execute(
+            "SELECT size, mtime_ns, md5 FROM months WHERE month = ?", (month,)
+        ).fetchone()
+        has_changed, stamp = check_file_stamp(
+            n101_notes,
+            row and FileStamp(size=row[0], mtime_ns=row[1], md5=row[2]),
+        )
+        if stamp is not None:
+            with self._db:
+                self._save_stamp(month, stamp)
+        return has_changed
+
+    def _export_month(self, month: str, n101_notes: Path) -> None:
+        # stat before reading, a file written in between is exported again the next time
+        stat = n101_notes.stat()
+        data = n101_notes.read_bytes()
+        stamp = FileStamp(
+            size=stat.st_size, mtime_ns=stat.st_mtime_ns, md5=md5(data).hexdigest()
+        )
+        placeholders = ", ".join("?" * (6 + len(NUTRIENTS)))
+        with self._db:
+            self._db.execute("DELETE FROM entries WHERE month = ?", (month,))
+            self._db.executemany(
+                f"INSERT INTO entries VALUES ({placeholders})",
+                self._iter_rows(month, data.decode()),
+            )
+            self._save_stamp(month, stamp)
+
+    def export(self, daily_notes_dir: str, nutrition_dir: str) -> list[str]:
+        """Exports the months that changed since the last export, and returns them.
+
+        The rows of the months whose n101 file is gone are deleted.
+        """
+        n101_files = {}
+        for notes_file in discover_notes_files(daily_notes_dir, nutrition_dir):
+            n101_notes = notes_file.parent / nutrition_dir / notes_file.name
+            if n101_notes.exists():
+                # `{year}/{%m %B}.md`
+                n101_files[f"{notes_file.parent.name}-{notes_file.name[:2]}"] = (
+                    n101_notes
+                )
+
+        exported = []
+        for month, n101_notes in n101_files.items():
+            if self._has_changed(month, n101_notes):
+                self._export_month(month, n101_notes)
+                exported.append(month)
+
+        gone = [
+            month
+            for (month,) in self._db.execute("SELECT month FROM months").fetchall()
+            if month not in n101_files
+        ]
+        with self._db:
+            for month in gone:
+                self._db.execute("DELETE FROM entries WHERE month = ?", (month,))
+                self._db.execute("DELETE FROM months WHERE month = ?", (month,))
+        return exported
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
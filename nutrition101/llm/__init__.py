@@ -1 +1,19 @@
-from .models import ClaudeNAnalyzer, ILLMAnalyzer, GrokAnalyzer
+from .base import ILLMAnalyzer, IncompleteOutputError, TokenUsage
+from .budget import RunBudget
+from .cache import BreakdownCache
+from .clients import HttpSettings
+from .concurrent import ConcurrentNAnalyzer
+from .hedged import HedgedAnalyzer, HedgeStats
+from .metered import MeteredAnalyzer
+from .similarity import MealIndex, SimilarMeal
+from .batching import BatchPlanner, BatchRetryStats, MealBatch, get_batch_breakdowns
+from .knowledge_base import KnowledgeBase, Recipe
+
+
+def __getattr__(name: str):
+    # the analyzers pull in magentic and the provider SDKs, which are slow to import
+    if name in ("ClaudeNAnalyzer", "GrokAnalyzer"):
+        from . import models
+
+        return getattr(models, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,159 @@
+"""The analyzer interface, importable without the LLM provider SDKs."""
+
+import threading
+from abc import ABCMeta, abstractmethod
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, NamedTuple
+
+from nutrition101.domain import NBreakdown
+
+if TYPE_CHECKING:
+    from magentic import Usage
+
+
+class PromptCacheUsage(NamedTuple):
+    """`magentic.Usage` plus the prompt tokens read from/written to the provider's cache."""
+
+    input_tokens: int
+    output_tokens: int
+    cache_read_input_tokens: int
+    cache_creation_input_tokens: int
+    # the output was cut off at max tokens
+    is_truncated: bool = False
+    # the call was stopped before the provider reported its usage in full,
+    # the output tokens (and, for some providers, all of them) are a lower bound
+    is_partial: bool = False
+
+
+class IncompleteOutputError(Exception):
+    """The LLM output couldn't be parsed into breakdowns, e.g. it was cut off at max tokens."""
+
+
+class CancelledCallError(Exception):
+    """The call was cancelled while it was running, e.g. another analyzer answered first."""
+
+
+class Cancellation:
+    """Closes the responses of the calls made under it when it's cancelled, from any thread.
+
+    A streaming analyzer registers the closing of its response with the cancellation of the
+    calling context, see `use_cancellation`; cancelling stops the call mid-response.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._closers: list[Callable[[], None]] = []
+        self.is_cancelled = False
+
+    def register(self, close: Callable[[], None]) -> None:
+        with self._lock:
+            if not self.is_cancelled:
+                self._closers.append(close)
+                return
+        close()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.is_cancelled = True
+            closers, self._closers = self._closers, []
+        for close in closers:
+            # the reading thread gets to see what's wrong with the response
+            with suppress(Exception):
+                close()
+
+
+_cancellation: ContextVar[Cancellation | None] = ContextVar(
+    "n101_cancellation", default=None
+)
+
+
+@contextmanager
+def use_cancellation(cancellation: Cancellation) -> Iterator[None]:
+    """The analyzer calls made in this block stop when `cancellation` is cancelled."""
+    token = _cancellation.set(cancellation)
+    try:
+        yield
+    finally:
+        # pooled threads go on to make other calls
+        _cancellation.reset(token)
+
+
+def get_cancellation() -> Cancellation | None:
+    return _cancellation.get()
+
+
+class TokenUsage:
+    """Tokens an analyzer has spent, including the prompt tokens read from/written to the provider's cache."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # what the calling thread's last call spent, analyzers are called from many threads
+        self._last = threading.local()
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+
+    def record(self, usage: "Usage | PromptCacheUsage | None") -> None:
+        self._last.usage = usage
+        with self._lock:
+            self.calls += 1
+            if usage is None:
+                return
+            self.input_tokens += usage.input_tokens
+            self.output_tokens += usage.output_tokens
+            if isinstance(usage, PromptCacheUsage):
+                self.cache_read_input_tokens += usage.cache_read_input_tokens
+                self.cache_creation_input_tokens += usage.cache_creation_input_tokens
+
+    def get_last(self) -> "Usage | PromptCacheUsage | None":
+        """The usage of the last call recorded from the current thread."""
+        return getattr(self._last, "usage", None)
+
+
+class ILLMAnalyzer(metaclass=ABCMeta):
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
+    @property
+    def max_tokens(self) -> int | None:
+        return None
+
+    @property
+    def usage(self) -> TokenUsage | None:
+        return None
+
+    def with_analyzers(
+        self, wrap: Callable[["ILLMAnalyzer"], "ILLMAnalyzer"]
+    ) -> "ILLMAnalyzer":
+        """The analyzer with `wrap` (e.g. metering) applied to the analyzers making the calls.
+
+        An analyzer that calls others, like the hedged one, wraps each of them instead.
+        """
+        return wrap(self)
+
+    def get_stats(self) -> dict[str, int]:
+        """Counters of how the analyzer handled its calls, e.g. how many were hedged."""
+        return {}
+
+    def close(self) -> None:
+        """Releases what the analyzer holds, e.g. its threads."""
+
+    @abstractmethod
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]: ...
+
+    def iter_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> Iterator[NBreakdown]:
+        """Yields the breakdowns as soon as they're received, in the order of the meals.
+
+        Raises `IncompleteOutputError` after the breakdowns received in full when the rest of
+        the output is cut off. Unless an analyzer streams, this waits for all of them.
+        """
+        yield from self.get_meal_breakdowns(meal_descriptions, knowledge_base_section)
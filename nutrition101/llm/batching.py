@@ -0,0 +1,207 @@
+import re
+import threading
+from collections.abc import Callable, Iterable
+from time import time
+from typing import Generic, TypeVar
+
+from nutrition101.domain import NBreakdown
+
+from .knowledge_base import KnowledgeBase
+from .base import ILLMAnalyzer, IncompleteOutputError
+from .prompts import BREAKDOWNS_FROM_MEALS
+
+K = TypeVar("K")
+
+_CHARS_PER_TOKEN = 4
+_FOOD_ITEMS_SEPARATORS = re.compile(r"[,;.+\n]|\band\b|\bwi(?:th)?\b")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+class MealBatch(Generic[K]):
+    """Meals (possibly from different days) that are analyzed with a single LLM call."""
+
+    def __init__(self, meals: list[tuple[K, str]]) -> None:
+        self.meals = meals
+
+    def __len__(self) -> int:
+        return len(self.meals)
+
+    @property
+    def keys(self) -> list[K]:
+        return [key for key, _ in self.meals]
+
+    @property
+    def descriptions(self) -> list[str]:
+        return [description for _, description in self.meals]
+
+    def split(self) -> tuple["MealBatch[K]", "MealBatch[K]"]:
+        assert len(self) > 1, "Can't split a single meal batch"
+        middle = len(self) // 2
+        return MealBatch(self.meals[:middle]), MealBatch(self.meals[middle:])
+
+    def align(self, breakdowns: list[NBreakdown]) -> list[tuple[K, NBreakdown]]:
+        assert len(breakdowns) == len(self), (
+            f"Wanted breakdowns for {len(self)} meals, but got {len(breakdowns)}"
+        )
+        return list(zip(self.keys, breakdowns))
+
+
+class BatchPlanner:
+    """Packs meals from many days into as few LLM calls as fit the token budgets.
+
+    The prompt budget covers the static prompt, the batch's recipes and the meal descriptions;
+    the output budget is checked against an estimate of the JSON the model returns per food item.
+    """
+
+    _OUTPUT_TOKENS_PER_FOOD_ITEM = 90
+    _OUTPUT_TOKENS_PER_MEAL = 20
+    # the output estimate is rough, leave some headroom below the model's max tokens
+    _OUTPUT_BUDGET_RATIO = 0.75
+
+    def __init__(self, prompt_token_budget: int, max_output_tokens: int) -> None:
+        self._prompt_token_budget = prompt_token_budget
+        self._output_token_budget = int(max_output_tokens * self._OUTPUT_BUDGET_RATIO)
+
+    @classmethod
+    def estimate_output_tokens(cls, meal_description: str) -> int:
+        food_items = len(
+            [p for p in _FOOD_ITEMS_SEPARATORS.split(meal_description) if p.strip()]
+        )
+        return cls._OUTPUT_TOKENS_PER_MEAL + cls._OUTPUT_TOKENS_PER_FOOD_ITEM * max(
+            food_items, 1
+        )
+
+    def plan(
+        self, meals: Iterable[tuple[K, str]], knowledge_base: KnowledgeBase
+    ) -> list[MealBatch[K]]:
+        """Groups meals into batches, preserving their order."""
+        static_prompt_tokens = estimate_tokens(BREAKDOWNS_FROM_MEALS)
+        batches: list[MealBatch[K]] = []
+        current: list[tuple[K, str]] = []
+        meals_prompt_tokens, output_tokens = 0, 0
+        for key, description in meals:
+            meal_prompt_tokens = estimate_tokens(description) + 1
+            meal_output_tokens = self.estimate_output_tokens(description)
+            knowledge_base_tokens = estimate_tokens(
+                knowledge_base.get_section([d for _, d in current] + [description])
+            )
+            if current and (
+                static_prompt_tokens
+                + knowledge_base_tokens
+                + meals_prompt_tokens
+                + meal_prompt_tokens
+                > self._prompt_token_budget
+                or output_tokens + meal_output_tokens > self._output_token_budget
+            ):
+                batches.append(MealBatch(current))
+                current, meals_prompt_tokens, output_tokens = [], 0, 0
+            current.append((key, description))
+            meals_prompt_tokens += meal_prompt_tokens
+            output_tokens += meal_output_tokens
+        if current:
+            batches.append(MealBatch(current))
+        return batches
+
+
+class BatchRetryStats:
+    """Counts the extra LLM calls spent on recovering batches that came back incomplete."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.mismatches = 0
+        self.retries = 0
+        self.retry_seconds = 0.0
+        self.failed_meals = 0
+
+    def record_mismatch(self) -> None:
+        with self._lock:
+            self.mismatches += 1
+
+    def record_retry(self, seconds: float) -> None:
+        with self._lock:
+            self.retries += 1
+            self.retry_seconds += seconds
+
+    def record_failure(self, meals: int) -> None:
+        with self._lock:
+            self.failed_meals += meals
+
+
+def _align(
+    batch: MealBatch[K],
+    breakdowns: list[NBreakdown],
+    on_breakdown: Callable[[K, NBreakdown], None] | None,
+) -> list[tuple[K, NBreakdown]]:
+    aligned = batch.align(breakdowns)
+    if on_breakdown is not None:
+        for key, breakdown in aligned:
+            on_breakdown(key, breakdown)
+    return aligned
+
+
+def get_batch_breakdowns(
+    analyzer: ILLMAnalyzer,
+    batch: MealBatch[K],
+    knowledge_base: KnowledgeBase,
+    stats: BatchRetryStats | None = None,
+    on_breakdown: Callable[[K, NBreakdown], None] | None = None,
+    _is_retry: bool = False,
+) -> list[tuple[K, NBreakdown]]:
+    """Analyzes the batch, returning breakdowns only for the meals they could be aligned with.
+
+    `on_breakdown` gets the breakdowns as soon as they are known to line up with their meals:
+    those of a complete response once their number is checked, and those received in full before
+    the output was cut off. When the output is cut off, the breakdowns received in full are
+    kept and only the meals after them are re-asked for. When it has a wrong number of breakdowns
+    the batch is split in halves and re-asked for, down to single meals. A single meal that comes
+    back as several breakdowns (the model split its description) gets them merged; otherwise the
+    meal is left out.
+    """
+    stats = stats or BatchRetryStats()
+    start = time()
+    breakdowns: list[NBreakdown] = []
+    is_complete = True
+    try:
+        for breakdown in analyzer.iter_meal_breakdowns(
+            batch.descriptions, knowledge_base.get_section(batch.descriptions)
+        ):
+            breakdowns.append(breakdown)
+    except IncompleteOutputError:
+        is_complete = False
+    finally:
+        if _is_retry:
+            stats.record_retry(time() - start)
+
+    if is_complete and len(breakdowns) == len(batch):
+        return _align(batch, breakdowns, on_breakdown)
+
+    stats.record_mismatch()
+    if not is_complete and 0 < len(breakdowns) < len(batch):
+        received = len(breakdowns)
+        return _align(
+            MealBatch(batch.meals[:received]), breakdowns, on_breakdown
+        ) + get_batch_breakdowns(
+            analyzer,
+            MealBatch(batch.meals[received:]),
+            knowledge_base,
+            stats,
+            on_breakdown,
+            _is_retry=True,
+        )
+
+    if len(batch) == 1:
+        if is_complete and breakdowns:
+            merged = NBreakdown(entries=[e for b in breakdowns for e in b.entries])
+            return _align(batch, [merged], on_breakdown)
+        stats.record_failure(1)
+        return []
+
+    left, right = batch.split()
+    return get_batch_breakdowns(
+        analyzer, left, knowledge_base, stats, on_breakdown, _is_retry=True
+    ) + get_batch_breakdowns(
+        analyzer, right, knowledge_base, stats, on_breakdown, _is_retry=True
+    )
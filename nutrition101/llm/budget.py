@@ -0,0 +1,76 @@
+from nutrition101.metrics import TokenPrices
+
+from .batching import BatchPlanner, estimate_tokens
+from .knowledge_base import KnowledgeBase
+from .prompts import BREAKDOWNS_FROM_MEALS
+
+
+class RunBudget:
+    """How many tokens, or dollars, a run may spend on the analyzer.
+
+    Work is reserved against estimates before it's sent: a day costs the static prompt,
+    its recipes and meals, plus the output estimate of `BatchPlanner`. The prompt cache
+    isn't accounted for. Once a day doesn't fit, the budget is spent and nothing else is
+    reserved, so the days after it (in priority order) wait for the next run.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        max_cost_usd: float | None = None,
+        prices: TokenPrices | None = None,
+    ) -> None:
+        assert max_cost_usd is None or prices is not None, (
+            "A dollar budget needs the analyzer's token prices"
+        )
+        self._max_tokens = max_tokens
+        self._max_cost_usd = max_cost_usd
+        self._prices = prices
+        self.tokens = 0
+        self.cost_usd = 0.0
+        self.is_spent = False
+
+    @staticmethod
+    def estimate_tokens(
+        meal_descriptions: list[str], knowledge_base: KnowledgeBase
+    ) -> tuple[int, int]:
+        """The prompt and the output tokens of analyzing the meals in one call."""
+        if not meal_descriptions:
+            return 0, 0
+        prompt_tokens = (
+            estimate_tokens(BREAKDOWNS_FROM_MEALS)
+            + estimate_tokens(knowledge_base.get_section(meal_descriptions))
+            + sum(estimate_tokens(d) + 1 for d in meal_descriptions)
+        )
+        output_tokens = sum(
+            BatchPlanner.estimate_output_tokens(d) for d in meal_descriptions
+        )
+        return prompt_tokens, output_tokens
+
+    def reserve(
+        self, meal_descriptions: list[str], knowledge_base: KnowledgeBase
+    ) -> bool:
+        if not meal_descriptions:
+            return True
+        if self.is_spent:
+            return False
+        prompt_tokens, output_tokens = self.estimate_tokens(
+            meal_descriptions, knowledge_base
+        )
+        cost_usd = 0.0
+        if self._prices is not None:
+            cost_usd = (
+                prompt_tokens * self._prices.input + output_tokens * self._prices.output
+            ) / 1_000_000
+        if (
+            self._max_tokens is not None
+            and self.tokens + prompt_tokens + output_tokens > self._max_tokens
+        ) or (
+            self._max_cost_usd is not None
+            and self.cost_usd + cost_usd > self._max_cost_usd
+        ):
+            self.is_spent = True
+            return False
+        self.tokens += prompt_tokens + output_tokens
+        self.cost_usd += cost_usd
+        return True
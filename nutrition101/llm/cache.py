@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+from datetime import timedelta
+from hashlib import md5
+from time import time
+
+from nutrition101.domain import NBreakdown
+
+from .prompts import (
+    BREAKDOWNS_FROM_MEALS,
+    BREAKDOWNS_KNOWLEDGE_BASE,
+    BREAKDOWNS_MEAL_DESCRIPTIONS,
+)
+
+
+class BreakdownCache:
+    """Disk-backed, content-addressed store of meal breakdowns.
+
+    Entries are keyed by the meal hash, the analyzer that produced them and the hashes
+    of the prompt and the knowledge base, so a change to any of those misses the cache.
+    """
+
+    _DEFAULT_MAX_ENTRIES = 10_000
+    _DEFAULT_MAX_AGE = timedelta(days=180)
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = _DEFAULT_MAX_ENTRIES,
+        max_age: timedelta = _DEFAULT_MAX_AGE,
+    ) -> None:
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._prompt_hash = md5(
+            (
+                BREAKDOWNS_FROM_MEALS
+                + BREAKDOWNS_KNOWLEDGE_BASE
+                + BREAKDOWNS_MEAL_DESCRIPTIONS
+            ).encode()
+        ).hexdigest()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS breakdowns ("
+            "key TEXT PRIMARY KEY, breakdown TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evict()
+
+    def make_key(
+        self, meal_hash: str, analyzer_name: str, knowledge_base: str | None
+    ) -> str:
+        kb_hash = md5((knowledge_base or "").encode()).hexdigest()
+        return f"{meal_hash}:{analyzer_name}:{self._prompt_hash}:{kb_hash}"
+
+    def get(self, key: str) -> NBreakdown | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT breakdown, created_at FROM breakdowns WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < time() - self._max_age.total_seconds():
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE breakdowns SET accessed_at = ? WHERE key = ?", (time(), key)
+            )
+            self._db.commit()
+            self.hits += 1
+        return NBreakdown.model_validate_json(row[0])
+
+    def put(self, key: str, breakdown: NBreakdown) -> None:
+        now = time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO breakdowns VALUES (?, ?, ?, ?)",
+                (key, breakdown.model_dump_json(), now, now),
+            )
+            self._db.commit()
+
+    def evict(self) -> int:
+        """Drop entries older than `max_age`, then the least recently used ones above `max_entries`."""
+        with self._lock:
+            evicted = self._db.execute(
+                "DELETE FROM breakdowns WHERE created_at < ?",
+                (time() - self._max_age.total_seconds(),),
+            ).rowcount
+            evicted += self._db.execute(
+                "DELETE FROM breakdowns WHERE key NOT IN "
+                "(SELECT key FROM breakdowns ORDER BY accessed_at DESC LIMIT ?)",
+                (self._max_entries,),
+            ).rowcount
+            self._db.commit()
+        return evicted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM breakdowns").fetchone()[0]
+
+    def close(self) -> None:
+        self.evict()
+        self._db.close()
@@ -0,0 +1,299 @@
+"""magentic chat models that cache the stable prompt prefix and report the cache usage.
+
+They only differ from the magentic ones (pinned in pyproject.toml) in how the system messages
+are sent, in the usage they record, see `PromptCacheUsage`, and in the HTTP client they use,
+see `HttpSettings`. They build on private magentic helpers and attributes,
+`test_the_magentic_internals_are_as_expected` fails when an upgrade changes them.
+"""
+
+from collections.abc import Callable, Iterable, Iterator
+from functools import cache
+from typing import Any, TypeVar, cast
+
+import anthropic
+import openai
+from anthropic.lib.streaming import MessageStream, MessageStreamEvent
+from magentic.chat_model.anthropic_chat_model import (
+    AnthropicChatModel,
+    AnthropicStreamParser,
+    AnthropicStreamState,
+    BaseFunctionToolSchema as AnthropicFunctionToolSchema,
+    _combine_messages,
+    _if_given as _anthropic_if_given,
+    message_to_anthropic_message,
+)
+from magentic.chat_model.base import OutputT, parse_stream
+from magentic.chat_model.function_schema import FunctionSchema, get_function_schemas
+from magentic.chat_model.message import AssistantMessage, Message, SystemMessage
+from magentic.chat_model.openai_chat_model import (
+    BaseFunctionToolSchema as OpenaiFunctionToolSchema,
+    OpenaiChatModel,
+    OpenaiStreamParser,
+    OpenaiStreamState,
+    _add_missing_tool_calls_responses,
+    _if_given as _openai_if_given,
+    message_to_openai_message,
+)
+from magentic.chat_model.stream import OutputStream
+from openai.types.chat import ChatCompletionChunk
+
+from .base import PromptCacheUsage
+from .clients import HttpSettings, get_http_client
+
+ToolSchemaT = TypeVar(
+    "ToolSchemaT", AnthropicFunctionToolSchema, OpenaiFunctionToolSchema
+)
+
+
+@cache
+def _get_tools(
+    tool_schema_type: type[ToolSchemaT],
+    functions: tuple[Callable[..., Any], ...],
+    output_types: tuple[type[Any], ...],
+) -> tuple[list[FunctionSchema[Any]], list[ToolSchemaT], list[dict[str, Any]]]:
+    """Generating the JSON schemas of the tools dominates the per-call setup, they're made once."""
+    function_schemas = list(get_function_schemas(functions, output_types))
+    tool_schemas = [tool_schema_type(schema) for schema in function_schemas]
+    return function_schemas, tool_schemas, [s.to_dict() for s in tool_schemas]
+
+
+def _closing(response: MessageStream) -> Iterator[MessageStreamEvent]:
+    """Closes the connection of an output stream that wasn't read to the end once it's collected."""
+    try:
+        yield from response
+    finally:
+        response.close()
+
+
+class _AnthropicStreamState(AnthropicStreamState):
+    def update(self, item: MessageStreamEvent) -> None:
+        if item.type == "message_stop":
+            # the partial usage is replaced by the final one
+            self.usage_ref.clear()
+        super().update(item)
+        if self._current_message_snapshot is None:
+            return
+        # the prompt tokens are known from the start of the message, the output tokens at its end
+        message = self._current_message_snapshot
+        self.usage_ref[:] = [
+            PromptCacheUsage(  # type: ignore
+                input_tokens=message.usage.input_tokens,
+                output_tokens=message.usage.output_tokens,
+                cache_read_input_tokens=message.usage.cache_read_input_tokens or 0,
+                cache_creation_input_tokens=message.usage.cache_creation_input_tokens
+                or 0,
+                is_truncated=message.stop_reason == "max_tokens",
+                is_partial=item.type != "message_stop",
+            )
+        ]
+
+
+class _OpenaiStreamState(OpenaiStreamState):
+    def __init__(self) -> None:
+        super().__init__()
+        self._is_truncated = False
+        self._is_finished = False
+
+    def update(self, item: ChatCompletionChunk) -> None:
+        super().update(item)
+        if item.choices and item.choices[0].finish_reason:
+            self._is_finished = True
+            self._is_truncated = item.choices[0].finish_reason == "length"
+        # the usage comes with or after the finish reason
+        if item.usage:
+            details = item.usage.prompt_tokens_details
+            self.usage_ref[-1] = PromptCacheUsage(  # type: ignore
+                input_tokens=item.usage.prompt_tokens,
+                output_tokens=item.usage.completion_tokens,
+                cache_read_input_tokens=(details and details.cached_tokens) or 0,
+                # OpenAI-compatible APIs cache prompt prefixes implicitly
+                cache_creation_input_tokens=0,
+                is_truncated=self._is_truncated,
+                # some APIs report the usage so far with every chunk
+                is_partial=not self._is_finished,
+            )
+
+
+class PromptCachingAnthropicChatModel(AnthropicChatModel):
+    """Sends every system message as a separate `cache_control` block.
+
+    The system messages (and the tools before them) must be the stable part of the prompt,
+    each of them ends a prefix Anthropic caches; at most 4 are allowed.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        max_tokens: int = 1024,
+        temperature: float | None = None,
+        http_settings: HttpSettings | None = None,
+    ) -> None:
+        # magentic's __init__ would build a sync and an async client of its own, only the
+        # pooled sync one is needed: its attributes are set here instead (the async API isn't used)
+        self._model = model
+        self._api_key = api_key
+        self._base_url = base_url
+        self._max_tokens = max_tokens
+        self._temperature = temperature
+        http_settings = http_settings or HttpSettings()
+        self._client = anthropic.Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=http_settings.timeout,
+            max_retries=http_settings.max_retries,
+            http_client=get_http_client("anthropic", http_settings),
+        )
+
+    def complete(
+        self,
+        messages: Iterable[Message[Any]],
+        functions: Iterable[Callable[..., Any]] | None = None,
+        output_types: Iterable[type[OutputT]] | None = None,
+        *,
+        stop: list[str] | None = None,
+    ) -> AssistantMessage[OutputT]:
+        message, _ = self.stream(messages, functions, output_types, stop=stop)
+        return message
+
+    def stream(
+        self,
+        messages: Iterable[Message[Any]],
+        functions: Iterable[Callable[..., Any]] | None = None,
+        output_types: Iterable[type[OutputT]] | None = None,
+        *,
+        stop: list[str] | None = None,
+    ) -> tuple[AssistantMessage[OutputT], Callable[[], None]]:
+        """Like `complete`, plus a function that closes the response, from any thread."""
+        if output_types is None:
+            output_types = [] if functions else cast(list[type[OutputT]], [str])
+
+        function_schemas, tool_schemas, tools = _get_tools(
+            AnthropicFunctionToolSchema, tuple(functions or ()), tuple(output_types)
+        )
+        messages = list(messages)
+        system = [
+            {"type": "text", "text": m.content, "cache_control": {"type": "ephemeral"}}
+            for m in messages
+            if isinstance(m, SystemMessage) and m.content.strip()
+        ]
+        response = self._client.messages.stream(
+            model=self.model,
+            messages=_combine_messages(
+                [
+                    message_to_anthropic_message(m)
+                    for m in messages
+                    if not isinstance(m, SystemMessage)
+                ]
+            ),
+            max_tokens=self.max_tokens,
+            stop_sequences=_anthropic_if_given(stop),
+            system=system or anthropic.NOT_GIVEN,  # type: ignore[arg-type]
+            temperature=_anthropic_if_given(self.temperature),
+            tools=tools or anthropic.NOT_GIVEN,
+            tool_choice=self._get_tool_choice(
+                tool_schemas=tool_schemas, output_types=output_types
+            ),
+        ).__enter__()
+        stream = OutputStream(
+            _closing(response),
+            function_schemas=function_schemas,
+            parser=AnthropicStreamParser(),
+            state=_AnthropicStreamState(),
+        )
+        message = AssistantMessage._with_usage(
+            parse_stream(stream, output_types), usage_ref=stream.usage_ref
+        )
+        return message, response.close
+
+
+class PromptCachingOpenaiChatModel(OpenaiChatModel):
+    """Reports the prompt tokens an OpenAI-compatible API served from its prefix cache."""
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        max_tokens: int | None = None,
+        seed: int | None = None,
+        temperature: float | None = None,
+        http_settings: HttpSettings | None = None,
+    ) -> None:
+        # like PromptCachingAnthropicChatModel, only the pooled sync client is built
+        self._model = model
+        self._api_key = api_key
+        self._api_type = "openai"
+        self._base_url = base_url
+        self._max_tokens = max_tokens
+        self._seed = seed
+        self._temperature = temperature
+        http_settings = http_settings or HttpSettings()
+        self._client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=http_settings.timeout,
+            max_retries=http_settings.max_retries,
+            http_client=get_http_client("openai", http_settings),
+        )
+
+    def complete(
+        self,
+        messages: Iterable[Message[Any]],
+        functions: Iterable[Callable[..., Any]] | None = None,
+        output_types: Iterable[type[OutputT]] | None = None,
+        *,
+        stop: list[str] | None = None,
+    ) -> AssistantMessage[OutputT]:
+        message, _ = self.stream(messages, functions, output_types, stop=stop)
+        return message
+
+    def stream(
+        self,
+        messages: Iterable[Message[Any]],
+        functions: Iterable[Callable[..., Any]] | None = None,
+        output_types: Iterable[type[OutputT]] | None = None,
+        *,
+        stop: list[str] | None = None,
+    ) -> tuple[AssistantMessage[OutputT], Callable[[], None]]:
+        """Like `complete`, plus a function that closes the response, from any thread."""
+        if output_types is None:
+            output_types = cast(Iterable[type[OutputT]], [] if functions else [str])
+
+        function_schemas, tool_schemas, tools = _get_tools(
+            OpenaiFunctionToolSchema, tuple(functions or ()), tuple(output_types)
+        )
+        response: openai.Stream[ChatCompletionChunk] = (
+            self._client.chat.completions.create(
+                model=self.model,
+                messages=_add_missing_tool_calls_responses(
+                    [message_to_openai_message(m) for m in messages]
+                ),
+                max_tokens=_openai_if_given(self.max_tokens),
+                seed=_openai_if_given(self.seed),
+                stop=_openai_if_given(stop),
+                stream=True,
+                stream_options=self._get_stream_options(),
+                temperature=_openai_if_given(self.temperature),
+                tools=tools or openai.NOT_GIVEN,
+                tool_choice=self._get_tool_choice(
+                    tool_schemas=tool_schemas, output_types=output_types
+                ),
+                parallel_tool_calls=self._get_parallel_tool_calls(
+                    tools_specified=bool(tool_schemas), output_types=output_types
+                ),
+            )
+        )
+        stream = OutputStream(
+            response,
+            function_schemas=function_schemas,
+            parser=OpenaiStreamParser(),
+            state=_OpenaiStreamState(),
+        )
+        message = AssistantMessage._with_usage(
+            parse_stream(stream, output_types), usage_ref=stream.usage_ref
+        )
+        return message, response.close
@@ -0,0 +1,47 @@
+"""The HTTP settings of the provider APIs and one pooled connection per provider.
+
+httpx is imported on first use, like the provider SDKs.
+"""
+
+from functools import cache
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel, ConfigDict
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class HttpSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    connect_timeout_s: float = 5.0
+    # between two chunks of a streamed response, not for the whole response
+    read_timeout_s: float = 60.0
+    # on connection errors, 408/409/429 and 5xx; the SDKs back off exponentially from 0.5s
+    # to 8s with jitter, or as long as the retry-after header says
+    max_retries: int = 4
+    max_connections: int = 16
+    keepalive_expiry_s: float = 60.0
+
+    @property
+    def timeout(self) -> "httpx.Timeout":
+        import httpx
+
+        return httpx.Timeout(self.read_timeout_s, connect=self.connect_timeout_s)
+
+
+@cache
+def get_http_client(provider: str, settings: HttpSettings) -> "httpx.Client":
+    """Shared by all the analyzers of the provider, so calls reuse its kept-alive TLS connections."""
+    import httpx
+
+    return httpx.Client(
+        timeout=settings.timeout,
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_connections,
+            keepalive_expiry=settings.keepalive_expiry_s,
+        ),
+        follow_redirects=True,
+    )
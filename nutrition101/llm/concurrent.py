@@ -0,0 +1,70 @@
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from nutrition101.domain import NBreakdown
+
+from .batching import BatchRetryStats, K, MealBatch, get_batch_breakdowns
+from .knowledge_base import KnowledgeBase
+from .base import ILLMAnalyzer, TokenUsage
+
+
+class ConcurrentNAnalyzer(ILLMAnalyzer):
+    """Dispatches a wrapped analyzer's calls on a thread pool of at most `max_concurrency` workers."""
+
+    def __init__(self, analyzer: ILLMAnalyzer, max_concurrency: int) -> None:
+        assert max_concurrency >= 1, "max_concurrency must be a positive number"
+        self._analyzer = analyzer
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="n101-analyzer"
+        )
+
+    @property
+    def name(self) -> str:
+        return self._analyzer.name
+
+    @property
+    def max_tokens(self) -> int | None:
+        return self._analyzer.max_tokens
+
+    @property
+    def usage(self) -> TokenUsage | None:
+        return self._analyzer.usage
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        return self.submit(meal_descriptions, knowledge_base_section).result()
+
+    def submit(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> Future[list[NBreakdown]]:
+        return self._executor.submit(
+            self._analyzer.get_meal_breakdowns,
+            meal_descriptions,
+            knowledge_base_section,
+        )
+
+    def submit_batch(
+        self,
+        batch: MealBatch[K],
+        knowledge_base: KnowledgeBase,
+        stats: BatchRetryStats | None = None,
+        on_breakdown: Callable[[K, NBreakdown], None] | None = None,
+    ) -> Future[list[tuple[K, NBreakdown]]]:
+        return self._executor.submit(
+            get_batch_breakdowns,
+            self._analyzer,
+            batch,
+            knowledge_base,
+            stats,
+            on_breakdown,
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "ConcurrentNAnalyzer":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
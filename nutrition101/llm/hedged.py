@@ -0,0 +1,237 @@
+import math
+import threading
+from collections import Counter, deque
+from collections.abc import Callable, Generator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from time import perf_counter
+
+from nutrition101.domain import NBreakdown
+
+from .base import Cancellation, CancelledCallError, ILLMAnalyzer, use_cancellation
+
+
+class HedgeStats:
+    """How many calls were hedged or fell back to the secondary analyzer, and who won them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged_calls = 0
+        self.fallbacks = 0
+        self.wins: Counter[str] = Counter()
+
+    def record(self, winner: str | None, is_hedged: bool, is_fallback: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.hedged_calls += is_hedged
+            self.fallbacks += is_fallback
+            if winner is not None:
+                self.wins[winner] += 1
+
+
+class _LatencyWindow:
+    """The latencies of the last calls of the primary analyzer."""
+
+    def __init__(self, size: int) -> None:
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=size)
+
+    def add(self, latency_s: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_s)
+
+    def get_quantile(self, quantile: float, min_samples: int) -> float | None:
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[math.ceil(quantile * len(latencies)) - 1]
+
+
+class HedgedAnalyzer(ILLMAnalyzer):
+    """Asks the secondary analyzer too when the primary one is slow or fails.
+
+    The secondary gets the same call once the primary has been running for longer than
+    `hedge_after_s`, by default the p90 of the primary's recent latencies. It gets it right
+    away when the primary fails or returns a wrong number of breakdowns. The first response
+    with a breakdown for every meal wins; the other analyzer's call is cancelled, a streaming
+    one's response is closed. When neither has one, the primary's response (or error) is
+    returned.
+
+    The calls of both analyzers run on a pool of two threads per concurrent call, up to
+    `max_concurrency` calls; it's shut down by `close`.
+    """
+
+    _DEFAULT_HEDGE_AFTER_S = 30.0
+    _DEFAULT_MAX_CONCURRENCY = 4
+    _HEDGE_QUANTILE = 0.9
+    _MIN_SAMPLES = 10
+    _WINDOW = 100
+
+    def __init__(
+        self,
+        primary: ILLMAnalyzer,
+        secondary: ILLMAnalyzer,
+        hedge_after_s: float | None = None,
+        max_concurrency: int = _DEFAULT_MAX_CONCURRENCY,
+        _latencies: _LatencyWindow | None = None,
+        _executor: ThreadPoolExecutor | None = None,
+    ) -> None:
+        assert max_concurrency >= 1, "max_concurrency must be a positive number"
+        self._primary = primary
+        self._secondary = secondary
+        self._hedge_after_s = hedge_after_s
+        self._max_concurrency = max_concurrency
+        self._latencies = _latencies or _LatencyWindow(self._WINDOW)
+        # the copies made by `with_analyzers` share the pool of the analyzer they're made of
+        self._is_executor_owned = _executor is None
+        self._executor = _executor or ThreadPoolExecutor(
+            max_workers=2 * max_concurrency, thread_name_prefix="n101-hedge"
+        )
+        self.stats = HedgeStats()
+
+    @property
+    def name(self) -> str:
+        return f"hedged:{self._primary.name},{self._secondary.name}"
+
+    @property
+    def max_tokens(self) -> int | None:
+        max_tokens = [
+            m
+            for m in (self._primary.max_tokens, self._secondary.max_tokens)
+            if m is not None
+        ]
+        return min(max_tokens) if max_tokens else None
+
+    def with_analyzers(
+        self, wrap: Callable[[ILLMAnalyzer], ILLMAnalyzer]
+    ) -> "HedgedAnalyzer":
+        """The same hedging over wrapped analyzers (e.g. metered ones), with its own stats."""
+        return HedgedAnalyzer(
+            wrap(self._primary),
+            wrap(self._secondary),
+            self._hedge_after_s,
+            self._max_concurrency,
+            _latencies=self._latencies,
+            _executor=self._executor,
+        )
+
+    def get_stats(self) -> dict[str, int]:
+        if not self.stats.calls:
+            return {}
+        return {
+            "hedged_calls": self.stats.hedged_calls,
+            "hedge_fallbacks": self.stats.fallbacks,
+            **{f"wins:{name}": wins for name, wins in self.stats.wins.items()},
+        }
+
+    def close(self) -> None:
+        if self._is_executor_owned:
+            # a cancelled call still waiting for its response ends at the read timeout
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_hedge_after_s(self) -> float:
+        if self._hedge_after_s is not None:
+            return self._hedge_after_s
+        observed = self._latencies.get_quantile(self._HEDGE_QUANTILE, self._MIN_SAMPLES)
+        return self._DEFAULT_HEDGE_AFTER_S if observed is None else observed
+
+    @staticmethod
+    def _call(
+        analyzer: ILLMAnalyzer,
+        meal_descriptions: list[str],
+        knowledge_base_section: str | None,
+        cancellation: Cancellation,
+    ) -> list[NBreakdown]:
+        breakdowns = []
+        stream = analyzer.iter_meal_breakdowns(
+            meal_descriptions, knowledge_base_section
+        )
+        try:
+            for breakdown in stream:
+                # analyzers that don't stream are only stopped once they've answered
+                if cancellation.is_cancelled:
+                    raise CancelledCallError()
+                breakdowns.append(breakdown)
+        finally:
+            if isinstance(stream, Generator):
+                stream.close()
+        return breakdowns
+
+    def _submit(
+        self,
+        analyzer: ILLMAnalyzer,
+        meal_descriptions: list[str],
+        knowledge_base_section: str | None,
+        cancellation: Cancellation,
+    ) -> Future[list[NBreakdown]]:
+        def run() -> list[NBreakdown]:
+            # a streaming analyzer closes its response when the call is cancelled
+            with use_cancellation(cancellation):
+                return self._call(
+                    analyzer, meal_descriptions, knowledge_base_section, cancellation
+                )
+
+        return self._executor.submit(run)
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        cancellation = Cancellation()
+        start = perf_counter()
+        hedge_at = start + self.get_hedge_after_s()
+        futures = {
+            self._submit(
+                self._primary, meal_descriptions, knowledge_base_section, cancellation
+            ): self._primary
+        }
+        is_hedged = is_fallback = False
+        results: dict[ILLMAnalyzer, list[NBreakdown] | BaseException] = {}
+        try:
+            while futures:
+                timeout = None
+                if not (is_hedged or is_fallback):
+                    timeout = max(hedge_at - perf_counter(), 0)
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    analyzer = futures.pop(future)
+                    if (error := future.exception()) is not None:
+                        results[analyzer] = error
+                        continue
+                    breakdowns = future.result()
+                    results[analyzer] = breakdowns
+                    if analyzer is self._primary:
+                        self._latencies.add(perf_counter() - start)
+                    if len(breakdowns) == len(meal_descriptions):
+                        if is_hedged and self._primary not in results:
+                            # the primary took at least this long
+                            self._latencies.add(perf_counter() - start)
+                        self.stats.record(analyzer.name, is_hedged, is_fallback)
+                        return breakdowns
+                if not (is_hedged or is_fallback):
+                    if done:
+                        is_fallback = True
+                    else:
+                        is_hedged = True
+                    futures[
+                        self._submit(
+                            self._secondary,
+                            meal_descriptions,
+                            knowledge_base_section,
+                            cancellation,
+                        )
+                    ] = self._secondary
+        finally:
+            for future in futures:
+                # still waiting for a thread of the pool
+                future.cancel()
+            cancellation.cancel()
+
+        self.stats.record(None, is_hedged, is_fallback)
+        result = results[self._primary]
+        if isinstance(result, BaseException):
+            secondary_result = results[self._secondary]
+            if isinstance(secondary_result, BaseException):
+                raise result
+            return secondary_result
+        return result
@@ -0,0 +1,149 @@
+import re
+from collections.abc import Iterable
+
+from pydantic import BaseModel
+
+_RECIPE_TITLE = re.compile(
+    r"^\s*(?:(?P<level>#{1,6})\s+(?P<heading>.+?)\s*#*|==(?P<marked>[^=]+)==)\s*$"
+)
+_RECIPE_ALIASES = re.compile(r"^\s*aliases?\s*:\s*(?P<aliases>.+)$", re.IGNORECASE)
+
+
+class Recipe(BaseModel):
+    name: str
+    aliases: list[str]
+    content: str
+
+    def get_pattern(self) -> re.Pattern:
+        names = "|".join(
+            r"\s+".join(re.escape(word) for word in name.split())
+            for name in [self.name, *self.aliases]
+        )
+        return re.compile(rf"\b(?:{names})\b", re.IGNORECASE)
+
+
+class KnowledgeBase:
+    """An index of the named recipes in knowledge_base.md.
+
+    A recipe starts at a markdown heading of the recipe titles' level (or a `==name==` marker)
+    and may list its other names on an `aliases: a, b` line; deeper headings, like
+    `### Ingredients`, are a part of the recipe. Headings without text of their own that group
+    other recipes, or the single heading the knowledge base starts with (`# Recipes`), aren't
+    recipes. Only the latest recipe with a given name is kept, with the aliases of all of them.
+    A knowledge base without any recipes isn't indexed and is always sent whole.
+    """
+
+    def __init__(self, content: str) -> None:
+        self._content = content
+        preamble, recipes = self._parse_recipes(content)
+        self._preamble = preamble
+        latest_recipes: dict[str, Recipe] = {}
+        for recipe in recipes:
+            if (
+                duplicate := latest_recipes.pop(recipe.name.casefold(), None)
+            ) is not None:
+                aliases = [*duplicate.aliases, *recipe.aliases]
+                recipe = recipe.model_copy(
+                    update={"aliases": list(dict.fromkeys(aliases))}
+                )
+            # ordered by the latest recipe with the name
+            latest_recipes[recipe.name.casefold()] = recipe
+        self.recipes = list(latest_recipes.values())
+        self._patterns = [r.get_pattern() for r in self.recipes]
+
+    @property
+    def is_indexed(self) -> bool:
+        return bool(self.recipes)
+
+    @staticmethod
+    def _get_recipe_level(lines: list[str]) -> int | None:
+        """The level of the headings that are recipe titles, if any of them are."""
+        # the level of every heading, and whether it has text of its own
+        headings: list[tuple[int, bool]] = []
+        for line in lines:
+            title_match = _RECIPE_TITLE.match(line)
+            if title_match and title_match["level"]:
+                headings.append((len(title_match["level"]), False))
+            elif title_match:
+                # a marked recipe ends the text of the heading before it
+                headings.append((0, True))
+            elif headings and line.strip():
+                headings[-1] = (headings[-1][0], True)
+
+        def is_group(idx: int) -> bool:
+            level, has_text = headings[idx]
+            if has_text:
+                return False
+            section_levels = set()
+            for sub_level, _ in headings[idx + 1 :]:
+                if sub_level <= level:
+                    break
+                section_levels.add(sub_level)
+            if len(section_levels) > 1:
+                # it has recipes with headings of their own
+                return True
+            # the title of the knowledge base
+            levels = [level for level, _ in headings if level]
+            return idx == 0 and levels.count(level) == 1 and level == min(levels)
+
+        return min(
+            (
+                level
+                for idx, (level, _) in enumerate(headings)
+                if level and not is_group(idx)
+            ),
+            default=None,
+        )
+
+    @classmethod
+    def _parse_recipes(cls, content: str) -> tuple[str, list[Recipe]]:
+        content_lines = content.splitlines()
+        recipe_level = cls._get_recipe_level(content_lines)
+        preamble: list[str] = []
+        recipes: list[Recipe] = []
+        name, aliases, lines = None, [], preamble
+        for line in content_lines:
+            title_match = _RECIPE_TITLE.match(line)
+            level = len(title_match["level"] or "") if title_match else None
+            if level and recipe_level and level > recipe_level:
+                # a part of the recipe, like its ingredients
+                title_match = None
+            if title_match:
+                if name:
+                    recipes.append(
+                        Recipe(name=name, aliases=aliases, content="\n".join(lines))
+                    )
+                name, aliases, lines = None, [], []
+                if level and level != recipe_level:
+                    # a heading grouping the recipes
+                    continue
+                name = (title_match["heading"] or title_match["marked"]).strip()
+                lines = [line]
+                continue
+            aliases_match = _RECIPE_ALIASES.match(line)
+            if name and aliases_match:
+                aliases.extend(
+                    a.strip() for a in aliases_match["aliases"].split(",") if a.strip()
+                )
+            lines.append(line)
+        if name:
+            recipes.append(Recipe(name=name, aliases=aliases, content="\n".join(lines)))
+        return "\n".join(preamble).strip(), recipes
+
+    def match(self, meal_descriptions: Iterable[str]) -> list[Recipe]:
+        """Returns recipes whose name or aliases are mentioned in the meal descriptions."""
+        descriptions = "|||".join(meal_descriptions)
+        return [
+            recipe
+            for recipe, pattern in zip(self.recipes, self._patterns)
+            if pattern.search(descriptions)
+        ]
+
+    def get_section(self, meal_descriptions: Iterable[str]) -> str:
+        if not self.is_indexed:
+            return self._content
+        recipes = [r.content.strip() for r in self.match(meal_descriptions)]
+        return "\n\n".join(s for s in [self._preamble, *recipes] if s)
+
+    def __str__(self) -> str:
+        return self._content
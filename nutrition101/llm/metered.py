@@ -0,0 +1,86 @@
+from collections.abc import Generator, Iterator
+from time import perf_counter
+
+from nutrition101.domain import NBreakdown
+from nutrition101.metrics import AnalyzerCall, RunMetrics
+
+from .base import CancelledCallError, ILLMAnalyzer, PromptCacheUsage, TokenUsage
+
+
+class MeteredAnalyzer(ILLMAnalyzer):
+    """Records the latency, the outcome and the tokens of every call of a wrapped analyzer."""
+
+    def __init__(self, analyzer: ILLMAnalyzer, metrics: RunMetrics) -> None:
+        self._analyzer = analyzer
+        self._metrics = metrics
+
+    @property
+    def name(self) -> str:
+        return self._analyzer.name
+
+    @property
+    def max_tokens(self) -> int | None:
+        return self._analyzer.max_tokens
+
+    @property
+    def usage(self) -> TokenUsage | None:
+        return self._analyzer.usage
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        return list(
+            self.iter_meal_breakdowns(meal_descriptions, knowledge_base_section)
+        )
+
+    def iter_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> Iterator[NBreakdown]:
+        usage = self._analyzer.usage
+        last_usage = usage and usage.get_last()
+        outcome = "ok"
+        breakdowns = 0
+        start = perf_counter()
+        stream = self._analyzer.iter_meal_breakdowns(
+            meal_descriptions, knowledge_base_section
+        )
+        try:
+            for breakdown in stream:
+                breakdowns += 1
+                yield breakdown
+            if breakdowns != len(meal_descriptions):
+                outcome = "wrong count"
+        except (GeneratorExit, CancelledCallError):
+            # the caller stopped reading, e.g. another analyzer answered first
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if isinstance(stream, Generator):
+                # a stopped stream records its usage once it's closed
+                stream.close()
+            call = AnalyzerCall(
+                analyzer=self.name,
+                meals=len(meal_descriptions),
+                latency_s=perf_counter() - start,
+                outcome=outcome,
+            )
+            call_usage = usage and usage.get_last()
+            if call_usage is last_usage:
+                # a failed call may not have recorded any usage
+                call_usage = None
+            # a cancelled call's usage is what was reported before it stopped, if anything
+            call.is_usage_partial = outcome == "cancelled" and (
+                not isinstance(call_usage, PromptCacheUsage) or call_usage.is_partial
+            )
+            if call_usage is not None:
+                call.input_tokens = call_usage.input_tokens
+                call.output_tokens = call_usage.output_tokens
+                if isinstance(call_usage, PromptCacheUsage):
+                    call.cache_read_input_tokens = call_usage.cache_read_input_tokens
+                    call.cache_creation_input_tokens = (
+                        call_usage.cache_creation_input_tokens
+                    )
+            self._metrics.record_call(call)
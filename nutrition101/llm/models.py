@@ -1,62 +1,180 @@
-from abc import ABCMeta, abstractmethod
+from collections.abc import Iterable, Iterator
 
-from magentic import prompt, OpenaiChatModel
-from magentic.chat_model.anthropic_chat_model import AnthropicChatModel
+from magentic import SystemMessage, UserMessage
+from magentic.chat_model.base import ToolSchemaParseError
+from magentic.chat_model.message import Message
+from pydantic import ValidationError
 
 from nutrition101.domain import NBreakdown
 
-from .prompts import BREAKDOWNS_FROM_MEALS
+from .base import (
+    CancelledCallError,
+    ILLMAnalyzer,
+    IncompleteOutputError,
+    PromptCacheUsage,
+    TokenUsage,
+    get_cancellation,
+)
+from .clients import HttpSettings
+from .chat_models import (
+    PromptCachingAnthropicChatModel,
+    PromptCachingOpenaiChatModel,
+)
+from .prompts import (
+    BREAKDOWNS_FROM_MEALS,
+    BREAKDOWNS_KNOWLEDGE_BASE,
+    BREAKDOWNS_MEAL_DESCRIPTIONS,
+)
 
 
-class ILLMAnalyzer(metaclass=ABCMeta):
-    @abstractmethod
-    def get_meal_breakdowns(
-        self, meal_descriptions: list[str], knowledge_base_section: str | None
-    ) -> list[NBreakdown]: ...
+_INSTRUCTIONS = SystemMessage(BREAKDOWNS_FROM_MEALS)
+
+
+def get_breakdowns_messages(
+    meal_descriptions: list[str], knowledge_base_section: str | None
+) -> list[Message]:
+    """The instructions and the knowledge base go first as the stable, cacheable prefix."""
+    return [
+        _INSTRUCTIONS,
+        SystemMessage(
+            BREAKDOWNS_KNOWLEDGE_BASE.format(
+                knowledge_base_section=knowledge_base_section or ""
+            )
+        ),
+        UserMessage(
+            BREAKDOWNS_MEAL_DESCRIPTIONS.format(
+                meal_descriptions="|||".join(meal_descriptions)
+            )
+        ),
+    ]
+
+
+def stream_breakdowns(
+    model: PromptCachingAnthropicChatModel | PromptCachingOpenaiChatModel,
+    usage: TokenUsage,
+    meal_descriptions: list[str],
+    knowledge_base_section: str | None,
+) -> Iterator[NBreakdown]:
+    """Each breakdown is validated and yielded as soon as its JSON object has been received.
+
+    The response is closed when the caller stops reading or the call is cancelled, see
+    `Cancellation`; the usage received by then is recorded either way.
+    """
+    message, close = model.stream(
+        get_breakdowns_messages(meal_descriptions, knowledge_base_section),
+        output_types=[Iterable[NBreakdown]],
+    )
+    cancellation = get_cancellation()
+    if cancellation is not None:
+        cancellation.register(close)
+    try:
+        yield from message.content
+    except Exception as e:
+        if cancellation is not None and cancellation.is_cancelled:
+            raise CancelledCallError() from e
+        if isinstance(e, ToolSchemaParseError | ValidationError):
+            raise IncompleteOutputError(str(e)) from e
+        raise
+    finally:
+        close()
+        usage.record(message.usage)
+    # the streamed array silently ends at the last complete breakdown
+    if isinstance(message.usage, PromptCacheUsage) and message.usage.is_truncated:
+        raise IncompleteOutputError("The output was cut off at max tokens.")
 
 
 class ClaudeNAnalyzer(ILLMAnalyzer):
     _DEFAULT_MODEL = "claude-3-7-sonnet-latest"
     _MAX_TOKENS = 8192
 
-    def __init__(self, api_key: str, model: str = _DEFAULT_MODEL) -> None:
-        self._model = AnthropicChatModel(
-            model=model, api_key=api_key, max_tokens=self._MAX_TOKENS
+    def __init__(
+        self,
+        api_key: str,
+        model: str = _DEFAULT_MODEL,
+        base_url: str | None = None,
+        http_settings: HttpSettings | None = None,
+    ) -> None:
+        self._model_name = model
+        self._model = PromptCachingAnthropicChatModel(
+            model=model,
+            api_key=api_key,
+            max_tokens=self._MAX_TOKENS,
+            base_url=base_url,
+            http_settings=http_settings,
         )
+        self._usage = TokenUsage()
+
+    @property
+    def name(self) -> str:
+        return f"claude:{self._model_name}"
+
+    @property
+    def max_tokens(self) -> int:
+        return self._MAX_TOKENS
+
+    @property
+    def usage(self) -> TokenUsage:
+        return self._usage
 
     def get_meal_breakdowns(
         self, meal_descriptions: list[str], knowledge_base_section: str | None
     ) -> list[NBreakdown]:
-        @prompt(BREAKDOWNS_FROM_MEALS, model=self._model)
-        def _get_breakdowns(
-            meal_descriptions, knowledge_base_section
-        ) -> list[NBreakdown]: ...
+        return list(
+            self.iter_meal_breakdowns(meal_descriptions, knowledge_base_section)
+        )
 
-        return _get_breakdowns(
-            "|||".join(meal_descriptions), knowledge_base_section or ""
+    def iter_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> Iterator[NBreakdown]:
+        return stream_breakdowns(
+            self._model, self._usage, meal_descriptions, knowledge_base_section
         )
 
 
 class GrokAnalyzer(ILLMAnalyzer):
     _DEFAULT_MODEL = "grok-3"
+    _DEFAULT_BASE_URL = "https://api.x.ai/v1"
     _MAX_TOKENS = 8192
 
-    def __init__(self, api_key: str, model: str = _DEFAULT_MODEL) -> None:
-        self._model = OpenaiChatModel(
+    def __init__(
+        self,
+        api_key: str,
+        model: str = _DEFAULT_MODEL,
+        base_url: str = _DEFAULT_BASE_URL,
+        http_settings: HttpSettings | None = None,
+    ) -> None:
+        self._model_name = model
+        self._model = PromptCachingOpenaiChatModel(
             model=model,
             api_key=api_key,
             max_tokens=self._MAX_TOKENS,
-            base_url="https://api.x.ai/v1",
+            base_url=base_url,
+            http_settings=http_settings,
         )
+        self._usage = TokenUsage()
+
+    @property
+    def name(self) -> str:
+        return f"grok:{self._model_name}"
+
+    @property
+    def max_tokens(self) -> int:
+        return self._MAX_TOKENS
+
+    @property
+    def usage(self) -> TokenUsage:
+        return self._usage
 
     def get_meal_breakdowns(
         self, meal_descriptions: list[str], knowledge_base_section: str | None
     ) -> list[NBreakdown]:
-        @prompt(BREAKDOWNS_FROM_MEALS, model=self._model)
-        def _get_breakdowns(
-            meal_descriptions, knowledge_base_section
-        ) -> list[NBreakdown]: ...
+        return list(
+            self.iter_meal_breakdowns(meal_descriptions, knowledge_base_section)
+        )
 
-        return _get_breakdowns(
-            "|||".join(meal_descriptions), knowledge_base_section or ""
+    def iter_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> Iterator[NBreakdown]:
+        return stream_breakdowns(
+            self._model, self._usage, meal_descriptions, knowledge_base_section
         )
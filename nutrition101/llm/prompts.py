@@ -1,13 +1,11 @@
+# The prompt is split so that everything but the meal descriptions is a stable prefix
+# the providers can cache: the instructions, then the knowledge base, then the meals.
 BREAKDOWNS_FROM_MEALS = """Analyze this meal descriptions and break them down into individual food items with their nutritional values. 
 Return total sugars in sugars_g field; the field added_sugars_g is only for added/free sugar. added_sugars_g is always <= sugars_g. 
 
 Meal descriptions are separated ONLY by '|||'. For example, `1 1/4 (by volume) cooked pinto beans, 3/4 (by volume) cooked rice, 1 Costco rotisserie chicken thigh, 1 tomatoe.
 1/6 zapekanka. 7 dried date, 4 dried figs.` is a SINGLE meal description, despite it having new lines and `.` in its content.
 
-    Meal Descriptions: {meal_descriptions}
-
-    Knowledge base: {knowledge_base_section}
-
     Return Format:
     You must return a list of NBreakdown objects. Each NBreakdown contains a list of NEntry objects with this exact schema:
     
@@ -56,3 +54,7 @@ Meal descriptions are separated ONLY by '|||'. For example, `1 1/4 (by volume) c
     - All values should be integers (no units in the values)
     - If a nutrient value is negligible, use 0
     - Set used_knowledge_base=true only when you actually used a Knowledge Base recipe for that specific item"""
+
+BREAKDOWNS_KNOWLEDGE_BASE = """Knowledge base: {knowledge_base_section}"""
+
+BREAKDOWNS_MEAL_DESCRIPTIONS = """Meal Descriptions: {meal_descriptions}"""
@@ -0,0 +1,197 @@
+import random
+import re
+import sqlite3
+import threading
+from array import array
+from collections.abc import Iterable
+from hashlib import blake2b, md5
+from itertools import pairwise
+from typing import NamedTuple
+
+from nutrition101.domain import NBreakdown
+
+_TOKENS = re.compile(r"\d+(?:[./]\d+)?|[^\W\d_]+")
+_NUMBER = re.compile(r"\d")
+# words that join the foods of a description without changing what was eaten
+_STOPWORDS = frozenset(
+    {"a", "an", "and", "the", "of", "with", "wi", "w", "some", "plus"}
+)
+# the MinHash permutations are modulo a Mersenne prime, the signatures fit into 64 bits
+_PRIME = (1 << 61) - 1
+
+
+def get_canonical_tokens(description: str) -> list[str]:
+    """Case, punctuation, whitespace and line breaks don't make a meal a different one."""
+    return _TOKENS.findall(description.lower())
+
+
+def get_shingles(tokens: list[str]) -> set[str]:
+    """The words and the pairs of adjacent words, so that reordered items aren't identical."""
+    return set(tokens) | {f"{a} {b}" for a, b in pairwise(tokens)}
+
+
+def get_content_tokens(tokens: list[str]) -> list[str]:
+    """The foods of a description with their quantities; meals that differ in them aren't similar."""
+    content_tokens: list[str] = []
+    for token in tokens:
+        if token in _STOPWORDS:
+            continue
+        if content_tokens and _NUMBER.match(content_tokens[-1][-1]):
+            # a quantity goes with the word after it, "2 eggs, 3 plums" isn't "3 eggs, 2 plums"
+            content_tokens[-1] += f" {token}"
+        else:
+            content_tokens.append(token)
+    return sorted(content_tokens)
+
+
+def get_jaccard_similarity(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class SimilarMeal(NamedTuple):
+    # canonical tokens of the past meal
+    description: str
+    similarity: float
+    breakdown: NBreakdown
+
+
+class MealIndex:
+    """Breakdowns of past meals, looked up by a near-identical description.
+
+    Descriptions are compared by their canonical tokens. They must have the same foods and
+    quantities, only the joining words and the order may differ: "2 eggs" isn't "3 eggs", and
+    "black coffee" isn't "black coffee with butter". Among those, the Jaccard similarity of
+    their shingles decides; MinHash signatures banded into LSH buckets find the candidates
+    without comparing against every meal.
+    """
+
+    _PERMUTATIONS = 64
+    # 16 bands of 4 rows make meals with a similarity above ~0.5 likely candidates
+    _BANDS = 16
+    _DEFAULT_THRESHOLD = 0.9
+
+    def __init__(self, path: str, threshold: float = _DEFAULT_THRESHOLD) -> None:
+        assert 0 < threshold <= 1, "The similarity threshold must be in (0, 1]"
+        self._threshold = threshold
+        rnd = random.Random(101)
+        self._permutations = [
+            (rnd.randrange(1, _PRIME), rnd.randrange(_PRIME))
+            for _ in range(self._PERMUTATIONS)
+        ]
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meals ("
+            "key TEXT PRIMARY KEY, tokens TEXT NOT NULL, "
+            "signature BLOB NOT NULL, breakdown TEXT NOT NULL)"
+        )
+        self._db.commit()
+        # the signatures and the buckets are kept in memory, the breakdowns are read on a hit
+        self._tokens: dict[str, list[str]] = {}
+        self._buckets: dict[tuple[int, ...], list[str]] = {}
+        for key, tokens, signature in self._db.execute(
+            "SELECT key, tokens, signature FROM meals"
+        ):
+            self._index(key, tokens.split(), list(array("Q", signature)))
+        self.hits = 0
+        self.misses = 0
+
+    def _get_signature(self, shingles: set[str]) -> list[int]:
+        hashes = [
+            int.from_bytes(blake2b(s.encode(), digest_size=8).digest())
+            for s in shingles
+        ]
+        return [
+            min(((a * h + b) % _PRIME for h in hashes), default=0)
+            for a, b in self._permutations
+        ]
+
+    def _get_bands(self, signature: list[int]) -> list[tuple[int, ...]]:
+        rows = self._PERMUTATIONS // self._BANDS
+        return [
+            (band, *signature[band * rows : (band + 1) * rows])
+            for band in range(self._BANDS)
+        ]
+
+    def _index(self, key: str, tokens: list[str], signature: list[int]) -> None:
+        if key in self._tokens:
+            return
+        self._tokens[key] = tokens
+        for band in self._get_bands(signature):
+            self._buckets.setdefault(band, []).append(key)
+
+    @staticmethod
+    def _make_key(tokens: list[str]) -> str:
+        return md5(" ".join(tokens).encode()).hexdigest()
+
+    def add(self, meals: Iterable[tuple[str, NBreakdown]], replace: bool = True) -> int:
+        """Indexes the breakdowns of the meal descriptions, returns how many were written.
+
+        Without `replace`, the breakdowns of the already indexed meals are kept.
+        """
+        added = 0
+        with self._lock:
+            for description, breakdown in meals:
+                tokens = get_canonical_tokens(description)
+                key = self._make_key(tokens)
+                if key in self._tokens and not replace:
+                    continue
+                signature = self._get_signature(get_shingles(tokens))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meals VALUES (?, ?, ?, ?)",
+                    (
+                        key,
+                        " ".join(tokens),
+                        array("Q", signature).tobytes(),
+                        breakdown.model_dump_json(),
+                    ),
+                )
+                self._index(key, tokens, signature)
+                added += 1
+            self._db.commit()
+        return added
+
+    def find(self, description: str) -> SimilarMeal | None:
+        """The breakdown of the most similar past meal, if it's similar enough."""
+        tokens = get_canonical_tokens(description)
+        shingles = get_shingles(tokens)
+        content_tokens = get_content_tokens(tokens)
+        with self._lock:
+            key = self._make_key(tokens)
+            if key in self._tokens:
+                best_key, best_similarity = key, 1.0
+            else:
+                candidates = {
+                    candidate
+                    for band in self._get_bands(self._get_signature(shingles))
+                    for candidate in self._buckets.get(band, [])
+                }
+                best_key, best_similarity = None, 0.0
+                for candidate in candidates:
+                    candidate_tokens = self._tokens[candidate]
+                    if get_content_tokens(candidate_tokens) != content_tokens:
+                        continue
+                    similarity = get_jaccard_similarity(
+                        shingles, get_shingles(candidate_tokens)
+                    )
+                    if similarity > best_similarity:
+                        best_key, best_similarity = candidate, similarity
+            if best_key is None or best_similarity < self._threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            breakdown = self._db.execute(
+                "SELECT breakdown FROM meals WHERE key = ?", (best_key,)
+            ).fetchone()[0]
+        return SimilarMeal(
+            description=" ".join(self._tokens[best_key]),
+            similarity=best_similarity,
+            breakdown=NBreakdown.model_validate_json(breakdown),
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tokens)
+
+    def close(self) -> None:
+        self._db.close()
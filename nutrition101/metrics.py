@@ -0,0 +1,268 @@
+"""Timings, analyzer calls and costs of a run, reported as JSON lines and a Prometheus textfile."""
+
+import math
+import statistics
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
+from time import perf_counter
+
+from pydantic import BaseModel
+
+
+class TokenPrices(BaseModel):
+    """USD per million tokens."""
+
+    input: float
+    output: float
+    cache_read: float
+    cache_creation: float = 0.0
+    # OpenAI-compatible APIs count the cached prompt tokens in the input tokens too
+    input_includes_cache_reads: bool = False
+
+
+# by analyzer name prefix, the longest matching prefix wins
+_PRICES = {
+    "claude:claude-3-7-sonnet": TokenPrices(
+        input=3.0, output=15.0, cache_read=0.3, cache_creation=3.75
+    ),
+    "grok:grok-3": TokenPrices(
+        input=3.0, output=15.0, cache_read=0.75, input_includes_cache_reads=True
+    ),
+    "grok:grok-3-mini": TokenPrices(
+        input=0.3, output=0.5, cache_read=0.075, input_includes_cache_reads=True
+    ),
+}
+
+
+def get_token_prices(analyzer_name: str) -> TokenPrices | None:
+    prefixes = [p for p in _PRICES if analyzer_name.startswith(p)]
+    return _PRICES[max(prefixes, key=len)] if prefixes else None
+
+
+class AnalyzerCall(BaseModel):
+    analyzer: str
+    meals: int
+    latency_s: float
+    # "ok", "wrong count" or the exception class name
+    outcome: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    # stopped before its usage was reported in full, e.g. cancelled: it cost more than recorded
+    is_usage_partial: bool = False
+
+
+class StageStats(BaseModel):
+    count: int = 0
+    seconds: float = 0.0
+
+
+class AnalyzerStats(BaseModel):
+    calls: int = 0
+    failed_calls: int = 0
+    meals: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    # calls whose tokens (and cost) are a lower bound
+    partial_usage_calls: int = 0
+    latency_p50_s: float = 0.0
+    latency_p95_s: float = 0.0
+    latency_max_s: float = 0.0
+    cost_usd: float | None = None
+
+
+class RunReport(BaseModel):
+    command: str
+    started_at: datetime
+    duration_s: float
+    stages: dict[str, StageStats]
+    analyzers: dict[str, AnalyzerStats]
+    counters: dict[str, int]
+
+
+class RunMetrics:
+    """Collects how long each pipeline stage took and what each analyzer call cost.
+
+    Stages are timed with `stage()` and may run many times per run (once per notes file);
+    it's safe to record analyzer calls from many threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started_at = datetime.now(UTC)
+        self._start = perf_counter()
+        self._stages: dict[str, StageStats] = {}
+        self._calls: list[AnalyzerCall] = []
+        self._counters: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            with self._lock:
+                stats = self._stages.setdefault(name, StageStats())
+                stats.count += 1
+                stats.seconds += seconds
+
+    def record_call(self, call: AnalyzerCall) -> None:
+        with self._lock:
+            self._calls.append(call)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @property
+    def calls(self) -> list[AnalyzerCall]:
+        with self._lock:
+            return list(self._calls)
+
+    @staticmethod
+    def _get_analyzer_stats(analyzer: str, calls: list[AnalyzerCall]) -> AnalyzerStats:
+        latencies = sorted(c.latency_s for c in calls)
+        stats = AnalyzerStats(
+            calls=len(calls),
+            failed_calls=sum(c.outcome != "ok" for c in calls),
+            meals=sum(c.meals for c in calls),
+            input_tokens=sum(c.input_tokens for c in calls),
+            output_tokens=sum(c.output_tokens for c in calls),
+            cache_read_input_tokens=sum(c.cache_read_input_tokens for c in calls),
+            cache_creation_input_tokens=sum(
+                c.cache_creation_input_tokens for c in calls
+            ),
+            partial_usage_calls=sum(c.is_usage_partial for c in calls),
+            latency_p50_s=statistics.median(latencies),
+            latency_p95_s=latencies[math.ceil(0.95 * len(latencies)) - 1],
+            latency_max_s=latencies[-1],
+        )
+        if prices := get_token_prices(analyzer):
+            uncached_input_tokens = stats.input_tokens - (
+                stats.cache_read_input_tokens
+                if prices.input_includes_cache_reads
+                else 0
+            )
+            stats.cost_usd = (
+                uncached_input_tokens * prices.input
+                + stats.output_tokens * prices.output
+                + stats.cache_read_input_tokens * prices.cache_read
+                + stats.cache_creation_input_tokens * prices.cache_creation
+            ) / 1_000_000
+        return stats
+
+    def get_report(self, command: str) -> RunReport:
+        with self._lock:
+            calls_by_analyzer: dict[str, list[AnalyzerCall]] = {}
+            for call in self._calls:
+                calls_by_analyzer.setdefault(call.analyzer, []).append(call)
+            return RunReport(
+                command=command,
+                started_at=self._started_at,
+                duration_s=perf_counter() - self._start,
+                stages={n: s.model_copy() for n, s in self._stages.items()},
+                analyzers={
+                    analyzer: self._get_analyzer_stats(analyzer, calls)
+                    for analyzer, calls in calls_by_analyzer.items()
+                },
+                counters=dict(self._counters),
+            )
+
+
+def append_report(report: RunReport, metrics_file: str) -> None:
+    with open(metrics_file, "a") as f:
+        f.write(report.model_dump_json() + "\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    escaped = {
+        k: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for k, v in labels.items()
+    }
+    return ",".join(f'{k}="{v}"' for k, v in escaped.items())
+
+
+def write_prometheus_textfile(report: RunReport, textfile: str) -> None:
+    """Writes the report as gauges of the last run, for node_exporter's textfile collector."""
+    lines: list[str] = []
+
+    def gauge(name: str, help: str, samples: list[tuple[dict[str, str], float]]):
+        lines.append(f"# HELP n101_{name} {help}")
+        lines.append(f"# TYPE n101_{name} gauge")
+        for labels, value in samples:
+            lines.append(
+                f"n101_{name}{{{_format_labels({'command': report.command} | labels)}}} {value}"
+            )
+
+    gauge(
+        "last_run_timestamp_seconds",
+        "When the last run started.",
+        [({}, report.started_at.timestamp())],
+    )
+    gauge(
+        "last_run_duration_seconds",
+        "How long the last run took.",
+        [({}, report.duration_s)],
+    )
+    gauge(
+        "last_run_stage_seconds",
+        "Time spent in each pipeline stage in the last run.",
+        [({"stage": n}, s.seconds) for n, s in report.stages.items()],
+    )
+    gauge(
+        "last_run_counter",
+        "Counters of the last run.",
+        [({"counter": n}, v) for n, v in report.counters.items()],
+    )
+    analyzers = report.analyzers.items()
+    gauge(
+        "last_run_analyzer_calls",
+        "Analyzer calls in the last run.",
+        [
+            ({"analyzer": a, "outcome": "ok"}, s.calls - s.failed_calls)
+            for a, s in analyzers
+        ]
+        + [
+            ({"analyzer": a, "outcome": "failed"}, s.failed_calls) for a, s in analyzers
+        ],
+    )
+    gauge(
+        "last_run_analyzer_tokens",
+        "Tokens the analyzers spent in the last run.",
+        [
+            ({"analyzer": a, "kind": kind}, getattr(s, f"{kind}_tokens"))
+            for a, s in analyzers
+            for kind in ("input", "output", "cache_read_input", "cache_creation_input")
+        ],
+    )
+    gauge(
+        "last_run_analyzer_latency_seconds",
+        "Analyzer call latency quantiles in the last run.",
+        [
+            ({"analyzer": a, "quantile": q}, v)
+            for a, s in analyzers
+            for q, v in (
+                ("0.5", s.latency_p50_s),
+                ("0.95", s.latency_p95_s),
+                ("1", s.latency_max_s),
+            )
+        ],
+    )
+    gauge(
+        "last_run_analyzer_cost_usd",
+        "What the analyzer calls of the last run cost.",
+        [({"analyzer": a}, s.cost_usd) for a, s in analyzers if s.cost_usd is not None],
+    )
+
+    # the collector must never see a half-written file
+    path = Path(textfile)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text("\n".join(lines) + "\n")
+    tmp_path.replace(path)
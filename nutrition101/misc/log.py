@@ -1,16 +1,65 @@
+import asyncio
+import queue
+import sys
+import threading
 from itertools import zip_longest
 from logging import Handler, LogRecord, StreamHandler, Formatter
+from time import monotonic, sleep
+from traceback import print_exc
+from typing import TYPE_CHECKING
 
-from telethon.sync import TelegramClient
+if TYPE_CHECKING:
+    from telethon.sync import TelegramClient
+
+
+_TELEGRAM_MESSAGE_LIMIT = 4096
+_STOP = object()
+
+
+def _coalesce(texts: list[str], limit: int) -> list[str]:
+    """Joins texts into as few messages of up to `limit` characters as possible."""
+    messages: list[str] = []
+    for text in texts:
+        text = text[:limit]
+        if messages and len(messages[-1]) + 1 + len(text) <= limit:
+            messages[-1] += "\n" + text
+        else:
+            messages.append(text)
+    return messages
 
 
 class TelegramLogHandler(Handler):
+    """Sends log records to a Telegram group from a background thread.
+
+    Records logged while a message is being sent are coalesced into the next one, sends are
+    at least `min_send_interval` seconds apart, and records that don't fit into the queue
+    are dropped and counted. Closing the handler waits up to `flush_timeout` seconds for
+    the queued records to be sent.
+    """
+
     def __init__(
-        self, api_id: int, api_hash: str, bot_token: str, group_id: int, session: str
+        self,
+        api_id: int,
+        api_hash: str,
+        bot_token: str,
+        group_id: int,
+        session: str,
+        max_queue_size: int = 1000,
+        min_send_interval: float = 1.0,
+        flush_timeout: float = 5.0,
     ):
         self._bot_token = bot_token
         self._group_id = group_id
-        self._client = TelegramClient(session=session, api_id=api_id, api_hash=api_hash)
+        self._session = session
+        self._api_id = api_id
+        self._api_hash = api_hash
+        self._client: "TelegramClient | None" = None
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._min_send_interval = min_send_interval
+        self._flush_timeout = flush_timeout
+        self._last_sent_at = 0.0
+        self._dropped = 0
+        self._worker: threading.Thread | None = None
         super().__init__()
 
     def _format_exception(self, record: LogRecord, char_limit: int) -> str:
@@ -35,17 +84,93 @@ class TelegramLogHandler(Handler):
                 break
         return "\n".join(head + list(reversed(tail)))
 
-    def _ensure_client_started(self):
+    def _format_record(self, record: LogRecord) -> str:
+        msg = f"{record.getMessage()}\n"
+        if record.exc_info:
+            traceback = self._format_exception(
+                record, _TELEGRAM_MESSAGE_LIMIT - len(msg) - len("```\n```")
+            )
+            msg += f"```\n{traceback}```"
+        return msg
+
+    def _ensure_client_started(self) -> "TelegramClient":
+        # telethon is only imported (and the client created) once there's something to send
+        if self._client is None:
+            from telethon.sync import TelegramClient
+
+            self._client = TelegramClient(
+                session=self._session, api_id=self._api_id, api_hash=self._api_hash
+            )
         if not self._client.is_connected():
             self._client.start(bot_token=self._bot_token)
+        return self._client
+
+    def _send(self, message: str) -> None:
+        client = self._ensure_client_started()
+        client.send_message(self._group_id, message)
+
+    def _send_all(self, texts: list[str]) -> None:
+        with self.lock:
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            texts.append(
+                f"... {dropped} log records were dropped, Telegram is too slow."
+            )
+        for message in _coalesce(texts, _TELEGRAM_MESSAGE_LIMIT):
+            sleep(max(self._last_sent_at + self._min_send_interval - monotonic(), 0))
+            try:
+                self._send(message)
+            except Exception:
+                # logging it would come back to this handler
+                print_exc(file=sys.stderr)
+            self._last_sent_at = monotonic()
+
+    def _run(self) -> None:
+        # telethon's sync client runs on the event loop of the thread it's created in
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        is_stopping = False
+        while not is_stopping:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            is_stopping = _STOP in items
+            self._send_all([item for item in items if item is not _STOP])
+        if self._client is not None:
+            self._client.disconnect()
+
+    def _ensure_worker_started(self) -> None:
+        with self.lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="n101-telegram-log", daemon=True
+                )
+                self._worker.start()
 
     def emit(self, record: LogRecord) -> None:
-        self._ensure_client_started()
-        msg = f"{record.getMessage()}\n"
-        if record.exc_info:
-            traceback = self._format_exception(record, 4096 - len(msg))
-            msg += f"```\n{traceback}```"
-        self._client.send_message(self._group_id, msg)
+        try:
+            msg = self._format_record(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self._ensure_worker_started()
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            with self.lock:
+                self._dropped += 1
+
+    def close(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            deadline = monotonic() + self._flush_timeout
+            try:
+                self._queue.put(_STOP, timeout=self._flush_timeout)
+            except queue.Full:
+                pass
+            self._worker.join(max(deadline - monotonic(), 0))
+        super().close()
 
 
 class DebuggingHandler(StreamHandler):
@@ -1 +1,9 @@
 from .markdown import NotesManipulator, ObsidianNotesEnricher
+from .vault import NotesManifest, discover_notes_files
+from .watch import (
+    INotesWatcher,
+    InotifyNotesWatcher,
+    PollingNotesWatcher,
+    make_notes_watcher,
+    watch_notes_files,
+)
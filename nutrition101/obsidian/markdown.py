@@ -1,50 +1,119 @@
 import re
-from collections.abc import Sequence
+import shutil
+import threading
+from collections.abc import Callable, Container, Iterator, Sequence
 from datetime import date, datetime
+from bisect import bisect_left, insort
 from hashlib import md5
 from pathlib import Path
 from operator import itemgetter
+from time import monotonic
 from typing import Any, ClassVar
 
 from nutrition101.domain import NEntry, NBreakdown
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+from nutrition101.llm.batching import (
+    BatchPlanner,
+    BatchRetryStats,
+    MealBatch,
+    get_batch_breakdowns,
+)
+from nutrition101.llm.cache import BreakdownCache
+from nutrition101.llm.concurrent import ConcurrentNAnalyzer
+from nutrition101.llm.knowledge_base import KnowledgeBase
+from nutrition101.llm.base import ILLMAnalyzer
+from nutrition101.llm.budget import RunBudget
+from nutrition101.llm.metered import MeteredAnalyzer
+from nutrition101.llm.similarity import MealIndex
+from nutrition101.metrics import RunMetrics
+from nutrition101.misc import get_today_date
+
+
+_UNSET: Any = object()
+
+
+class DailyEntrySection(Sequence):
+    """An immutable block of lines; the lines and what they are is worked out once.
+
+    Sections are compared by their content, like the pydantic model they used to be.
+    """
+
+    __slots__ = (
+        "_content",
+        "_lines",
+        "_is_meal",
+        "_meal_name",
+        "_meal_hash",
+        "_n_breakdown_section",
+    )
+
+    def __init__(self, content: str) -> None:
+        self._content = content
+        self._lines = tuple(content.splitlines())
+        self._is_meal: bool = _UNSET
+        self._meal_name: str = _UNSET
+        self._meal_hash: str = _UNSET
+        self._n_breakdown_section: DailyEntryNBreakdownSubSection | None = _UNSET
 
-from nutrition101.llm.models import ILLMAnalyzer
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            return list(self._lines[key])
+        return self._lines[key]
 
+    def __len__(self) -> int:
+        return len(self._lines)
 
-class DailyEntrySection(BaseModel, Sequence):
-    content: str
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DailyEntrySection):
+            return NotImplemented
+        return self._content == other._content
 
-    def __getitem__(self, key: Any) -> Any:
-        return self.lines[key]
+    def __hash__(self) -> int:
+        return hash(self._content)
 
-    def __len__(self) -> int:
-        return len(self.lines)
+    def __repr__(self) -> str:
+        return f"DailyEntrySection(content={self._content!r})"
+
+    @property
+    def content(self) -> str:
+        return self._content
 
     @property
     def lines(self) -> list[str]:
-        return self.content.splitlines()
+        return list(self._lines)
 
     @property
     def is_meal(self) -> bool:
-        meal_name = self[0].strip()
-        is_linked = meal_name.startswith("[[")
-        is_anchor = meal_name.startswith("#" * 6)
-        return (is_anchor or is_linked or meal_name.startswith("=")) and len(self) >= 2
+        if self._is_meal is _UNSET:
+            meal_name = self[0].strip()
+            is_linked = meal_name.startswith("[[")
+            is_anchor = meal_name.startswith("#" * 6)
+            self._is_meal = (
+                is_anchor or is_linked or meal_name.startswith("=")
+            ) and len(self) >= 2
+        return self._is_meal
+
+    def _get_n_breakdown_section(self) -> "DailyEntryNBreakdownSubSection | None":
+        if self._n_breakdown_section is _UNSET:
+            self._n_breakdown_section = DailyEntryNBreakdownSubSection.from_md_table(
+                self._content
+            )
+        return self._n_breakdown_section
 
     @property
     def is_meal_n_breakdown(self) -> bool:
         return (
-            self.content.strip(" ").startswith(
+            self._content.strip(" ").startswith(
                 f"| {DailyEntryNBreakdownSubSection.MEAL_BREAKDOWN_FIRST_COLUMN}"
             )
-            and DailyEntryNBreakdownSubSection.from_md_table(self.content) is not None
+            and self._get_n_breakdown_section() is not None
         )
 
     @property
     def n_breakdown(self) -> NBreakdown:
         assert self.is_meal_n_breakdown or self.is_daily_n_breakdown
-        nb_section = DailyEntryNBreakdownSubSection.from_md_table(self.content)
+        nb_section = self._get_n_breakdown_section()
         assert nb_section
         return nb_section.breakdown
 
@@ -58,7 +127,7 @@ class DailyEntrySection(BaseModel, Sequence):
 
     @property
     def is_daily_n_breakdown(self) -> bool:
-        return self.content.strip(" ").startswith(
+        return self._content.strip(" ").startswith(
             f"| {DailyEntryNBreakdownSubSection.DAILY_TOTAL_BREAKDOWN_FIRST_COLUMN}"
         )
 
@@ -68,17 +137,21 @@ class DailyEntrySection(BaseModel, Sequence):
 
     def get_meal_hash(self) -> str:
         assert self.is_meal, "Not a meal section"
-        return md5("".join(self[1:]).encode()).hexdigest()
+        if self._meal_hash is _UNSET:
+            self._meal_hash = md5("".join(self[1:]).encode()).hexdigest()
+        return self._meal_hash
 
     def get_meal_name(self) -> str:
         assert self.is_meal, f"Not a meal section - {self[0]}"
-        if self[0].startswith("[["):
-            meal_name = self[0].strip("[]").split("|")[-1]
-        elif self[0].startswith("###"):
-            meal_name = self[0].strip("# ")
-        else:
-            meal_name = self[0]
-        return meal_name.strip(" =")
+        if self._meal_name is _UNSET:
+            if self[0].startswith("[["):
+                meal_name = self[0].strip("[]").split("|")[-1]
+            elif self[0].startswith("###"):
+                meal_name = self[0].strip("# ")
+            else:
+                meal_name = self[0]
+            self._meal_name = meal_name.strip(" =")
+        return self._meal_name
 
     def get_meal_anchor(self) -> str:
         assert self.is_breakdown_anchor, f"Not a meal anchor - {self[0]}"
@@ -183,6 +256,8 @@ class DailyEntryNBreakdownSubSection(BaseModel):
 
 
 class DailyEntry(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     date: date
     sections: list[DailyEntrySection]
 
@@ -193,26 +268,225 @@ class DailyEntry(BaseModel):
         return "\n\n".join(md_sections)
 
 
+class _IndexedSections:
+    """A day's sections, with their positions indexed by content, anchor title and meal name.
+
+    The sections are changed through it to keep the index up to date, so finding a meal,
+    its anchor or its breakdown table doesn't scan the day.
+    """
+
+    def __init__(
+        self, sections: list[DailyEntrySection], daily_link_marker: str
+    ) -> None:
+        self._sections = sections
+        self._daily_link_marker = daily_link_marker
+        self._positions: dict[tuple[str, Any], list[int]] = {}
+        self._reindex()
+
+    def __getitem__(self, idx: int) -> DailyEntrySection:
+        return self._sections[idx]
+
+    def __len__(self) -> int:
+        return len(self._sections)
+
+    def _get_keys(self, section: DailyEntrySection) -> list[tuple[str, Any]]:
+        keys: list[tuple[str, Any]] = [("section", section)]
+        if section.is_breakdown_anchor:
+            keys.append(("anchor", section[0]))
+        if section.is_meal:
+            keys.append(("meal", section.get_meal_name()))
+        if section.is_meal_n_breakdown:
+            keys.append(("table", None))
+        if section.has_breakdown_link and self._daily_link_marker in section[0]:
+            keys.append(("daily_link", None))
+        return keys
+
+    def _index(self, idx: int, section: DailyEntrySection) -> None:
+        for key in self._get_keys(section):
+            insort(self._positions.setdefault(key, []), idx)
+
+    def _unindex(self, idx: int, section: DailyEntrySection) -> None:
+        for key in self._get_keys(section):
+            positions = self._positions[key]
+            positions.remove(idx)
+            if not positions:
+                del self._positions[key]
+
+    def _reindex(self) -> None:
+        self._positions = {}
+        for idx, section in enumerate(self._sections):
+            self._index(idx, section)
+
+    def _find(self, key: tuple[str, Any]) -> int | None:
+        positions = self._positions.get(key)
+        return positions[0] if positions else None
+
+    def find_section(self, section: DailyEntrySection) -> int | None:
+        return self._find(("section", section))
+
+    def find_anchor(self, anchor_title: str) -> int | None:
+        return self._find(("anchor", anchor_title))
+
+    def find_meal(self, meal_name: str) -> int | None:
+        return self._find(("meal", meal_name))
+
+    def find_daily_link(self) -> int | None:
+        return self._find(("daily_link", None))
+
+    def find_tables(self) -> list[int]:
+        return self._positions.get(("table", None), [])
+
+    def replace(self, idx: int, section: DailyEntrySection) -> None:
+        self._unindex(idx, self._sections[idx])
+        self._sections[idx] = section
+        self._index(idx, section)
+
+    def append(self, section: DailyEntrySection) -> None:
+        self._index(len(self._sections), section)
+        self._sections.append(section)
+
+    def pop(self) -> DailyEntrySection:
+        section = self._sections.pop()
+        self._unindex(len(self._sections), section)
+        return section
+
+    def insert(self, idx: int, section: DailyEntrySection) -> None:
+        # shifts the sections after it, which only happens to an anchor without a table
+        for positions in self._positions.values():
+            for n in range(bisect_left(positions, idx), len(positions)):
+                positions[n] += 1
+        self._sections.insert(idx, section)
+        self._index(idx, section)
+
+
+_DATE_PATTERN = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+
+
+def _get_date_from_line(line: str) -> date | None:
+    # most lines have no slashes at all, there is no need to run the regex on them
+    if "/" not in line:
+        return None
+    match = _DATE_PATTERN.search(line)
+    return match and date(int(match[3]), int(match[1]), int(match[2]))
+
+
+def parse_daily_entries(
+    content: str, dates: Container[date] | None = None
+) -> Iterator[DailyEntry]:
+    """Yields the daily entries of a notes file in the order they appear in it.
+
+    A day starts at a line with a `%m/%d/%Y` date, its sections are separated by blank lines.
+    Only the days in `dates` are yielded if given, the sections of the other days aren't built.
+    The caller can stop iterating as soon as it's got the days it needs.
+    """
+    current_date: date | None = None
+    current_date_sections: list[DailyEntrySection] = []
+    current_section_lines: list[str] = []
+    is_wanted = True
+    for line in content.splitlines():
+        maybe_date = _get_date_from_line(line)
+        if maybe_date:
+            if current_date is not None and is_wanted:
+                yield DailyEntry.model_construct(
+                    date=current_date, sections=current_date_sections
+                )
+            current_date, current_date_sections = maybe_date, []
+            is_wanted = dates is None or current_date in dates
+        elif not line.strip(" \n"):
+            if current_section_lines:
+                if is_wanted:
+                    current_date_sections.append(
+                        DailyEntrySection(content="\n".join(current_section_lines))
+                    )
+                current_section_lines = []
+        else:
+            # lines right above a date, with no blank line between, open the next day
+            current_section_lines.append(line)
+
+    if current_date and is_wanted:
+        if current_section_lines:
+            current_date_sections.append(
+                DailyEntrySection(content="\n".join(current_section_lines))
+            )
+        yield DailyEntry.model_construct(
+            date=current_date, sections=current_date_sections
+        )
+
+
+def parse_meal_breakdown_entries(
+    content: str,
+) -> Iterator[tuple[date, str, str, NEntry]]:
+    """Yields the (date, meal name, meal hash, entry) of every meal breakdown row of an n101 file."""
+    for daily_entry in parse_daily_entries(content):
+        meal_name = ""
+        for section in daily_entry.sections:
+            if section.is_breakdown_anchor and section.is_meal:
+                meal_name = section.get_meal_name()
+            elif section.is_meal_n_breakdown:
+                nb_section = section._get_n_breakdown_section()
+                assert nb_section
+                for entry in nb_section.breakdown.entries:
+                    yield daily_entry.date, meal_name, nb_section.meal_hash, entry
+                meal_name = ""
+
+
+def get_item_name(entry: NEntry) -> str:
+    """The entry's item without the knowledge base marker the breakdown tables add to it."""
+    return entry.item.replace(
+        DailyEntryNBreakdownSubSection.USED_KNOWLEDGE_BASE_MARKER, ""
+    ).strip()
+
+
+def _write_if_changed(path: Path, content: str) -> bool:
+    """Atomically replaces the file, unless it already has the content.
+
+    Syncthing (and Obsidian) never see a half-written file, and an unchanged file keeps
+    its mtime, so it isn't synced again.
+    """
+    data = content.encode()
+    if path.exists() and path.read_bytes() == data:
+        return False
+    tmp_path = path.with_name(f".{path.name}.n101.tmp")
+    tmp_path.write_bytes(data)
+    if path.exists():
+        shutil.copymode(path, tmp_path)
+    tmp_path.replace(path)
+    return True
+
+
 class NotesManipulator:
     _DAILY_BREAKDOWN: str = "daily-breakdown"
 
-    def __init__(self, notes_file: str, nutrition_dir: str) -> None:
+    def __init__(
+        self, notes_file: str, nutrition_dir: str, metrics: RunMetrics | None = None
+    ) -> None:
         self._nutrition_dir = nutrition_dir
+        self._metrics = metrics or RunMetrics()
         self._source_notes = Path(notes_file)
-        self._entries_map = {
-            de.date: de
-            for de in self._parse_daily_entries(self._source_notes.read_text())
-        }
         self._n101_notes = Path(
             self._source_notes.parent / self._nutrition_dir / self._source_notes.name
         )
         self._n101_notes.parent.mkdir(exist_ok=True)
-        self._n101_entries_map = {
-            de.date: de
-            for de in self._parse_daily_entries(
-                self._n101_notes.read_text() if self._n101_notes.exists() else ""
-            )
-        }
+        with self._metrics.stage("parse"):
+            self._entries_map = {
+                de.date: de
+                for de in self._parse_daily_entries(self._source_notes.read_text())
+            }
+            self._n101_entries_map = {
+                de.date: de
+                for de in self._parse_daily_entries(
+                    self._n101_notes.read_text() if self._n101_notes.exists() else ""
+                )
+            }
+        # built on the first lookup of a day, most runs only look at a few days
+        self._source_sections: dict[date, _IndexedSections] = {}
+        self._n101_sections: dict[date, _IndexedSections] = {}
+        self._changed_dates: set[date] = set()
+        # the markdown of each day as last written, only the changed days are rendered again
+        self._rendered: dict[tuple[bool, date], str] = {}
+        # days whose daily total table is rendered on the next read of the n101 entries
+        self._days_to_total: set[date] = set()
+        self._meal_totals: dict[DailyEntrySection, NEntry] = {}
 
     @property
     def source_entries(self) -> list[DailyEntry]:
@@ -220,61 +494,33 @@ class NotesManipulator:
 
     @property
     def n101_entries(self) -> list[DailyEntry]:
+        self._add_daily_totals()
         return [
             de for _, de in sorted(self._n101_entries_map.items(), key=itemgetter(0))
         ]
 
     def write_notes(self, notes_path: str | None) -> None:
         destination = Path(notes_path) if notes_path else self._source_notes
-        md_content = "\n\n".join([de.to_md_content() for de in self.source_entries])
-        destination.write_text(md_content)
-
-        md_content = "\n\n".join([de.to_md_content() for de in self.n101_entries])
-        self._n101_notes.write_text(md_content)
-
-    @staticmethod
-    def _get_date_from_line(line: str) -> date | None:
-        date_pattern = r"\b(\d{1,2}/\d{1,2}/\d{4})\b"
-        match = re.search(date_pattern, line.strip())
-        return match and datetime.strptime(match.group(), "%m/%d/%Y").date()
+        if not self._changed_dates and destination == self._source_notes:
+            return
+
+        with self._metrics.stage("render"):
+            md_content = self._render(self.source_entries, is_n101=False)
+            n101_md_content = self._render(self.n101_entries, is_n101=True)
+        with self._metrics.stage("write"):
+            _write_if_changed(destination, md_content)
+            _write_if_changed(self._n101_notes, n101_md_content)
+        self._changed_dates.clear()
+
+    def _render(self, entries: list[DailyEntry], is_n101: bool) -> str:
+        for de in entries:
+            key = (is_n101, de.date)
+            if de.date in self._changed_dates or key not in self._rendered:
+                self._rendered[key] = de.to_md_content()
+        return "\n\n".join(self._rendered[(is_n101, de.date)] for de in entries)
 
     def _parse_daily_entries(self, content: str) -> list[DailyEntry]:
-        content_lines = content.splitlines()
-        current_line = 0
-        entries, current_date, current_date_sections, current_section_lines = (
-            [],
-            None,
-            [],
-            [],
-        )
-        while current_line <= len(content_lines) - 1:
-            line = content_lines[current_line]
-            maybe_date = self._get_date_from_line(line)
-            if maybe_date:
-                if current_date is not None:
-                    entries.append(
-                        DailyEntry(date=current_date, sections=current_date_sections)
-                    )
-                current_date, current_date_sections = maybe_date, []
-            elif not line.strip(" \n"):
-                if current_section_lines:
-                    current_date_sections.append(
-                        DailyEntrySection(content="\n".join(current_section_lines))
-                    )
-                    current_section_lines = []
-            else:
-                current_section_lines.append(line)
-            current_line += 1
-
-        if current_date:
-            if current_section_lines:
-                current_date_sections.append(
-                    DailyEntrySection(content="\n".join(current_section_lines))
-                )
-            entries.append(
-                DailyEntry(date=current_date, sections=current_date_sections)
-            )
-        return entries
+        return list(parse_daily_entries(content))
 
     @staticmethod
     def _generate_meal_anchor(date: date, meal_name: str) -> str:
@@ -287,70 +533,77 @@ class NotesManipulator:
     def _generate_breakdown_link(self, date: date, meal_name: str) -> str:
         return f"[[{self._nutrition_dir}/{self._n101_notes.name}#{self._generate_meal_anchor(date, meal_name)}|{meal_name}]]"
 
-    def _add_meal_anchor(
-        self, daily_entry: DailyEntry, section: DailyEntrySection
-    ) -> DailyEntry:
+    def _get_source_sections(self, date: date) -> _IndexedSections:
+        if date not in self._source_sections:
+            self._source_sections[date] = _IndexedSections(
+                self._entries_map[date].sections, self._DAILY_BREAKDOWN
+            )
+        return self._source_sections[date]
+
+    def _get_n101_sections(self, date: date, create: bool = False) -> _IndexedSections:
+        if date not in self._n101_sections:
+            if date not in self._n101_entries_map:
+                if not create:
+                    return _IndexedSections([], self._DAILY_BREAKDOWN)
+                self._n101_entries_map[date] = DailyEntry(date=date, sections=[])
+            self._n101_sections[date] = _IndexedSections(
+                self._n101_entries_map[date].sections, self._DAILY_BREAKDOWN
+            )
+        return self._n101_sections[date]
+
+    def _add_meal_anchor(self, date: date, section: DailyEntrySection) -> None:
         assert section.is_meal
-        sections = daily_entry.sections.copy()
-        meal_idx = sections.index(section)
-        meal_content = section.lines.copy()
+        sections = self._get_source_sections(date)
         # always rewrite the anchor in case the nutrition_dir has changed
         meal_name = section.get_meal_name()
-        meal_name_anchored = self._generate_breakdown_link(daily_entry.date, meal_name)
-        updated_meal_section = DailyEntrySection(
-            content="\n".join([meal_name_anchored] + meal_content[1:])
+        meal_name_anchored = self._generate_breakdown_link(date, meal_name)
+        anchored_section = DailyEntrySection(
+            content="\n".join([meal_name_anchored] + section[1:])
         )
-        sections[meal_idx] = updated_meal_section
+        meal_idx = sections.find_section(section)
+        if meal_idx is None:
+            # the section was anchored by an earlier breakdown of the same run
+            meal_idx = sections.find_section(anchored_section)
+        assert meal_idx is not None, f"{section} isn't in the {date} entry"
+        sections.replace(meal_idx, anchored_section)
 
         # the same with daily breakdown anchor
-        existing_daily_link_section = next(
-            (
-                section
-                for section in sections
-                if section.has_breakdown_link and self._DAILY_BREAKDOWN in section[0]
-            ),
-            None,
-        )
-
         daily_link_section = DailyEntrySection(
-            content=self._generate_breakdown_link(
-                daily_entry.date, self._DAILY_BREAKDOWN
-            )
+            content=self._generate_breakdown_link(date, self._DAILY_BREAKDOWN)
         )
-
-        if not existing_daily_link_section:
+        daily_link_idx = sections.find_daily_link()
+        if daily_link_idx is None:
             sections.append(daily_link_section)
         else:
-            sections[sections.index(existing_daily_link_section)] = daily_link_section
-
-        return DailyEntry(date=daily_entry.date, sections=sections)
+            sections.replace(daily_link_idx, daily_link_section)
 
     def _add_meal_breakdown(
-        self,
-        daily_entry: DailyEntry,
-        source_section: DailyEntrySection,
-        breakdown: NBreakdown,
-    ) -> DailyEntry:
+        self, date: date, source_section: DailyEntrySection, breakdown: NBreakdown
+    ) -> None:
         assert source_section.is_meal
         anchor_title = self._generate_meal_anchor_title(source_section.get_meal_name())
-        n101_sections = daily_entry.sections.copy()
-        if n101_sections:
-            if n101_sections[-1].is_daily_n_breakdown:
-                assert n101_sections[-2].is_breakdown_anchor, (
-                    f"Can't detect the daily breakdown anchor {n101_sections[:-3]}"
+        n101_sections = self._get_n101_sections(date, create=True)
+        if date not in self._days_to_total:
+            # the daily total goes last, it's rendered again once the day's meals are added
+            if len(n101_sections):
+                if n101_sections[-1].is_daily_n_breakdown:
+                    assert n101_sections[-2].is_breakdown_anchor, (
+                        f"Can't detect the daily breakdown anchor {n101_sections[-2]}"
+                    )
+                for _ in range(min(len(n101_sections), 2)):
+                    n101_sections.pop()
+            self._days_to_total.add(date)
+
+        anchor_idx = n101_sections.find_anchor(anchor_title)
+        if anchor_idx is None:
+            anchor_idx = len(n101_sections)
+            n101_sections.append(
+                DailyEntrySection(
+                    content=f"{anchor_title}\n{self._generate_meal_anchor(date, source_section.get_meal_name())}"
                 )
-            n101_sections = n101_sections[:-2]
-
-        n101_section = next(
-            (s for s in daily_entry.sections if s[0] == anchor_title), None
-        )
-        if not n101_section:
-            n101_section = DailyEntrySection(
-                content=f"{anchor_title}\n{self._generate_meal_anchor(daily_entry.date, source_section.get_meal_name())}"
             )
-            n101_sections.append(n101_section)
 
-        breakdown_section_idx = n101_sections.index(n101_section) + 1
+        breakdown_section_idx = anchor_idx + 1
         breakdown_as_table = DailyEntrySection(
             content=DailyEntryNBreakdownSubSection(
                 breakdown=breakdown,
@@ -360,46 +613,54 @@ class NotesManipulator:
         )
         if breakdown_section_idx <= len(n101_sections) - 1:
             if n101_sections[breakdown_section_idx].is_meal_n_breakdown:
-                n101_sections[breakdown_section_idx] = breakdown_as_table
+                n101_sections.replace(breakdown_section_idx, breakdown_as_table)
             else:
                 n101_sections.insert(breakdown_section_idx, breakdown_as_table)
         else:
             n101_sections.append(breakdown_as_table)
 
-        meal_breakdowns = [
-            (
-                n101_sections[n101_sections.index(mb) - 1].get_meal_name(),
-                mb.n_breakdown,
+        self._meal_totals[breakdown_as_table] = breakdown.get_total_as_entry("")
+
+    def _get_meal_total(self, table: DailyEntrySection, meal_name: str) -> NEntry:
+        if table not in self._meal_totals:
+            self._meal_totals[table] = table.n_breakdown.get_total_as_entry("")
+        return self._meal_totals[table].model_copy(update={"item": meal_name})
+
+    def _add_daily_totals(self) -> None:
+        for day in self._days_to_total:
+            n101_sections = self._get_n101_sections(day)
+            daily_breakdown_table = DailyEntrySection(
+                content=DailyEntryNBreakdownSubSection(
+                    is_daily_total=True,
+                    breakdown=NBreakdown(
+                        entries=[
+                            self._get_meal_total(
+                                n101_sections[idx],
+                                n101_sections[idx - 1].get_meal_name(),
+                            )
+                            for idx in n101_sections.find_tables()
+                        ]
+                    ),
+                    meal_hash="",
+                ).to_md_table()
             )
-            for mb in n101_sections
-            if mb.is_meal_n_breakdown
-        ]
-
-        daily_breakdown_table = DailyEntrySection(
-            content=DailyEntryNBreakdownSubSection(
-                is_daily_total=True,
-                breakdown=NBreakdown(
-                    entries=[
-                        mb.get_total_as_entry(meal_name)
-                        for meal_name, mb in meal_breakdowns
+            daily_anchor = DailyEntrySection(
+                content="\n".join(
+                    [
+                        self._generate_meal_anchor_title(self._DAILY_BREAKDOWN),
+                        self._generate_meal_anchor(day, self._DAILY_BREAKDOWN),
                     ]
-                ),
-                meal_hash="",
-            ).to_md_table()
-        )
-        daily_anchor = DailyEntrySection(
-            content="\n".join(
-                [
-                    self._generate_meal_anchor_title(self._DAILY_BREAKDOWN),
-                    self._generate_meal_anchor(daily_entry.date, self._DAILY_BREAKDOWN),
-                ]
+                )
             )
-        )
-        n101_sections.extend([daily_anchor, daily_breakdown_table])
-        return DailyEntry(date=daily_entry.date, sections=n101_sections)
+            n101_sections.append(daily_anchor)
+            n101_sections.append(daily_breakdown_table)
+        self._days_to_total.clear()
 
     def clear_breakdowns(self, date: date) -> None:
         self._n101_entries_map[date] = DailyEntry(date=date, sections=[])
+        self._n101_sections.pop(date, None)
+        self._days_to_total.discard(date)
+        self._changed_dates.add(date)
 
     def add_meal_breakdown(
         self, date: date, section: DailyEntrySection, breakdown: NBreakdown
@@ -407,55 +668,29 @@ class NotesManipulator:
         assert date in self._entries_map, (
             f"There is not daily entry for {date.isoformat()}"
         )
-        daily_entry = self._entries_map[date]
-        daily_entry = self._add_meal_anchor(daily_entry, section)
-        self._entries_map[date] = daily_entry
-
-        n101_daily_entry = self._n101_entries_map.get(
-            date, DailyEntry(date=date, sections=[])
-        )
-        n101_daily_entry = self._add_meal_breakdown(
-            n101_daily_entry, section, breakdown
-        )
-        self._n101_entries_map[date] = n101_daily_entry
+        self._add_meal_anchor(date, section)
+        self._add_meal_breakdown(date, section, breakdown)
+        self._changed_dates.add(date)
 
     def get_meal_breakdowns(
         self, date: date
     ) -> list[tuple[DailyEntrySection, DailyEntryNBreakdownSubSection | None]]:
         daily_entry = self._entries_map[date]
-        n101_daily_entry = self._n101_entries_map.get(
-            date, DailyEntry(date=date, sections=[])
-        )
+        n101_sections = self._get_n101_sections(date)
         result = []
         for section in daily_entry.sections:
             if section.is_meal:
                 n_breakdown = None
-                n101_anchor = next(
-                    (
-                        ns
-                        for ns in n101_daily_entry.sections
-                        if ns.is_meal and ns.get_meal_name() == section.get_meal_name()
-                    ),
-                    None,
-                )
-                if n101_anchor:
-                    maybe_breakdown_idx = (
-                        n101_daily_entry.sections.index(n101_anchor) + 1
-                    )
-                    if maybe_breakdown_idx <= len(n101_daily_entry.sections) - 1:
-                        next_section = n101_daily_entry.sections[maybe_breakdown_idx]
-                        if next_section.is_meal_n_breakdown:
-                            breakdown_section = (
-                                DailyEntryNBreakdownSubSection.from_md_table(
-                                    next_section.content
-                                )
-                            )
-                            if (
-                                breakdown_section
-                                and breakdown_section.meal_hash
-                                == section.get_meal_hash()
-                            ):
-                                n_breakdown = breakdown_section
+                anchor_idx = n101_sections.find_meal(section.get_meal_name())
+                if anchor_idx is not None and anchor_idx + 1 < len(n101_sections):
+                    next_section = n101_sections[anchor_idx + 1]
+                    if next_section.is_meal_n_breakdown:
+                        breakdown_section = next_section._get_n_breakdown_section()
+                        if (
+                            breakdown_section
+                            and breakdown_section.meal_hash == section.get_meal_hash()
+                        ):
+                            n_breakdown = breakdown_section
                 result.append((section, n_breakdown))
         return result
 
@@ -465,25 +700,173 @@ class NotesManipulator:
         )
 
 
+class _DailyWork(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    date: date
+    meals_and_breakdowns: list[
+        tuple[DailyEntrySection, DailyEntryNBreakdownSubSection | None]
+    ]
+    meals_to_get_breakdowns: list[DailyEntrySection]
+    breakdowns: list[NBreakdown | None]
+
+    @property
+    def meals_to_analyze(self) -> list[DailyEntrySection]:
+        return [
+            ms
+            for ms, n_b in zip(self.meals_to_get_breakdowns, self.breakdowns)
+            if n_b is None
+        ]
+
+
+class _Checkpoint:
+    """Adds every breakdown to the notes as soon as it's known to line up with its meal.
+
+    The notes are written at most every `interval_s` seconds, and by `flush` when the
+    analysis fails; the final results of the analysis replace them at the end of the run.
+    """
+
+    def __init__(
+        self, nm: NotesManipulator, notes_path: str, interval_s: float
+    ) -> None:
+        self._nm = nm
+        self._notes_path = notes_path
+        self._interval_s = interval_s
+        self._last_write_at: float | None = None
+        self._is_pending = False
+        # batches stream from many threads
+        self._lock = threading.Lock()
+
+    def add_breakdown(
+        self, key: tuple[date, DailyEntrySection], breakdown: NBreakdown
+    ) -> None:
+        meal_date, ms = key
+        with self._lock:
+            self._nm.add_meal_breakdown(meal_date, ms, breakdown)
+            self._is_pending = True
+            if (
+                self._last_write_at is None
+                or monotonic() - self._last_write_at >= self._interval_s
+            ):
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._is_pending:
+                self._write()
+
+    def _write(self) -> None:
+        self._nm.write_notes(self._notes_path)
+        self._last_write_at = monotonic()
+        self._is_pending = False
+
+
 class ObsidianNotesEnricher:
-    def __init__(self, analyzer: ILLMAnalyzer) -> None:
+    _DEFAULT_MAX_TOKENS = 8192
+    _CHECKPOINT_INTERVAL_S = 5.0
+
+    def __init__(
+        self,
+        analyzer: ILLMAnalyzer,
+        cache: BreakdownCache | None = None,
+        max_concurrency: int = 1,
+        batch_token_budget: int | None = None,
+        checkpoint: bool = False,
+        meal_index: MealIndex | None = None,
+    ) -> None:
         self._analyzer = analyzer
+        self._cache = cache
+        self._max_concurrency = max_concurrency
+        self._batch_token_budget = batch_token_budget
+        # write the notes while the breakdowns are received, not only at the end of the run
+        self._checkpoint = checkpoint
+        self._meal_index = meal_index
+        self.retry_stats = BatchRetryStats()
+        self.deferred_days: list[date] = []
+
+    def _make_cache_key(
+        self,
+        cache: BreakdownCache,
+        ms: DailyEntrySection,
+        knowledge_base: KnowledgeBase,
+    ) -> str:
+        # A batch is sent the recipes of all its meals, but the key only has the meal's own.
+        # The prompt only lets a meal use the recipes it names, so the other recipes of its
+        # batch don't change its breakdown, and the meal hits the cache in any batch.
+        return cache.make_key(
+            ms.get_meal_hash(),
+            self._analyzer.name,
+            knowledge_base.get_section([ms.get_meal_description()]),
+        )
 
-    def enrich_notes(
+    def _get_cached_breakdowns(
+        self, meals: list[DailyEntrySection], knowledge_base: KnowledgeBase
+    ) -> list[NBreakdown | None]:
+        if self._cache is None:
+            return [None] * len(meals)
+        return [
+            self._cache.get(self._make_cache_key(self._cache, ms, knowledge_base))
+            for ms in meals
+        ]
+
+    def _cache_breakdowns(
         self,
-        notes_file: str,
-        knowledge_base: str,
-        nutrition_dir: str,
-        only_date: datetime | None,
-        write_notes_to: str | None,
-        override_existing: bool,
-    ) -> bool:
-        assert Path(notes_file).exists(), (
-            f"Can't find the {notes_file} file with daily notes."
+        meals: list[DailyEntrySection],
+        breakdowns: list[NBreakdown],
+        knowledge_base: KnowledgeBase,
+    ) -> None:
+        if self._cache is None:
+            return
+        for ms, n_b in zip(meals, breakdowns):
+            self._cache.put(self._make_cache_key(self._cache, ms, knowledge_base), n_b)
+
+    def _get_similar_breakdowns(
+        self,
+        day: date,
+        meals: list[DailyEntrySection],
+        breakdowns: list[NBreakdown | None],
+        metrics: RunMetrics,
+    ) -> list[NBreakdown | None]:
+        """Fills in the breakdowns of the meals that are near-identical to an indexed one."""
+        if self._meal_index is None:
+            return breakdowns
+        similar_breakdowns = []
+        for ms, n_b in zip(meals, breakdowns):
+            if n_b is None and (
+                similar := self._meal_index.find(ms.get_meal_description())
+            ):
+                print(
+                    f"{day.isoformat()} {ms.get_meal_name()} reuses the breakdown of a "
+                    f"{similar.similarity:.0%} similar meal: {similar.description}"
+                )
+                metrics.count("similar_meals_reused")
+                n_b = similar.breakdown
+            similar_breakdowns.append(n_b)
+        return similar_breakdowns
+
+    def _index_meals(self, nm: NotesManipulator) -> None:
+        """Adds the meals that already have breakdowns in the notes to the similarity index."""
+        if self._meal_index is None:
+            return
+        self._meal_index.add(
+            (
+                (ms.get_meal_description(), n_b.breakdown)
+                for de in nm.source_entries
+                for ms, n_b in nm.get_meal_breakdowns(de.date)
+                if n_b is not None
+            ),
+            replace=False,
         )
-        nm = NotesManipulator(notes_file=notes_file, nutrition_dir=nutrition_dir)
-        notes_need_enrichment = False
 
+    def _plan_daily_work(
+        self,
+        nm: NotesManipulator,
+        knowledge_base: KnowledgeBase,
+        only_date: datetime | None,
+        override_existing: bool,
+        metrics: RunMetrics,
+    ) -> list[_DailyWork]:
+        work = []
         for daily_entry in nm.source_entries:
             if only_date and daily_entry.date != only_date.date():
                 print(f"Skipping {daily_entry.date.isoformat()}")
@@ -505,37 +888,250 @@ class ObsidianNotesEnricher:
                 if n_b is None or override_existing
             ]
             print("processing", daily_entry.date, meals_to_get_breakdowns)
-
-            meal_breakdowns_llm = self._analyzer.get_meal_breakdowns(
-                [ms.get_meal_description() for ms in meals_to_get_breakdowns],
-                knowledge_base,
+            if override_existing:
+                # overriding asks for new breakdowns, the cache and the index have the old ones
+                breakdowns: list[NBreakdown | None] = [None] * len(
+                    meals_to_get_breakdowns
+                )
+            else:
+                breakdowns = self._get_cached_breakdowns(
+                    meals_to_get_breakdowns, knowledge_base
+                )
+                breakdowns = self._get_similar_breakdowns(
+                    daily_entry.date, meals_to_get_breakdowns, breakdowns, metrics
+                )
+            work.append(
+                _DailyWork(
+                    date=daily_entry.date,
+                    meals_and_breakdowns=meals_and_breakdowns,
+                    meals_to_get_breakdowns=meals_to_get_breakdowns,
+                    breakdowns=breakdowns,
+                )
             )
+        return work
 
-            notes_need_enrichment = True
+    @staticmethod
+    def _schedule_daily_work(
+        work: list[_DailyWork],
+        knowledge_base: KnowledgeBase,
+        budget: RunBudget | None,
+    ) -> tuple[list[_DailyWork], list[_DailyWork]]:
+        """Orders the work today first, then yesterday, then the backlog oldest first.
+
+        Returns the work that fits into the budget and the work deferred to the next run.
+        """
+        today = get_today_date()
+
+        def get_priority(dw: _DailyWork) -> tuple[int, date]:
+            days_ago = (today - dw.date).days
+            return (days_ago if days_ago in (0, 1) else 2), dw.date
+
+        scheduled, deferred = [], []
+        for dw in sorted(work, key=get_priority):
+            meal_descriptions = [
+                ms.get_meal_description() for ms in dw.meals_to_analyze
+            ]
+            if budget is None or budget.reserve(meal_descriptions, knowledge_base):
+                scheduled.append(dw)
+            else:
+                deferred.append(dw)
+        return scheduled, deferred
+
+    def _plan_batches(
+        self, work: list[_DailyWork], knowledge_base: KnowledgeBase
+    ) -> list[MealBatch[tuple[date, DailyEntrySection]]]:
+        if self._batch_token_budget is None:
+            return [
+                MealBatch(
+                    [
+                        ((dw.date, ms), ms.get_meal_description())
+                        for ms in dw.meals_to_analyze
+                    ]
+                )
+                for dw in work
+                if dw.meals_to_analyze
+            ]
+        planner = BatchPlanner(
+            prompt_token_budget=self._batch_token_budget,
+            max_output_tokens=self._analyzer.max_tokens or self._DEFAULT_MAX_TOKENS,
+        )
+        return planner.plan(
+            (
+                ((dw.date, ms), ms.get_meal_description())
+                for dw in work
+                for ms in dw.meals_to_analyze
+            ),
+            knowledge_base,
+        )
 
-            try:
-                assert len(meal_breakdowns_llm) == len(meals_to_get_breakdowns)
-            except AssertionError:
+    def _analyze_daily_work(
+        self,
+        work: list[_DailyWork],
+        knowledge_base: KnowledgeBase,
+        metrics: RunMetrics,
+        on_breakdown: Callable[[tuple[date, DailyEntrySection], NBreakdown], None]
+        | None = None,
+    ) -> None:
+        for dw in work:
+            if not dw.meals_to_analyze:
+                print(f"{dw.date.isoformat()} all breakdowns are cached.")
+
+        batches = self._plan_batches(work, knowledge_base)
+        self.retry_stats = BatchRetryStats()
+        # the calls are metered per provider (e.g. of a hedged analyzer), they're priced differently
+        metered_analyzer = self._analyzer.with_analyzers(
+            lambda analyzer: MeteredAnalyzer(analyzer, metrics)
+        )
+        if self._max_concurrency > 1 and len(batches) > 1:
+            with ConcurrentNAnalyzer(
+                metered_analyzer, self._max_concurrency
+            ) as analyzer:
+                futures = [
+                    analyzer.submit_batch(
+                        b, knowledge_base, self.retry_stats, on_breakdown
+                    )
+                    for b in batches
+                ]
+                results = [f.result() for f in futures]
+        else:
+            results = [
+                get_batch_breakdowns(
+                    metered_analyzer, b, knowledge_base, self.retry_stats, on_breakdown
+                )
+                for b in batches
+            ]
+        metrics.count("batches", len(batches))
+        metrics.count("batch_retries", self.retry_stats.retries)
+        metrics.count("meals_left_without_breakdowns", self.retry_stats.failed_meals)
+        if analyzer_stats := metered_analyzer.get_stats():
+            for name, value in analyzer_stats.items():
+                metrics.count(name, value)
+            print(f"{metered_analyzer.name} calls: {analyzer_stats}")
+
+        meal_breakdowns_llm: dict[date, dict[int, NBreakdown]] = {}
+        for aligned_breakdowns in results:
+            for (meal_date, ms), n_b in aligned_breakdowns:
+                meal_breakdowns_llm.setdefault(meal_date, {})[id(ms)] = n_b
+
+        for dw in work:
+            day_breakdowns_llm = meal_breakdowns_llm.get(dw.date, {})
+            analyzed_meals = [
+                ms for ms in dw.meals_to_analyze if id(ms) in day_breakdowns_llm
+            ]
+            if len(analyzed_meals) < len(dw.meals_to_analyze):
                 print(
                     "%s Wanted breakdowns for %d meals, but got %d breakdowns from LLM"
                     % (
-                        daily_entry.date.isoformat(),
-                        len(meals_to_get_breakdowns),
-                        len(meal_breakdowns_llm),
+                        dw.date.isoformat(),
+                        len(dw.meals_to_analyze),
+                        len(analyzed_meals),
                     )
                 )
-                continue
+            self._cache_breakdowns(
+                analyzed_meals,
+                [day_breakdowns_llm[id(ms)] for ms in analyzed_meals],
+                knowledge_base,
+            )
+            if self._meal_index is not None:
+                self._meal_index.add(
+                    (ms.get_meal_description(), day_breakdowns_llm[id(ms)])
+                    for ms in analyzed_meals
+                )
+            dw.breakdowns = [
+                n_b if n_b is not None else day_breakdowns_llm.get(id(ms))
+                for ms, n_b in zip(dw.meals_to_get_breakdowns, dw.breakdowns)
+            ]
 
-            nm.clear_breakdowns(daily_entry.date)
-            for ms, n_b_section in meals_and_breakdowns:
-                if ms in meals_to_get_breakdowns:
-                    n_b = meal_breakdowns_llm[meals_to_get_breakdowns.index(ms)]
-                else:
-                    assert n_b_section is not None
-                    n_b = n_b_section.breakdown
-                nm.add_meal_breakdown(daily_entry.date, ms, n_b)
+        if self.retry_stats.mismatches:
+            print(
+                "Recovered from %d incomplete LLM responses with %d retries (%.2f extra seconds), %d meals left without breakdowns"
+                % (
+                    self.retry_stats.mismatches,
+                    self.retry_stats.retries,
+                    self.retry_stats.retry_seconds,
+                    self.retry_stats.failed_meals,
+                )
+            )
+
+    @staticmethod
+    def _apply_daily_work(
+        nm: NotesManipulator,
+        dw: _DailyWork,
+    ) -> None:
+        meals_and_breakdowns: list[tuple[DailyEntrySection, NBreakdown | None]] = []
+        new_breakdowns: list[tuple[DailyEntrySection, NBreakdown]] = []
+        for ms, n_b_section in dw.meals_and_breakdowns:
+            n_b = None
+            if ms in dw.meals_to_get_breakdowns:
+                n_b = dw.breakdowns[dw.meals_to_get_breakdowns.index(ms)]
+            if n_b is not None:
+                new_breakdowns.append((ms, n_b))
+            elif n_b_section is not None:
+                n_b = n_b_section.breakdown
+            meals_and_breakdowns.append((ms, n_b))
+
+        if all(n_b is not None for _, n_b in meals_and_breakdowns):
+            # the day is laid out again, in the order of its meals
+            nm.clear_breakdowns(dw.date)
+            for ms, n_b in meals_and_breakdowns:
+                nm.add_meal_breakdown(dw.date, ms, n_b)
+            return
+        # some meals are left for the next run, they keep whatever tables they have
+        for ms, n_b in new_breakdowns:
+            nm.add_meal_breakdown(dw.date, ms, n_b)
 
-        if not notes_need_enrichment:
+    def enrich_notes(
+        self,
+        notes_file: str,
+        knowledge_base: str,
+        nutrition_dir: str,
+        only_date: datetime | None,
+        write_notes_to: str | None,
+        override_existing: bool,
+        metrics: RunMetrics | None = None,
+        budget: RunBudget | None = None,
+    ) -> bool:
+        assert Path(notes_file).exists(), (
+            f"Can't find the {notes_file} file with daily notes."
+        )
+        metrics = metrics or RunMetrics()
+        metrics.count("files")
+        nm = NotesManipulator(
+            notes_file=notes_file, nutrition_dir=nutrition_dir, metrics=metrics
+        )
+
+        with metrics.stage("plan"):
+            kb = KnowledgeBase(knowledge_base)
+            self._index_meals(nm)
+            work = self._plan_daily_work(nm, kb, only_date, override_existing, metrics)
+            work, deferred = self._schedule_daily_work(work, kb, budget)
+        self.deferred_days = sorted(dw.date for dw in deferred)
+        if deferred:
+            print(
+                f"The run budget is spent, {len(deferred)} days are left for the next run."
+            )
+            metrics.count("deferred_days", len(deferred))
+        with metrics.stage("analyze"):
+            checkpoint = None
+            if self._checkpoint:
+                checkpoint = _Checkpoint(
+                    nm, write_notes_to or notes_file, self._CHECKPOINT_INTERVAL_S
+                )
+            try:
+                self._analyze_daily_work(
+                    work, kb, metrics, checkpoint and checkpoint.add_breakdown
+                )
+            except BaseException:
+                if checkpoint is not None:
+                    checkpoint.flush()
+                raise
+        with metrics.stage("apply"):
+            # days are applied in date order regardless of the order their analysis finished in;
+            # every day is, so that the final results replace whatever was checkpointed
+            for dw in sorted(work, key=lambda dw: dw.date):
+                self._apply_daily_work(nm, dw)
+
+        if not work:
             print("No new meals and breakdowns, skipping the file.")
             return False
 
@@ -0,0 +1,103 @@
+import json
+import re
+from hashlib import md5
+from pathlib import Path
+
+from pydantic import BaseModel
+
+_NOTES_FILE_NAME = re.compile(r"^\d{2} [A-Z][a-z]+\.md$")
+
+
+def is_notes_file(path: Path, nutrition_dir: str) -> bool:
+    return (
+        path.parent.name.isdigit()
+        and path.parent.name != nutrition_dir
+        and _NOTES_FILE_NAME.match(path.name) is not None
+    )
+
+
+def discover_notes_files(daily_notes_dir: str, nutrition_dir: str) -> list[Path]:
+    """Finds every `{year}/{%m %B}.md` daily notes file, oldest first."""
+    notes_files = [
+        path
+        for path in Path(daily_notes_dir).glob("*/*.md")
+        if is_notes_file(path, nutrition_dir)
+    ]
+    return sorted(notes_files, key=lambda p: (p.parent.name, p.name))
+
+
+class FileStamp(BaseModel):
+    size: int
+    mtime_ns: int
+    md5: str
+
+    @classmethod
+    def of(cls, path: Path, content_hash: str | None = None) -> "FileStamp":
+        stat = path.stat()
+        return cls(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            md5=content_hash or md5(path.read_bytes()).hexdigest(),
+        )
+
+
+def check_file_stamp(
+    path: Path, stamp: FileStamp | None
+) -> tuple[bool, FileStamp | None]:
+    """Whether the file changed since its stamp was taken, and its new stamp if it was only touched.
+
+    The file is only read when its size or mtime changed; a file that was touched, but not
+    modified, isn't changed, and storing its new stamp spares reading it the next time.
+    """
+    if stamp is None:
+        return True, None
+    stat = path.stat()
+    if (stat.st_size, stat.st_mtime_ns) == (stamp.size, stamp.mtime_ns):
+        return False, None
+    content_hash = md5(path.read_bytes()).hexdigest()
+    if content_hash != stamp.md5:
+        return True, None
+    return False, FileStamp(
+        size=stat.st_size, mtime_ns=stat.st_mtime_ns, md5=content_hash
+    )
+
+
+class NotesManifest:
+    """Remembers the (size, mtime, content hash) of processed notes files.
+
+    A file is only read when its size or mtime changed since it was recorded, and only
+    reported as changed when its content did too.
+    """
+
+    def __init__(self, manifest_file: str) -> None:
+        self._manifest_file = Path(manifest_file)
+        self._entries: dict[str, FileStamp] = {}
+        if self._manifest_file.exists():
+            self._entries = {
+                path: FileStamp.model_validate(entry)
+                for path, entry in json.loads(self._manifest_file.read_text()).items()
+            }
+
+    def has_changed(self, notes_file: Path) -> bool:
+        has_changed, stamp = check_file_stamp(
+            notes_file, self._entries.get(str(notes_file))
+        )
+        if stamp is not None:
+            self._entries[str(notes_file)] = stamp
+        return has_changed
+
+    def get_changed(self, notes_files: list[Path]) -> list[Path]:
+        return [nf for nf in notes_files if self.has_changed(nf)]
+
+    def record(self, notes_file: Path) -> None:
+        self._entries[str(notes_file)] = FileStamp.of(notes_file)
+
+    def save(self) -> None:
+        tmp_file = self._manifest_file.with_name(f".{self._manifest_file.name}.tmp")
+        tmp_file.write_text(
+            json.dumps(
+                {path: entry.model_dump() for path, entry in self._entries.items()},
+                indent=2,
+            )
+        )
+        tmp_file.replace(self._manifest_file)
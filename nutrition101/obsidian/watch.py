@@ -0,0 +1,181 @@
+"""Watches the daily notes files for changes: with inotify on Linux, by polling elsewhere."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Self
+
+from .vault import discover_notes_files, is_notes_file
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = os.O_CLOEXEC
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class INotesWatcher(ABC):
+    def __init__(self, daily_notes_dir: str, nutrition_dir: str) -> None:
+        self._daily_notes_dir = Path(daily_notes_dir)
+        self._nutrition_dir = nutrition_dir
+
+    @abstractmethod
+    def get_changes(self, timeout: float | None) -> set[Path]:
+        """Waits up to `timeout` seconds (forever if None) for daily notes files to change."""
+
+    def close(self) -> None: ...
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class InotifyNotesWatcher(INotesWatcher):
+    """Watches the daily notes dir and its year dirs, new year dirs are picked up on creation."""
+
+    _MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+    def __init__(self, daily_notes_dir: str, nutrition_dir: str) -> None:
+        super().__init__(daily_notes_dir, nutrition_dir)
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        except (AttributeError, OSError) as e:
+            raise OSError("inotify isn't available.") from e
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed.")
+        self._dirs: dict[int, Path] = {}
+        try:
+            self._add_watch(self._daily_notes_dir)
+            for path in self._daily_notes_dir.iterdir():
+                if path.is_dir() and path.name.isdigit():
+                    self._add_watch(path)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self._MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {path}.")
+        self._dirs[wd] = path
+
+    def _read_changes(self) -> set[Path]:
+        changes = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & _IN_Q_OVERFLOW:
+                # some events were lost, the caller filters out the unchanged files
+                changes.update(
+                    discover_notes_files(
+                        str(self._daily_notes_dir), self._nutrition_dir
+                    )
+                )
+                continue
+            if wd not in self._dirs:
+                continue
+            path = self._dirs[wd] / name
+            if mask & _IN_ISDIR:
+                if path.parent == self._daily_notes_dir and name.isdigit():
+                    self._add_watch(path)
+                    # files synced before the watch was added
+                    changes.update(
+                        p
+                        for p in path.glob("*.md")
+                        if is_notes_file(p, self._nutrition_dir)
+                    )
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and is_notes_file(
+                path, self._nutrition_dir
+            ):
+                changes.add(path)
+        return changes
+
+    def get_changes(self, timeout: float | None) -> set[Path]:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - monotonic(), 0)
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return set()
+            if changes := self._read_changes():
+                return changes
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingNotesWatcher(INotesWatcher):
+    """Compares the size and mtime of the daily notes files every `poll_interval` seconds."""
+
+    def __init__(
+        self, daily_notes_dir: str, nutrition_dir: str, poll_interval: float
+    ) -> None:
+        super().__init__(daily_notes_dir, nutrition_dir)
+        self._poll_interval = poll_interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for path in discover_notes_files(
+            str(self._daily_notes_dir), self._nutrition_dir
+        ):
+            stat = path.stat()
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def get_changes(self, timeout: float | None) -> set[Path]:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - monotonic()
+            sleep(
+                self._poll_interval
+                if remaining is None
+                else max(min(self._poll_interval, remaining), 0)
+            )
+            snapshot = self._take_snapshot()
+            changes = {
+                path
+                for path, stat in snapshot.items()
+                if self._snapshot.get(path) != stat
+            }
+            self._snapshot = snapshot
+            if changes or (deadline is not None and monotonic() >= deadline):
+                return changes
+
+
+def make_notes_watcher(
+    daily_notes_dir: str, nutrition_dir: str, poll_interval: float
+) -> INotesWatcher:
+    try:
+        return InotifyNotesWatcher(daily_notes_dir, nutrition_dir)
+    except OSError:
+        return PollingNotesWatcher(daily_notes_dir, nutrition_dir, poll_interval)
+
+
+def watch_notes_files(
+    watcher: INotesWatcher, debounce_seconds: float
+) -> Iterator[list[Path]]:
+    """Yields the changed daily notes files once they've been quiet for `debounce_seconds`.
+
+    Syncthing writes a file in a burst of events, and a note is often edited a few times in a row.
+    """
+    while True:
+        changes = watcher.get_changes(timeout=None)
+        while more_changes := watcher.get_changes(timeout=debounce_seconds):
+            changes |= more_changes
+        yield sorted(changes)
@@ -0,0 +1,156 @@
+"""Columnar store of the breakdowns in the vault, for questions across days."""
+
+from collections.abc import Iterable
+from datetime import date
+
+import numpy as np
+
+from nutrition101.domain import NUTRIENTS, NEntry
+from nutrition101.obsidian.markdown import get_item_name, parse_meal_breakdown_entries
+from nutrition101.obsidian.vault import discover_notes_files
+
+# calories per gram
+_MACROS = {"protein_g": 4, "carbs_g": 4, "fat_g": 9}
+
+
+def _to_day(d: date) -> np.datetime64:
+    return np.datetime64(d, "D")
+
+
+class NutritionStore:
+    """Every breakdown entry as a row: one int array per nutrient, plus date, meal and item indices.
+
+    Rows are sorted by date, so selecting a date range is two binary searches and the
+    per-day totals are sums over contiguous slices.
+    """
+
+    def __init__(
+        self,
+        dates: np.ndarray,
+        meals: np.ndarray,
+        items: np.ndarray,
+        meal_names: list[str],
+        item_names: list[str],
+        nutrients: dict[str, np.ndarray],
+    ) -> None:
+        self.dates = dates
+        self.meals = meals
+        self.items = items
+        self.meal_names = meal_names
+        self.item_names = item_names
+        self.nutrients = nutrients
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @classmethod
+    def from_entries(cls, rows: Iterable[tuple[date, str, NEntry]]) -> "NutritionStore":
+        meal_ids: dict[str, int] = {}
+        item_ids: dict[str, int] = {}
+        dates, meals, items = [], [], []
+        nutrients: dict[str, list[int]] = {n: [] for n in NUTRIENTS}
+        for day, meal_name, entry in rows:
+            dates.append(day)
+            meals.append(meal_ids.setdefault(meal_name, len(meal_ids)))
+            items.append(item_ids.setdefault(get_item_name(entry), len(item_ids)))
+            for nutrient, values in nutrients.items():
+                values.append(getattr(entry, nutrient))
+
+        order = np.argsort(np.array(dates, dtype="datetime64[D]"), kind="stable")
+        return cls(
+            dates=np.array(dates, dtype="datetime64[D]")[order],
+            meals=np.array(meals, dtype=np.int32)[order],
+            items=np.array(items, dtype=np.int32)[order],
+            meal_names=list(meal_ids),
+            item_names=list(item_ids),
+            nutrients={
+                n: np.array(values, dtype=np.int64)[order]
+                for n, values in nutrients.items()
+            },
+        )
+
+    @classmethod
+    def load(cls, daily_notes_dir: str, nutrition_dir: str) -> "NutritionStore":
+        """Loads the breakdown tables of every daily notes file in the vault."""
+
+        def iter_rows():
+            for notes_file in discover_notes_files(daily_notes_dir, nutrition_dir):
+                n101_notes = notes_file.parent / nutrition_dir / notes_file.name
+                if not n101_notes.exists():
+                    continue
+                for day, meal_name, _, entry in parse_meal_breakdown_entries(
+                    n101_notes.read_text()
+                ):
+                    yield day, meal_name, entry
+
+        return cls.from_entries(iter_rows())
+
+    def select(
+        self, start: date | None = None, end: date | None = None
+    ) -> "NutritionStore":
+        """The rows from `start` to `end`, both inclusive."""
+        lo = 0 if start is None else np.searchsorted(self.dates, _to_day(start), "left")
+        hi = (
+            len(self)
+            if end is None
+            else np.searchsorted(self.dates, _to_day(end), "right")
+        )
+        return NutritionStore(
+            dates=self.dates[lo:hi],
+            meals=self.meals[lo:hi],
+            items=self.items[lo:hi],
+            meal_names=self.meal_names,
+            item_names=self.item_names,
+            nutrients={n: values[lo:hi] for n, values in self.nutrients.items()},
+        )
+
+    def daily_totals(self) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """The logged days and each nutrient's total per day; days without breakdowns are left out."""
+        if not len(self):
+            return self.dates, {n: values for n, values in self.nutrients.items()}
+        starts = np.flatnonzero(np.r_[True, self.dates[1:] != self.dates[:-1]])
+        return self.dates[starts], {
+            n: np.add.reduceat(values, starts) for n, values in self.nutrients.items()
+        }
+
+    def rolling_average(
+        self, nutrient: str, window: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The average daily total over the logged days of every `window` calendar days.
+
+        Returns the last day of each window and the average, NaN if no day in it was logged.
+        """
+        days, totals = self.daily_totals()
+        if not len(days):
+            return days, np.array([], dtype=np.float64)
+        calendar = np.arange(days[0], days[-1] + np.timedelta64(1, "D"))
+        positions = (days - days[0]).astype(np.int64)
+        values = np.zeros(len(calendar))
+        logged = np.zeros(len(calendar))
+        values[positions] = totals[nutrient]
+        logged[positions] = 1
+        window = min(window, len(calendar))
+        value_sums = np.cumsum(np.r_[0.0, values])
+        value_sums = value_sums[window:] - value_sums[:-window]
+        logged_days = np.cumsum(np.r_[0.0, logged])
+        logged_days = logged_days[window:] - logged_days[:-window]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.where(logged_days > 0, value_sums / logged_days, np.nan)
+        return calendar[window - 1 :], averages
+
+    def macro_ratios(self) -> dict[str, float]:
+        """The share of the calories from protein, carbs and fat."""
+        calories = {
+            n: float(self.nutrients[n].sum()) * kcal for n, kcal in _MACROS.items()
+        }
+        total = sum(calories.values())
+        return {n: (c / total if total else 0.0) for n, c in calories.items()}
+
+    def trend(self, nutrient: str) -> float:
+        """The least-squares change of the daily total per day, 0 with fewer than 2 logged days."""
+        days, totals = self.daily_totals()
+        if len(days) < 2:
+            return 0.0
+        x = (days - days[0]).astype(np.float64)
+        slope, _ = np.polyfit(x, totals[nutrient].astype(np.float64), 1)
+        return float(slope)
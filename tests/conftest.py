@@ -1,3 +1,6 @@
+import shutil
+from pathlib import Path
+
 import pytest
 
 from nutrition101.domain import NBreakdown
@@ -13,3 +16,30 @@ def llm_analyzer() -> ILLMAnalyzer:
             return []
 
     return TestAnalyzer()
+
+
+@pytest.fixture()
+def daily_notes() -> str:
+    return "daily1.md"
+
+
+@pytest.fixture()
+def nutrition_dir() -> str:
+    return "n101"
+
+
+@pytest.fixture()
+def kbs() -> str:
+    return "A Knowledge Base"
+
+
+@pytest.fixture()
+def staged_notes_file(daily_notes: str):
+    data_dir = Path(__file__).parent / "data/"
+    staging_area = data_dir / "staging/"
+    shutil.rmtree(staging_area, ignore_errors=True)
+    staging_area.mkdir()
+    staged_notes_file = staging_area / daily_notes
+    shutil.copy(data_dir / daily_notes, staged_notes_file)
+    yield staged_notes_file
+    shutil.rmtree(staging_area)
@@ -0,0 +1,182 @@
+from flexmock import flexmock
+
+from nutrition101.llm import (
+    BatchPlanner,
+    BatchRetryStats,
+    ILLMAnalyzer,
+    IncompleteOutputError,
+    KnowledgeBase,
+    MealBatch,
+    get_batch_breakdowns,
+)
+from nutrition101.obsidian import NotesManipulator, ObsidianNotesEnricher
+
+from .fixtures import NBreakdownFactory
+
+
+def test_it_packs_meals_into_batches():
+    meals = [(idx, "1 cup rice, 2 eggs, 1 apple") for idx in range(10)]
+
+    (batch,) = BatchPlanner(prompt_token_budget=10_000, max_output_tokens=8192).plan(
+        meals, KnowledgeBase("A Knowledge Base")
+    )
+    assert batch.keys == list(range(10))
+
+    # the output of 10 meals doesn't fit into 1024 tokens
+    batches = BatchPlanner(prompt_token_budget=10_000, max_output_tokens=1024).plan(
+        meals, KnowledgeBase("A Knowledge Base")
+    )
+    assert len(batches) > 1
+    assert [key for b in batches for key in b.keys] == list(range(10))
+
+    # a prompt budget smaller than the static prompt still makes progress
+    batches = BatchPlanner(prompt_token_budget=10, max_output_tokens=8192).plan(
+        meals, KnowledgeBase("")
+    )
+    assert [len(b) for b in batches] == [1] * 10
+
+
+def test_it_splits_batches_with_incomplete_output(llm_analyzer: ILLMAnalyzer):
+    batch = MealBatch([(idx, f"meal {idx}") for idx in range(4)])
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        if len(meal_descriptions) > 1:
+            raise IncompleteOutputError()
+        return [NBreakdownFactory.build()]
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    ).times(7)
+    aligned = get_batch_breakdowns(llm_analyzer, batch, KnowledgeBase(""))
+    assert [key for key, _ in aligned] == [0, 1, 2, 3]
+
+
+def test_it_keeps_breakdowns_streamed_before_the_output_is_cut_off(
+    llm_analyzer: ILLMAnalyzer,
+):
+    batch = MealBatch([(idx, f"meal {idx}") for idx in range(4)])
+    calls = []
+
+    def iter_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        calls.append(meal_descriptions)
+        yield from NBreakdownFactory.build_batch(min(len(meal_descriptions), 3))
+        if len(meal_descriptions) > 3:
+            raise IncompleteOutputError()
+
+    flexmock(llm_analyzer).should_receive("iter_meal_breakdowns").replace_with(
+        iter_meal_breakdowns
+    )
+    streamed = []
+    stats = BatchRetryStats()
+    aligned = get_batch_breakdowns(
+        llm_analyzer,
+        batch,
+        KnowledgeBase(""),
+        stats,
+        on_breakdown=lambda key, n_b: streamed.append((key, n_b)),
+    )
+
+    # only the meal that was cut off is asked for again
+    assert calls == [[f"meal {idx}" for idx in range(4)], ["meal 3"]]
+    assert [key for key, _ in aligned] == [0, 1, 2, 3]
+    assert streamed == aligned
+    assert (stats.mismatches, stats.retries) == (1, 1)
+
+
+def test_it_enriches_notes_with_cross_day_batches(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    knowledge_base = "A knowledge_base"
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    meal_descriptions = [
+        s.get_meal_description()
+        for de in nm.source_entries
+        for s in de.sections
+        if s.is_meal
+    ]
+    calls = []
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        calls.append(meal_descriptions)
+        return NBreakdownFactory.build_batch(len(meal_descriptions))
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    )
+
+    ObsidianNotesEnricher(
+        analyzer=llm_analyzer, batch_token_budget=100_000
+    ).enrich_notes(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base=knowledge_base,
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+    )
+
+    assert len(calls) < len(nm.source_entries)
+    assert [d for call in calls for d in call] == meal_descriptions
+
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    assert [de.date for de in nm.n101_entries] == [de.date for de in nm.source_entries]
+    assert all(nm.do_all_meals_have_breakdowns(de.date) for de in nm.source_entries)
+
+
+def test_it_bisects_batches_with_wrong_breakdowns_count(llm_analyzer: ILLMAnalyzer):
+    batch = MealBatch([(idx, f"meal {idx}") for idx in range(4)])
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        if meal_descriptions == ["meal 2"]:
+            # the model split a single meal into two
+            return NBreakdownFactory.build_batch(2)
+        if "meal 3" in meal_descriptions:
+            return NBreakdownFactory.build_batch(len(meal_descriptions) - 1)
+        return NBreakdownFactory.build_batch(len(meal_descriptions))
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    )
+    stats = BatchRetryStats()
+    aligned = get_batch_breakdowns(llm_analyzer, batch, KnowledgeBase(""), stats)
+
+    assert [key for key, _ in aligned] == [0, 1, 2]
+    assert len(aligned[2][1].entries) == 10
+    assert (stats.mismatches, stats.retries, stats.failed_meals) == (4, 4, 1)
+
+
+def test_it_keeps_aligned_breakdowns_of_a_day(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    jul_01 = nm.source_entries[0]
+    tea = [s for s in jul_01.sections if s.is_meal][-1]
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        if tea.get_meal_description() in meal_descriptions:
+            return NBreakdownFactory.build_batch(len(meal_descriptions) - 1)
+        return NBreakdownFactory.build_batch(len(meal_descriptions))
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    )
+    notes_enricher = ObsidianNotesEnricher(analyzer=llm_analyzer)
+    notes_enricher.enrich_notes(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base="A knowledge_base",
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+    )
+    assert notes_enricher.retry_stats.failed_meals == 1
+
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    meals_and_breakdowns = nm.get_meal_breakdowns(jul_01.date)
+    assert [n_b is not None for _, n_b in meals_and_breakdowns] == [
+        True,
+        True,
+        True,
+        True,
+        False,
+    ]
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+from flexmock import flexmock
+
+from nutrition101.llm import BreakdownCache, ILLMAnalyzer
+from nutrition101.obsidian import NotesManipulator, ObsidianNotesEnricher
+
+from .fixtures import NBreakdownFactory
+
+
+@pytest.fixture()
+def cache(tmp_path: Path):
+    cache = BreakdownCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_it_caches_breakdowns(cache: BreakdownCache):
+    breakdown = NBreakdownFactory.build()
+    key = cache.make_key("meal-hash", "analyzer", "A Knowledge Base")
+    assert cache.get(key) is None
+
+    cache.put(key, breakdown)
+    assert cache.get(key) == breakdown
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a different knowledge base is a different key
+    assert cache.get(cache.make_key("meal-hash", "analyzer", "Another KB")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_it_evicts_breakdowns(tmp_path: Path):
+    cache = BreakdownCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for idx in range(3):
+        cache.put(cache.make_key(f"meal-{idx}", "analyzer", None), NBreakdownFactory())
+    assert cache.evict() == 1
+    assert len(cache) == 2
+    cache.close()
+
+    cache = BreakdownCache(str(tmp_path / "cache.sqlite"), max_age=timedelta(0))
+    assert len(cache) == 0
+    cache.close()
+
+
+def test_it_enriches_notes_from_cache(
+    staged_notes_file: str,
+    nutrition_dir: str,
+    llm_analyzer: ILLMAnalyzer,
+    cache: BreakdownCache,
+):
+    knowledge_base = "A knowledge_base"
+    notes_enricher = ObsidianNotesEnricher(analyzer=llm_analyzer, cache=cache)
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    for de in nm.source_entries:
+        meal_descriptions = [s.get_meal_description() for s in de.sections if s.is_meal]
+        flexmock(llm_analyzer).should_receive("get_meal_breakdowns").with_args(
+            meal_descriptions, knowledge_base
+        ).and_return(NBreakdownFactory.build_batch(len(meal_descriptions))).once()
+
+    enrich_kwargs = dict(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base=knowledge_base,
+        only_date=None,
+        write_notes_to=None,
+    )
+    notes_enricher.enrich_notes(override_existing=False, **enrich_kwargs)
+    n101_notes = Path(staged_notes_file).parent / nutrition_dir / "daily1.md"
+    n101_content = n101_notes.read_text()
+
+    # overriding existing breakdowns asks for new ones, and caches them
+    for de in nm.source_entries:
+        meal_descriptions = [s.get_meal_description() for s in de.sections if s.is_meal]
+        flexmock(llm_analyzer).should_receive("get_meal_breakdowns").with_args(
+            meal_descriptions, knowledge_base
+        ).and_return(NBreakdownFactory.build_batch(len(meal_descriptions))).once()
+    assert notes_enricher.enrich_notes(override_existing=True, **enrich_kwargs)
+    overridden_n101_content = n101_notes.read_text()
+    assert overridden_n101_content != n101_content
+    assert cache.hits == 0
+
+    # the breakdowns are gone from the notes, they are served by the cache
+    n101_notes.unlink()
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").never()
+    assert notes_enricher.enrich_notes(override_existing=False, **enrich_kwargs)
+    assert n101_notes.read_text() == overridden_n101_content
+    assert cache.hits == len(cache)
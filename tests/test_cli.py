@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from click.testing import CliRunner
+from flexmock import flexmock
+
+from nutrition101 import application, cli
+from nutrition101.llm import ILLMAnalyzer
+
+from .fixtures import NBreakdownFactory
+
+
+def test_it_imports_analyzers_lazily():
+    # the provider SDKs are only imported once an analyzer is needed
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, nutrition101.cli; print(*sys.modules)"],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent.parent,
+    ).stdout.split()
+    for module in ("anthropic", "httpx", "magentic", "openai", "telethon"):
+        assert module not in output
+
+
+def test_it_reports_missing_config(tmp_path: Path):
+    (tmp_path / "2025").mkdir()
+    (tmp_path / "2025/01 January.md").write_text("01/01/2025")
+    flexmock(cli).should_receive("configure_logging")
+    flexmock(application).should_receive("_get_config").and_return({})
+    application.get_analyzer.cache_clear()
+
+    result = CliRunner().invoke(
+        cli.enrich_notes, [str(tmp_path), "n101", "--vault", "--analyzer", "grok"]
+    )
+    assert result.exit_code == 1
+    assert "config.ini is missing the [LLM] GROK_API_KEY setting." in result.output
+
+
+def test_it_reads_each_years_knowledge_base(tmp_path: Path, llm_analyzer: ILLMAnalyzer):
+    for year in ("2024", "2025"):
+        (tmp_path / year / "nutrition").mkdir(parents=True)
+        (tmp_path / year / "nutrition/knowledge_base.md").write_text(f"{year} recipes")
+        (tmp_path / year / "01 January.md").write_text(
+            f"01/01/{year}\n\n==breakfast==\n2 eggs"
+        )
+    # the default nutrition dir isn't the one used
+    (tmp_path / "2025/n101").mkdir()
+    (tmp_path / "2025/n101/knowledge_base.md").write_text("n101 recipes")
+    flexmock(cli).should_receive("configure_logging")
+    flexmock(cli).should_receive("_get_analyzer").and_return(llm_analyzer)
+    for year in ("2024", "2025"):
+        flexmock(llm_analyzer).should_receive("get_meal_breakdowns").with_args(
+            ["2 eggs"], f"{year} recipes"
+        ).and_return(NBreakdownFactory.build_batch(1)).once()
+
+    result = CliRunner().invoke(
+        cli.enrich_notes,
+        [str(tmp_path), "nutrition", "--vault", "--analyzer", "grok"],
+    )
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "2024/nutrition/01 January.md").exists()
@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+from nutrition101.domain import NBreakdown
+from nutrition101.llm import HedgedAnalyzer, ILLMAnalyzer, MeteredAnalyzer
+from nutrition101.metrics import RunMetrics
+from nutrition101.obsidian import ObsidianNotesEnricher
+
+from .fixtures import NBreakdownFactory
+
+
+class _Analyzer(ILLMAnalyzer):
+    def __init__(
+        self, name: str, latency_s: float = 0.0, breakdowns: int | None = None
+    ) -> None:
+        self._name = name
+        self.latency_s = latency_s
+        # how many breakdowns to return, one per meal by default
+        self.breakdowns = breakdowns
+        self.error: Exception | None = None
+        self.calls = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        self.calls += 1
+        time.sleep(self.latency_s)
+        if self.error is not None:
+            raise self.error
+        return NBreakdownFactory.build_batch(
+            len(meal_descriptions) if self.breakdowns is None else self.breakdowns
+        )
+
+
+def test_it_hedges_slow_calls():
+    primary, secondary = _Analyzer("slow", latency_s=0.5), _Analyzer("fast")
+    analyzer = HedgedAnalyzer(primary, secondary, hedge_after_s=0.05)
+
+    start = time.perf_counter()
+    assert len(analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None)) == 2
+    assert time.perf_counter() - start < 0.5
+    assert (analyzer.stats.hedged_calls, analyzer.stats.wins) == (1, {"fast": 1})
+
+    # a fast primary isn't hedged
+    primary.latency_s = 0.0
+    analyzer.get_meal_breakdowns(["meal 1"], None)
+    assert secondary.calls == 1
+    assert analyzer.stats.wins == {"fast": 1, "slow": 1}
+
+
+def test_it_falls_back_on_failed_calls():
+    primary, secondary = _Analyzer("broken", breakdowns=1), _Analyzer("other")
+    analyzer = HedgedAnalyzer(primary, secondary, hedge_after_s=10)
+
+    assert len(analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None)) == 2
+    assert (analyzer.stats.fallbacks, analyzer.stats.wins) == (1, {"other": 1})
+
+    # without a complete answer, the primary's is returned
+    secondary.error = TimeoutError()
+    assert len(analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None)) == 1
+    primary.error = ValueError()
+    with pytest.raises(ValueError):
+        analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None)
+    assert analyzer.stats.calls == 3
+
+
+def test_it_hedges_after_the_observed_p90_latency():
+    analyzer = HedgedAnalyzer(_Analyzer("primary"), _Analyzer("secondary"))
+    assert analyzer.get_hedge_after_s() == HedgedAnalyzer._DEFAULT_HEDGE_AFTER_S
+
+    for _ in range(HedgedAnalyzer._MIN_SAMPLES):
+        analyzer.get_meal_breakdowns(["meal 1"], None)
+    assert analyzer.get_hedge_after_s() < 1
+
+
+def test_it_meters_the_hedged_analyzers_separately():
+    metrics = RunMetrics()
+    analyzer = HedgedAnalyzer(
+        _Analyzer("slow", latency_s=0.3), _Analyzer("fast"), hedge_after_s=0.05
+    ).with_analyzers(lambda a: MeteredAnalyzer(a, metrics))
+
+    analyzer.get_meal_breakdowns(["meal 1"], None)
+    time.sleep(0.4)
+    assert {c.analyzer: c.outcome for c in metrics.calls} == {
+        "fast": "ok",
+        "slow": "cancelled",
+    }
+
+
+def test_it_shuts_its_pool_down_on_close():
+    analyzer = HedgedAnalyzer(_Analyzer("primary"), _Analyzer("secondary"))
+    metered = analyzer.with_analyzers(lambda a: a)
+    # the copies share the pool of the analyzer they're made of
+    metered.close()
+    assert len(metered.get_meal_breakdowns(["meal 1"], None)) == 1
+    assert metered.get_stats() == {
+        "hedged_calls": 0,
+        "hedge_fallbacks": 0,
+        "wins:primary": 1,
+    }
+
+    analyzer.close()
+    with pytest.raises(RuntimeError):
+        analyzer.get_meal_breakdowns(["meal 1"], None)
+
+
+def test_the_enricher_counts_the_hedged_calls(
+    staged_notes_file: str, nutrition_dir: str
+):
+    metrics = RunMetrics()
+    analyzer = HedgedAnalyzer(
+        _Analyzer("slow", latency_s=0.2), _Analyzer("fast"), hedge_after_s=0.05
+    )
+    ObsidianNotesEnricher(analyzer=analyzer).enrich_notes(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base="",
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+        metrics=metrics,
+    )
+    analyzer.close()
+
+    counters = metrics.get_report("enrich-notes").counters
+    assert (counters["hedged_calls"], counters["wins:fast"]) == (3, 3)
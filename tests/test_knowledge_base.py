@@ -0,0 +1,59 @@
+from nutrition101.llm import KnowledgeBase
+
+KNOWLEDGE_BASE = """All the olive oil is extra virgin.
+
+## Pork plov
+aliases: plov, pilaf
+2lb pork, 1.7 cup rice, 5 mushrooms. 4 servings.
+
+## Chicken stew
+1 whole chicken, 3 carrots, 2 potatoes. 6 servings.
+
+## Zapekanka
+500g cottage cheese, 2 eggs, 3 tbsp sugar. 6 servings.
+
+## Pork Plov
+3lb pork, 2 cup rice, 1 onion. 6 servings.
+"""
+
+
+def test_it_indexes_recipes():
+    kb = KnowledgeBase(KNOWLEDGE_BASE)
+    assert [r.name for r in kb.recipes] == ["Chicken stew", "Zapekanka", "Pork Plov"]
+
+
+def test_it_selects_mentioned_recipes():
+    kb = KnowledgeBase(KNOWLEDGE_BASE)
+
+    section = kb.get_section(["1 serving PORK plov, 1 tomato", "1/6 zapekanka."])
+    assert section.startswith("All the olive oil is extra virgin.")
+    assert "Zapekanka" in section
+    # the latest recipe with the same name wins
+    assert "3lb pork" in section and "2lb pork" not in section
+    assert "Chicken stew" not in section
+
+    # a single ingredient isn't a mention of a recipe
+    assert "Chicken stew" not in kb.get_section(["grilled chicken breast"])
+
+
+def test_it_sends_unindexed_knowledge_base_whole():
+    kb = KnowledgeBase("A Knowledge Base")
+    assert not kb.is_indexed
+    assert kb.get_section(["1 cup rice"]) == "A Knowledge Base"
+
+
+def test_it_keeps_sub_headings_in_recipes():
+    kb = KnowledgeBase(
+        "# Recipes\n\n## Pork plov\n\n### Ingredients\n2lb pork, 1.7 cup rice.\n\n"
+        "### Notes\n4 servings.\n\n## Chicken stew\n### Ingredients\n1 whole chicken.\n"
+    )
+    assert [r.name for r in kb.recipes] == ["Pork plov", "Chicken stew"]
+
+    section = kb.get_section(["1 serving pork plov"])
+    assert "2lb pork" in section and "4 servings" in section
+    assert "chicken" not in section
+
+
+def test_it_keeps_the_aliases_of_duplicate_recipes():
+    kb = KnowledgeBase(KNOWLEDGE_BASE)
+    assert "3lb pork" in kb.get_section(["1 bowl of plov"])
@@ -0,0 +1,361 @@
+import inspect
+import json
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+import anthropic
+import httpx
+import openai
+import pytest
+from magentic.chat_model import anthropic_chat_model, openai_chat_model
+from magentic.chat_model.function_schema import get_function_schemas
+from magentic.chat_model.message import AssistantMessage
+
+from nutrition101.domain import NBreakdown
+from nutrition101.llm import (
+    ClaudeNAnalyzer,
+    GrokAnalyzer,
+    HedgedAnalyzer,
+    HttpSettings,
+    IncompleteOutputError,
+    MeteredAnalyzer,
+)
+from nutrition101.metrics import RunMetrics
+from nutrition101.llm.chat_models import (
+    PromptCachingAnthropicChatModel,
+    PromptCachingOpenaiChatModel,
+)
+from nutrition101.llm.prompts import BREAKDOWNS_FROM_MEALS
+
+from .fixtures import NBreakdownFactory
+
+
+@pytest.fixture()
+def breakdowns() -> list[NBreakdown]:
+    return NBreakdownFactory.build_batch(2)
+
+
+@pytest.fixture()
+def tool_name() -> str:
+    return get_function_schemas(None, [Iterable[NBreakdown]])[0].name
+
+
+def _sse(events: list[tuple[str | None, dict]]) -> bytes:
+    return "".join(
+        (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+        for event, data in events
+    ).encode()
+
+
+def _claude_events(
+    tool_name: str, tool_input: str, stop_reason: str = "tool_use"
+) -> list[tuple[str | None, dict]]:
+    usage = {
+        "input_tokens": 20,
+        "output_tokens": 1,
+        "cache_read_input_tokens": 1500,
+        "cache_creation_input_tokens": 300,
+    }
+    return [
+        (
+            "message_start",
+            {
+                "type": "message_start",
+                "message": {
+                    "id": "msg_1",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": "claude",
+                    "content": [],
+                    "stop_reason": None,
+                    "stop_sequence": None,
+                    "usage": usage,
+                },
+            },
+        ),
+        (
+            "content_block_start",
+            {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {
+                    "type": "tool_use",
+                    "id": "toolu_1",
+                    "name": tool_name,
+                    "input": {},
+                },
+            },
+        ),
+        (
+            "content_block_delta",
+            {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {
+                    "type": "input_json_delta",
+                    "partial_json": tool_input,
+                },
+            },
+        ),
+        ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        (
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                "usage": {"output_tokens": 200},
+            },
+        ),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+
+
+def test_claude_caches_the_prompt_prefix(breakdowns: list[NBreakdown], tool_name: str):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        tool_input = json.dumps({"value": [b.model_dump() for b in breakdowns]})
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=_sse(_claude_events(tool_name, tool_input)),
+        )
+
+    analyzer = ClaudeNAnalyzer(api_key="key")
+    analyzer._model._client = anthropic.Anthropic(
+        api_key="key", http_client=httpx.Client(transport=httpx.MockTransport(handler))
+    )
+
+    assert analyzer.get_meal_breakdowns(["meal 1", "meal 2"], "A KB") == breakdowns
+
+    (request,) = requests
+    instructions, knowledge_base = request["system"]
+    assert instructions["text"] == BREAKDOWNS_FROM_MEALS
+    assert knowledge_base["text"].endswith("A KB")
+    assert instructions["cache_control"] == knowledge_base["cache_control"]
+    # only the meal descriptions are outside of the cached prefix
+    ((message,),) = [m["content"] for m in request["messages"]]
+    assert message == {"type": "text", "text": "Meal Descriptions: meal 1|||meal 2"}
+    assert analyzer.usage.cache_read_input_tokens == 1500
+    assert analyzer.usage.cache_creation_input_tokens == 300
+    assert analyzer.usage.output_tokens == 200
+
+
+def test_claude_streams_breakdowns_until_the_output_is_cut_off(
+    breakdowns: list[NBreakdown], tool_name: str
+):
+    tool_input = json.dumps({"value": [b.model_dump() for b in breakdowns]})
+    # cut off in the middle of the second breakdown
+    tool_input = tool_input[: tool_input.index(breakdowns[1].entries[0].item)]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=_sse(
+                _claude_events(tool_name, tool_input, stop_reason="max_tokens")
+            ),
+        )
+
+    analyzer = ClaudeNAnalyzer(api_key="key")
+    analyzer._model._client = anthropic.Anthropic(
+        api_key="key", http_client=httpx.Client(transport=httpx.MockTransport(handler))
+    )
+
+    received = []
+    with pytest.raises(IncompleteOutputError):
+        for breakdown in analyzer.iter_meal_breakdowns(["meal 1", "meal 2"], None):
+            received.append(breakdown)
+    assert received == breakdowns[:1]
+    assert analyzer.usage.output_tokens == 200
+
+
+class _SlowStream(httpx.SyncByteStream):
+    """A response body that stops like a closed socket would."""
+
+    def __init__(self, chunks: list[bytes], delay_s: float) -> None:
+        self._chunks = chunks
+        self._delay_s = delay_s
+        self._closed = threading.Event()
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._chunks:
+            if self._closed.wait(self._delay_s):
+                raise httpx.ReadError("The connection was closed.")
+            yield chunk
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+def test_claude_stops_a_cancelled_call(breakdowns: list[NBreakdown], tool_name: str):
+    tool_input = json.dumps({"value": [b.model_dump() for b in breakdowns]})
+    events = _claude_events(tool_name, tool_input)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        # the tool input arrives a character every 10ms
+        deltas = [_sse(_claude_events(tool_name, char)[2:3]) for char in tool_input]
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            stream=_SlowStream([_sse(events[:2]), *deltas, _sse(events[3:])], 0.01),
+        )
+
+    claude = ClaudeNAnalyzer(api_key="key")
+    claude._model._client = anthropic.Anthropic(
+        api_key="key", http_client=httpx.Client(transport=httpx.MockTransport(handler))
+    )
+
+    class FastAnalyzer(GrokAnalyzer):
+        def iter_meal_breakdowns(self, meal_descriptions, knowledge_base_section):
+            yield from breakdowns
+
+    metrics = RunMetrics()
+    analyzer = HedgedAnalyzer(
+        claude, FastAnalyzer(api_key="key"), hedge_after_s=0.05
+    ).with_analyzers(lambda a: MeteredAnalyzer(a, metrics))
+    assert analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None) == breakdowns
+
+    for _ in range(100):
+        if len(metrics.calls) == 2:
+            break
+        time.sleep(0.01)
+    (call,) = [c for c in metrics.calls if c.analyzer == claude.name]
+    # the losing call stopped reading its response, its usage so far is recorded
+    assert call.outcome == "cancelled"
+    assert call.latency_s < 1
+    assert (call.input_tokens, call.cache_read_input_tokens) == (20, 1500)
+    assert call.is_usage_partial
+    assert claude.usage.calls == 1
+
+
+def test_grok_keeps_the_prompt_prefix_stable(
+    breakdowns: list[NBreakdown], tool_name: str
+):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        tool_call = {
+            "index": 0,
+            "id": "call_1",
+            "type": "function",
+            "function": {
+                "name": tool_name,
+                "arguments": json.dumps(
+                    {"value": [b.model_dump() for b in breakdowns]}
+                ),
+            },
+        }
+        chunk = {
+            "id": "chunk_1",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "grok-3",
+        }
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=_sse(
+                [
+                    (
+                        None,
+                        chunk
+                        | {
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": {
+                                        "role": "assistant",
+                                        "tool_calls": [tool_call],
+                                    },
+                                    "finish_reason": None,
+                                }
+                            ]
+                        },
+                    ),
+                    (
+                        None,
+                        chunk
+                        | {
+                            "choices": [],
+                            "usage": {
+                                "prompt_tokens": 1800,
+                                "completion_tokens": 200,
+                                "total_tokens": 2000,
+                                "prompt_tokens_details": {"cached_tokens": 1500},
+                            },
+                        },
+                    ),
+                ]
+            )
+            + b"data: [DONE]\n\n",
+        )
+
+    analyzer = GrokAnalyzer(api_key="key")
+    analyzer._model._client = openai.OpenAI(
+        api_key="key", http_client=httpx.Client(transport=httpx.MockTransport(handler))
+    )
+
+    assert analyzer.get_meal_breakdowns(["meal 1"], "A KB") == breakdowns
+    assert analyzer.get_meal_breakdowns(["meal 2"], "A KB") == breakdowns
+
+    first, second = [r["messages"] for r in requests]
+    assert first[:2] == second[:2]
+    assert [m["role"] for m in first] == ["system", "system", "user"]
+    assert analyzer.usage.calls == 2
+    assert analyzer.usage.cache_read_input_tokens == 3000
+
+
+def test_analyzers_can_use_another_api_host():
+    claude = ClaudeNAnalyzer(api_key="key", base_url="http://127.0.0.1:8101")
+    grok = GrokAnalyzer(api_key="key", base_url="http://127.0.0.1:8101/v1")
+    assert str(claude._model._client.base_url) == "http://127.0.0.1:8101"
+    assert str(grok._model._client.base_url) == "http://127.0.0.1:8101/v1/"
+    assert str(GrokAnalyzer(api_key="key")._model._client.base_url) == (
+        "https://api.x.ai/v1/"
+    )
+
+
+def test_analyzers_share_a_pooled_http_client_per_provider():
+    settings = HttpSettings(read_timeout_s=30, max_retries=6)
+    claude = ClaudeNAnalyzer(api_key="key", http_settings=settings)
+    other_claude = ClaudeNAnalyzer(api_key="other key", http_settings=settings)
+    grok = GrokAnalyzer(api_key="key", http_settings=settings)
+
+    assert claude._model._client._client is other_claude._model._client._client
+    assert claude._model._client._client is not grok._model._client._client
+    for client in (claude._model._client, grok._model._client):
+        assert client.max_retries == 6
+        assert (client.timeout.connect, client.timeout.read) == (5.0, 30)
+
+
+def test_the_magentic_internals_are_as_expected():
+    # the chat models call these private magentic helpers...
+    for helper, parameters in [
+        (anthropic_chat_model._combine_messages, ["messages"]),
+        (anthropic_chat_model._if_given, ["value"]),
+        (openai_chat_model._add_missing_tool_calls_responses, ["messages"]),
+        (openai_chat_model._if_given, ["value"]),
+        (AssistantMessage._with_usage, ["content", "usage_ref"]),
+    ]:
+        assert list(inspect.signature(helper).parameters) == parameters
+    assert anthropic_chat_model._if_given(None) is anthropic.NOT_GIVEN
+    assert openai_chat_model._if_given(None) is openai.NOT_GIVEN
+
+    # ...and set the attributes magentic's __init__ would, but its async client
+    for model_type, magentic_model_type in [
+        (PromptCachingAnthropicChatModel, anthropic_chat_model.AnthropicChatModel),
+        (PromptCachingOpenaiChatModel, openai_chat_model.OpenaiChatModel),
+    ]:
+        model = model_type("model", api_key="key", max_tokens=10, temperature=0.5)
+        magentic_model = magentic_model_type(
+            "model", api_key="key", max_tokens=10, temperature=0.5
+        )
+        assert vars(model).keys() == vars(magentic_model).keys() - {"_async_client"}
+        for name, value in vars(model).items():
+            if name != "_client":
+                assert value == getattr(magentic_model, name)
+        assert (model.model, model.max_tokens, model.temperature) == ("model", 10, 0.5)
@@ -0,0 +1,75 @@
+import logging
+import threading
+from time import sleep
+
+from nutrition101.misc import TelegramLogHandler
+
+
+class RecordingTelegramLogHandler(TelegramLogHandler):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(
+            api_id=1,
+            api_hash="hash",
+            bot_token="token",
+            group_id=1,
+            session="s",
+            **kwargs,
+        )
+        self.messages: list[str] = []
+        self.can_send = threading.Event()
+        self.can_send.set()
+
+    def _send(self, message: str) -> None:
+        self.can_send.wait()
+        self.messages.append(message)
+
+
+def _record(msg: str) -> logging.LogRecord:
+    return logging.LogRecord("n101", logging.INFO, __file__, 1, msg, None, None)
+
+
+def _wait_until_sending(handler: RecordingTelegramLogHandler) -> None:
+    while handler._queue.qsize():
+        sleep(0.001)
+
+
+def test_it_coalesces_records_into_messages():
+    handler = RecordingTelegramLogHandler(min_send_interval=0)
+    handler.can_send.clear()
+    handler.emit(_record("first"))
+    _wait_until_sending(handler)
+    for idx in range(3):
+        handler.emit(_record(f"record {idx}"))
+    handler.emit(_record("x" * 5000))
+    handler.can_send.set()
+    handler.close()
+
+    first, records, long_record = handler.messages
+    assert first == "first\n"
+    assert records == "record 0\n\nrecord 1\n\nrecord 2\n"
+    assert long_record == "x" * 4096
+
+
+def test_it_drops_records_when_telegram_is_slow():
+    handler = RecordingTelegramLogHandler(max_queue_size=2, min_send_interval=0)
+    handler.can_send.clear()
+    handler.emit(_record("sending"))
+    _wait_until_sending(handler)
+    for idx in range(5):
+        handler.emit(_record(f"record {idx}"))
+    handler.can_send.set()
+    handler.close()
+
+    assert handler.messages[1] == (
+        "record 0\n\nrecord 1\n\n... 3 log records were dropped, Telegram is too slow."
+    )
+
+
+def test_it_flushes_with_a_timeout():
+    handler = RecordingTelegramLogHandler(flush_timeout=0.1)
+    handler.can_send.clear()
+    handler.emit(_record("never sent"))
+
+    handler.close()
+    assert handler.messages == []
+    handler.can_send.set()
@@ -0,0 +1,125 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from nutrition101.domain import NBreakdown
+from nutrition101.llm import ILLMAnalyzer, MeteredAnalyzer, TokenUsage
+from nutrition101.llm.base import PromptCacheUsage
+from nutrition101.metrics import (
+    AnalyzerCall,
+    RunMetrics,
+    append_report,
+    write_prometheus_textfile,
+)
+from nutrition101.obsidian import ObsidianNotesEnricher
+
+from .fixtures import NBreakdownFactory
+
+
+class _UsageAnalyzer(ILLMAnalyzer):
+    def __init__(self) -> None:
+        self._usage = TokenUsage()
+
+    @property
+    def name(self) -> str:
+        return "claude:claude-3-7-sonnet-latest"
+
+    @property
+    def usage(self) -> TokenUsage:
+        return self._usage
+
+    def get_meal_breakdowns(
+        self, meal_descriptions: list[str], knowledge_base_section: str | None
+    ) -> list[NBreakdown]:
+        if "boom" in meal_descriptions:
+            raise TimeoutError()
+        self._usage.record(
+            PromptCacheUsage(
+                input_tokens=100,
+                output_tokens=50 * len(meal_descriptions),
+                cache_read_input_tokens=1000,
+                cache_creation_input_tokens=0,
+            )
+        )
+        return NBreakdownFactory.build_batch(len(meal_descriptions))
+
+
+def test_it_meters_analyzer_calls():
+    metrics = RunMetrics()
+    analyzer = MeteredAnalyzer(_UsageAnalyzer(), metrics)
+    analyzer.get_meal_breakdowns(["meal 1", "meal 2"], None)
+    with pytest.raises(TimeoutError):
+        analyzer.get_meal_breakdowns(["boom"], None)
+
+    ok, failed = metrics.calls
+    assert (ok.outcome, ok.meals, ok.output_tokens, ok.cache_read_input_tokens) == (
+        "ok",
+        2,
+        100,
+        1000,
+    )
+    # the failed call didn't spend the tokens of the previous one
+    assert (failed.outcome, failed.input_tokens) == ("TimeoutError", 0)
+
+    stats = metrics.get_report("test").analyzers["claude:claude-3-7-sonnet-latest"]
+    assert (stats.calls, stats.failed_calls, stats.meals) == (2, 1, 3)
+    # 100 input, 100 output and 1000 cache read tokens
+    assert stats.cost_usd == pytest.approx((300 + 1500 + 300) / 1_000_000)
+
+
+def test_it_writes_reports(tmp_path: Path):
+    metrics = RunMetrics()
+    with metrics.stage("parse"):
+        pass
+    metrics.count("files", 2)
+    for latency in (1.0, 3.0):
+        metrics.record_call(
+            AnalyzerCall(
+                analyzer="grok:grok-3", meals=1, latency_s=latency, outcome="ok"
+            )
+        )
+    report = metrics.get_report("enrich-notes")
+
+    metrics_file = tmp_path / "metrics.jsonl"
+    append_report(report, str(metrics_file))
+    append_report(report, str(metrics_file))
+    first, second = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert first == second
+    assert first["counters"] == {"files": 2}
+    assert first["stages"]["parse"]["count"] == 1
+    assert first["analyzers"]["grok:grok-3"]["latency_p95_s"] == 3.0
+
+    textfile = tmp_path / "n101.prom"
+    write_prometheus_textfile(report, str(textfile))
+    lines = textfile.read_text().splitlines()
+    assert "# TYPE n101_last_run_analyzer_latency_seconds gauge" in lines
+    assert (
+        'n101_last_run_analyzer_latency_seconds{command="enrich-notes",analyzer="grok:grok-3",quantile="0.5"} 2.0'
+        in lines
+    )
+    assert 'n101_last_run_counter{command="enrich-notes",counter="files"} 2' in lines
+
+
+def test_enriching_records_stages(staged_notes_file: Path, nutrition_dir: str):
+    metrics = RunMetrics()
+    ObsidianNotesEnricher(analyzer=_UsageAnalyzer()).enrich_notes(
+        notes_file=str(staged_notes_file),
+        knowledge_base="",
+        nutrition_dir=nutrition_dir,
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+        metrics=metrics,
+    )
+    report = metrics.get_report("test")
+    assert set(report.stages) == {
+        "parse",
+        "plan",
+        "analyze",
+        "apply",
+        "render",
+        "write",
+    }
+    assert report.counters["files"] == 1
+    assert report.counters["batches"] == len(metrics.calls) == 3
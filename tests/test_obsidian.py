@@ -1,43 +1,21 @@
-from datetime import date
-import shutil
+import threading
+import time
+from datetime import date, datetime
 from pathlib import Path
 
 import pytest
 from flexmock import flexmock
 
+from nutrition101.llm import IncompleteOutputError, RunBudget
+from nutrition101.llm.knowledge_base import KnowledgeBase
 from nutrition101.llm.models import ILLMAnalyzer
 from nutrition101.obsidian import NotesManipulator, ObsidianNotesEnricher
+from nutrition101.obsidian import markdown
+from nutrition101.obsidian.markdown import DailyEntrySection, parse_daily_entries
 
 from .fixtures import NBreakdownFactory
 
 
-@pytest.fixture()
-def daily_notes() -> str:
-    return "daily1.md"
-
-
-@pytest.fixture()
-def nutrition_dir() -> str:
-    return "n101"
-
-
-@pytest.fixture()
-def kbs() -> str:
-    return "A Knowledge Base"
-
-
-@pytest.fixture()
-def staged_notes_file(daily_notes: str):
-    data_dir = Path(__file__).parent / "data/"
-    staging_area = data_dir / "staging/"
-    shutil.rmtree(staging_area, ignore_errors=True)
-    staging_area.mkdir()
-    staged_notes_file = staging_area / daily_notes
-    shutil.copy(data_dir / daily_notes, staged_notes_file)
-    yield staged_notes_file
-    shutil.rmtree(staging_area)
-
-
 @pytest.fixture()
 def nm(staged_notes_file: str, nutrition_dir: str):
     return NotesManipulator(staged_notes_file, nutrition_dir)
@@ -60,6 +38,41 @@ def test_it_reads_daily_entries(nm: NotesManipulator):
     assert tea.get_meal_name() == "tea"
 
 
+def test_it_parses_only_wanted_days(staged_notes_file: Path):
+    content = staged_notes_file.read_text()
+    jul_01, jul_02, jul_03 = parse_daily_entries(content)
+
+    assert list(parse_daily_entries(content, dates={jul_02.date})) == [jul_02]
+    assert next(parse_daily_entries(content)) == jul_01
+    # a line right above a date belongs to that date, like it always has
+    jul_01, jul_02 = parse_daily_entries(
+        "07/01/2025\n\nsleep\n07/02/2025\n==tea==\nmint"
+    )
+    assert jul_01.sections == []
+    assert [s.content for s in jul_02.sections] == ["sleep\n==tea==\nmint"]
+
+
+def test_sections_are_sequences_of_lines():
+    section = DailyEntrySection(content="[[n101/x.md#^lunch|lunch]]\n2 eggs\n1 toast")
+    assert section.is_meal
+    assert (len(section), section[1], section[1:]) == (
+        3,
+        "2 eggs",
+        ["2 eggs", "1 toast"],
+    )
+    assert section.get_meal_name() == "lunch"
+    assert section.get_meal_description() == "2 eggs.1 toast"
+    assert section == DailyEntrySection(content=section.content)
+    assert section in [
+        DailyEntrySection(content="tea"),
+        DailyEntrySection(section.content),
+    ]
+
+    lines = section.lines
+    lines.append("a snack")
+    assert len(section) == 3
+
+
 def test_it_writes_markdown(
     nm: NotesManipulator, staged_notes_file: str, nutrition_dir: str
 ):
@@ -84,6 +97,125 @@ def test_it_writes_markdown(
     assert len([s for s in jul_01_breakdowns.sections if s.is_meal_n_breakdown]) == 5
 
 
+def test_it_replaces_meal_breakdowns(nm: NotesManipulator):
+    jul_01 = nm.source_entries[0]
+    breakfast, snack, *_ = [s for s in jul_01.sections if s.is_meal]
+    first_b, second_b, snack_b = NBreakdownFactory.build_batch(3)
+
+    nm.add_meal_breakdown(jul_01.date, breakfast, first_b)
+    nm.add_meal_breakdown(jul_01.date, snack, snack_b)
+    # the breakfast section has been linked to its breakdown
+    (linked_breakfast, _), *_ = nm.get_meal_breakdowns(jul_01.date)
+    nm.add_meal_breakdown(jul_01.date, linked_breakfast, second_b)
+
+    (breakfast_nb, snack_nb, *others) = nm.get_meal_breakdowns(jul_01.date)
+    assert breakfast_nb[1].breakdown.get_total_as_entry("breakfast").calories == (
+        second_b.get_total_as_entry("breakfast").calories
+    )
+    assert snack_nb[1].breakdown.get_total_as_entry("snack").calories == (
+        snack_b.get_total_as_entry("snack").calories
+    )
+    assert all(n_b is None for _, n_b in others)
+    n101_sections = nm.n101_entries[0].sections
+    assert len([s for s in n101_sections if s.is_meal_n_breakdown]) == 2
+    # the daily total is rendered once, with a row per meal and the total
+    assert [s.is_daily_n_breakdown for s in n101_sections].count(True) == 1
+    assert n101_sections[-1].is_daily_n_breakdown and len(n101_sections[-1]) == 5
+    assert len([s for s in jul_01.sections if s.has_breakdown_link]) == 3
+
+
+def test_it_puts_back_a_deleted_breakdown_table(
+    nm: NotesManipulator, staged_notes_file: Path, nutrition_dir: str
+):
+    jul_01 = nm.source_entries[0]
+    breakfast, snack, *_ = [s for s in jul_01.sections if s.is_meal]
+    breakfast_b, snack_b, new_breakfast_b = NBreakdownFactory.build_batch(3)
+    nm.add_meal_breakdown(jul_01.date, breakfast, breakfast_b)
+    nm.add_meal_breakdown(jul_01.date, snack, snack_b)
+    nm.write_notes(None)
+
+    # the breakfast table is gone, its anchor is still there
+    [n101_file] = (staged_notes_file.parent / nutrition_dir).glob("*.md")
+    breakfast_table = nm.n101_entries[0].sections[1]
+    assert breakfast_table.is_meal_n_breakdown
+    n101_file.write_text(
+        n101_file.read_text().replace(breakfast_table.content + "\n\n", "", 1)
+    )
+
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    (breakfast, breakfast_nb), (snack, snack_nb), *_ = nm.get_meal_breakdowns(
+        jul_01.date
+    )
+    assert breakfast_nb is None and snack_nb is not None
+    nm.add_meal_breakdown(jul_01.date, breakfast, new_breakfast_b)
+
+    (_, breakfast_nb), (_, snack_nb), *_ = nm.get_meal_breakdowns(jul_01.date)
+    assert breakfast_nb is not None and snack_nb is not None
+    assert breakfast_nb.breakdown.get_total_as_entry("").calories == (
+        new_breakfast_b.get_total_as_entry("").calories
+    )
+    assert snack_nb.breakdown.get_total_as_entry("").calories == (
+        snack_b.get_total_as_entry("").calories
+    )
+    n101_sections = nm.n101_entries[0].sections
+    assert [s.is_meal_n_breakdown for s in n101_sections[:4]] == [
+        False,
+        True,
+        False,
+        True,
+    ]
+
+
+def test_it_writes_only_changed_files(
+    nm: NotesManipulator, staged_notes_file: Path, nutrition_dir: str
+):
+    staged_notes_file.chmod(0o640)
+    jul_01 = nm.source_entries[0]
+    breakfast = next(s for s in jul_01.sections if s.is_meal)
+    breakdown = NBreakdownFactory.build()
+    nm.add_meal_breakdown(jul_01.date, breakfast, breakdown)
+    nm.write_notes(None)
+    assert staged_notes_file.stat().st_mode & 0o777 == 0o640
+    assert sorted(p.name for p in staged_notes_file.parent.rglob("*")) == [
+        staged_notes_file.name,
+        staged_notes_file.name,
+        nutrition_dir,
+    ]
+
+    written = {p: p.stat().st_mtime_ns for p in staged_notes_file.parent.rglob("*.md")}
+    flexmock(Path).should_receive("write_bytes").never()
+    # nothing has changed since
+    nm.write_notes(None)
+    # the breakdown is the same, so are the files
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    (breakfast, _), *_ = nm.get_meal_breakdowns(jul_01.date)
+    nm.add_meal_breakdown(jul_01.date, breakfast, breakdown)
+    nm.write_notes(None)
+    assert written == {
+        p: p.stat().st_mtime_ns for p in staged_notes_file.parent.rglob("*.md")
+    }
+
+
+def test_it_renders_only_changed_days(
+    nm: NotesManipulator, staged_notes_file: Path, nutrition_dir: str
+):
+    jul_01, jul_02, _ = nm.source_entries
+    for de in (jul_01, jul_02):
+        meal = next(s for s in de.sections if s.is_meal)
+        nm.add_meal_breakdown(de.date, meal, NBreakdownFactory.build())
+    nm.write_notes(None)
+
+    (breakfast, _), *_ = nm.get_meal_breakdowns(jul_02.date)
+    nm.add_meal_breakdown(jul_02.date, breakfast, NBreakdownFactory.build())
+    # jul 02 in the notes and in the n101 file
+    flexmock(markdown.DailyEntry).should_call("to_md_content").twice()
+    nm.write_notes(None)
+
+    written = NotesManipulator(staged_notes_file, nutrition_dir)
+    assert written.source_entries == nm.source_entries
+    assert written.n101_entries == nm.n101_entries
+
+
 def test_it_enriches_notes(
     staged_notes_file: str,
     nutrition_dir: str,
@@ -152,3 +284,211 @@ def test_it_enriches_notes(
         override_existing=False,
         write_notes_to=None,
     )
+
+
+def test_it_enriches_days_concurrently(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    days = {
+        s.get_meal_description(): (idx, de.date)
+        for idx, de in enumerate(nm.source_entries)
+        for s in de.sections
+        if s.is_meal
+    }
+    breakdowns = {description: NBreakdownFactory.build() for description in days}
+    in_flight, max_in_flight, lock = 0, 0, threading.Lock()
+    finished = []
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        # the earliest day finishes last
+        idx, day = days[meal_descriptions[0]]
+        time.sleep(0.05 * (len(nm.source_entries) - idx))
+        with lock:
+            in_flight -= 1
+            finished.append(day)
+        return [breakdowns[d] for d in meal_descriptions]
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    )
+    n101_notes = Path(staged_notes_file).parent / nutrition_dir / "daily1.md"
+    enrich_kwargs = dict(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base="A knowledge_base",
+        only_date=None,
+        write_notes_to=None,
+        override_existing=True,
+    )
+
+    ObsidianNotesEnricher(analyzer=llm_analyzer).enrich_notes(**enrich_kwargs)
+    sequential_notes = n101_notes.read_text()
+    finished.clear()
+
+    ObsidianNotesEnricher(analyzer=llm_analyzer, max_concurrency=3).enrich_notes(
+        **enrich_kwargs
+    )
+    assert max_in_flight == 3
+    assert finished == sorted(finished, reverse=True)
+    assert n101_notes.read_text() == sequential_notes
+
+
+def test_it_enriches_today_first_within_the_run_budget(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    meals_by_day = {
+        de.date: [s.get_meal_description() for s in de.sections if s.is_meal]
+        for de in nm.source_entries
+    }
+    first_day, yesterday, today = sorted(meals_by_day)
+    flexmock(markdown).should_receive("get_today_date").and_return(today)
+    kb = KnowledgeBase("A knowledge_base")
+    budget = RunBudget(
+        max_tokens=sum(
+            sum(RunBudget.estimate_tokens(meals_by_day[d], kb))
+            for d in (today, yesterday)
+        )
+    )
+
+    analyzed_days = []
+
+    def get_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        analyzed_days.append(
+            next(d for d, meals in meals_by_day.items() if meals == meal_descriptions)
+        )
+        return NBreakdownFactory.build_batch(len(meal_descriptions))
+
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").replace_with(
+        get_meal_breakdowns
+    )
+    notes_enricher = ObsidianNotesEnricher(analyzer=llm_analyzer)
+    notes_enricher.enrich_notes(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base="A knowledge_base",
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+        budget=budget,
+    )
+    # today, then yesterday; the backlog didn't fit
+    assert analyzed_days == [today, yesterday]
+    assert notes_enricher.deferred_days == [first_day]
+    assert budget.is_spent
+
+
+def test_it_checkpoints_the_breakdowns_received_before_a_failure(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    jul_01 = nm.source_entries[0]
+
+    calls = []
+
+    def iter_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        calls.append(meal_descriptions)
+        if len(calls) > 1:
+            raise TimeoutError()
+        yield from NBreakdownFactory.build_batch(2)
+        raise IncompleteOutputError()
+
+    flexmock(llm_analyzer).should_receive("iter_meal_breakdowns").replace_with(
+        iter_meal_breakdowns
+    )
+    # on the first breakdown, then the second one when the run fails
+    flexmock(NotesManipulator).should_call("write_notes").twice()
+    with pytest.raises(TimeoutError):
+        ObsidianNotesEnricher(analyzer=llm_analyzer, checkpoint=True).enrich_notes(
+            notes_file=staged_notes_file,
+            nutrition_dir=nutrition_dir,
+            knowledge_base="A knowledge_base",
+            only_date=None,
+            write_notes_to=None,
+            override_existing=False,
+        )
+
+    # the first two meals of the first day made it to the notes
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    assert [n_b is not None for _, n_b in nm.get_meal_breakdowns(jul_01.date)] == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+
+
+def test_it_keeps_the_tables_of_meals_without_new_breakdowns(
+    staged_notes_file: Path, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    jul_01 = nm.source_entries[0]
+    for ms in [s for s in jul_01.sections if s.is_meal]:
+        nm.add_meal_breakdown(jul_01.date, ms, NBreakdownFactory.build())
+    nm.write_notes(None)
+    tables = [s for s in nm.n101_entries[0].sections if s.is_meal_n_breakdown]
+
+    # the snack has changed since its breakdown, and no call gets a breakdown
+    staged_notes_file.write_text(
+        staged_notes_file.read_text().replace("10 blueberries", "12 blueberries", 1)
+    )
+    flexmock(llm_analyzer).should_receive("iter_meal_breakdowns").replace_with(
+        lambda meal_descriptions, knowledge_base_section: iter(())
+    )
+    ObsidianNotesEnricher(analyzer=llm_analyzer).enrich_notes(
+        notes_file=str(staged_notes_file),
+        nutrition_dir=nutrition_dir,
+        knowledge_base="A knowledge_base",
+        only_date=datetime.combine(jul_01.date, datetime.min.time()),
+        write_notes_to=None,
+        override_existing=True,
+    )
+
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    assert [s for s in nm.n101_entries[0].sections if s.is_meal_n_breakdown] == tables
+    # the snack's table is kept, and it's still asked for on the next run
+    assert [n_b is not None for _, n_b in nm.get_meal_breakdowns(jul_01.date)] == [
+        True,
+        False,
+        True,
+        True,
+        True,
+    ]
+
+
+def test_it_doesnt_keep_breakdowns_that_dont_line_up_with_the_meals(
+    staged_notes_file: str, nutrition_dir: str, llm_analyzer: ILLMAnalyzer
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    jul_02 = nm.source_entries[1]
+    calls = []
+
+    def iter_meal_breakdowns(meal_descriptions, knowledge_base_section):
+        calls.append(meal_descriptions)
+        # the first call is a breakdown short, the retries return none
+        yield from NBreakdownFactory.build_batch(
+            len(meal_descriptions) - 1 if len(calls) == 1 else 0
+        )
+
+    flexmock(llm_analyzer).should_receive("iter_meal_breakdowns").replace_with(
+        iter_meal_breakdowns
+    )
+    notes_enricher = ObsidianNotesEnricher(analyzer=llm_analyzer, checkpoint=True)
+    notes_enricher.enrich_notes(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base="A knowledge_base",
+        only_date=datetime.combine(jul_02.date, datetime.min.time()),
+        write_notes_to=None,
+        override_existing=False,
+    )
+
+    assert notes_enricher.retry_stats.failed_meals == 4
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    assert all(n_b is None for _, n_b in nm.get_meal_breakdowns(jul_02.date))
@@ -0,0 +1,109 @@
+from datetime import date
+from pathlib import Path
+
+import pytest
+from flexmock import flexmock
+
+from nutrition101.llm import ILLMAnalyzer, MealIndex
+from nutrition101.obsidian import NotesManipulator, ObsidianNotesEnricher
+
+from .fixtures import NBreakdownFactory
+
+_MEAL = (
+    "2 bacon slices, 3 eggs, 1/4 onion, 3 whole white mushrooms, 1 slice country "
+    "sourdough bread, 1/2 large avocado, 4 garlic cloves, 12 tart cherry plums"
+)
+
+
+@pytest.fixture()
+def meal_index(tmp_path: Path):
+    meal_index = MealIndex(str(tmp_path / "meals.sqlite"))
+    yield meal_index
+    meal_index.close()
+
+
+def test_it_finds_near_identical_meals(meal_index: MealIndex):
+    breakdown = NBreakdownFactory.build()
+    assert meal_index.add([(_MEAL, breakdown)]) == 1
+
+    for description in (
+        _MEAL.upper(),
+        _MEAL.replace(", ", ".\n"),
+        _MEAL.replace(", 12 tart", " and 12 tart"),
+    ):
+        similar = meal_index.find(description)
+        assert similar is not None and similar.breakdown == breakdown
+
+    # different quantities, added or swapped foods or a different meal aren't similar
+    for description in (
+        _MEAL.replace("3 eggs", "2 eggs"),
+        _MEAL.replace("2 bacon slices, 3 eggs", "3 bacon slices, 2 eggs"),
+        _MEAL + ". Peppermint tea.",
+        _MEAL.replace("sourdough bread", "sourdough bread with butter"),
+        _MEAL.replace("garlic cloves", "ginger cloves"),
+        "1 cup cottage cheese wi 25 blueberries",
+    ):
+        assert meal_index.find(description) is None
+    assert (meal_index.hits, meal_index.misses) == (3, 6)
+
+
+def test_it_keeps_the_index(tmp_path: Path):
+    meal_index = MealIndex(str(tmp_path / "meals.sqlite"))
+    breakdown, other_breakdown = NBreakdownFactory.build_batch(2)
+    meal_index.add([(_MEAL, breakdown)])
+    assert meal_index.add([(_MEAL.upper(), other_breakdown)], replace=False) == 0
+    meal_index.close()
+
+    meal_index = MealIndex(str(tmp_path / "meals.sqlite"), threshold=0.5)
+    assert len(meal_index) == 1
+    # the same foods in a different order
+    similar = meal_index.find("3 eggs, " + _MEAL.replace(", 3 eggs", ""))
+    assert similar is not None and similar.breakdown == breakdown
+    meal_index.close()
+
+
+def test_it_reuses_the_breakdowns_of_similar_meals(
+    staged_notes_file: str,
+    nutrition_dir: str,
+    llm_analyzer: ILLMAnalyzer,
+    kbs: str,
+    meal_index: MealIndex,
+):
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    for de in nm.source_entries:
+        meal_descriptions = [s.get_meal_description() for s in de.sections if s.is_meal]
+        flexmock(llm_analyzer).should_receive("get_meal_breakdowns").with_args(
+            meal_descriptions, kbs
+        ).and_return(NBreakdownFactory.build_batch(len(meal_descriptions))).once()
+
+    enrich_kwargs = dict(
+        notes_file=staged_notes_file,
+        nutrition_dir=nutrition_dir,
+        knowledge_base=kbs,
+        only_date=None,
+        write_notes_to=None,
+        override_existing=False,
+    )
+    notes_enricher = ObsidianNotesEnricher(analyzer=llm_analyzer, meal_index=meal_index)
+    assert notes_enricher.enrich_notes(**enrich_kwargs)
+
+    # the same breakfast on the next day, written down a bit differently, and a new snack
+    with open(staged_notes_file, "a") as f:
+        f.write(
+            "\n\n07/04/2025\n\n==breakfast==\n"
+            + _MEAL.replace(", 4 garlic", ",\n4 Garlic")
+            + ", 20 cashews, 6 dried plums, 1 clif bar; Peppermint tea!\n\n"
+            "==snack==\na handful of pistachios\n"
+        )
+    flexmock(llm_analyzer).should_receive("get_meal_breakdowns").with_args(
+        ["a handful of pistachios"], kbs
+    ).and_return(NBreakdownFactory.build_batch(1)).once()
+    assert notes_enricher.enrich_notes(**enrich_kwargs)
+
+    nm = NotesManipulator(staged_notes_file, nutrition_dir)
+    [(_, yesterday_breakfast), *_] = nm.get_meal_breakdowns(date(2025, 7, 3))[1:]
+    [(_, breakfast), (_, snack)] = nm.get_meal_breakdowns(date(2025, 7, 4))
+    assert breakfast is not None and yesterday_breakfast is not None
+    assert breakfast.breakdown == yesterday_breakfast.breakdown
+    assert snack is not None
+    assert meal_index.hits == 1
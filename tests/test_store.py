@@ -0,0 +1,136 @@
+import shutil
+import sqlite3
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from nutrition101.obsidian import NotesManipulator
+from nutrition101.export import SQLiteExporter
+from nutrition101.store import NutritionStore
+
+from .fixtures import NBreakdownFactory, NEntryFactory
+
+
+def _entry(**nutrients):
+    return NEntryFactory.build(
+        **{
+            n: 0
+            for n in (
+                "calories",
+                "carbs_g",
+                "sugars_g",
+                "added_sugars_g",
+                "protein_g",
+                "fat_g",
+                "fiber_g",
+                "sodium_mg",
+            )
+        }
+        | nutrients
+    )
+
+
+@pytest.fixture()
+def store() -> NutritionStore:
+    return NutritionStore.from_entries(
+        [
+            (date(2025, 7, 4), "dinner", _entry(calories=700, protein_g=40)),
+            (date(2025, 7, 1), "breakfast", _entry(calories=300, protein_g=10)),
+            (date(2025, 7, 1), "lunch", _entry(calories=500, carbs_g=50, fat_g=20)),
+            (date(2025, 7, 2), "lunch", _entry(calories=600, protein_g=25)),
+        ]
+    )
+
+
+def test_it_totals_days(store: NutritionStore):
+    days, totals = store.daily_totals()
+    assert list(days) == [date(2025, 7, 1), date(2025, 7, 2), date(2025, 7, 4)]
+    assert list(totals["calories"]) == [800, 600, 700]
+    assert list(totals["protein_g"]) == [10, 25, 40]
+
+    days, totals = store.select(date(2025, 7, 2), date(2025, 7, 3)).daily_totals()
+    assert list(days) == [date(2025, 7, 2)]
+    assert list(totals["calories"]) == [600]
+    assert not len(store.select(end=date(2025, 6, 30)).daily_totals()[0])
+
+
+def test_it_averages_over_logged_days(store: NutritionStore):
+    until, averages = store.rolling_average("calories", window=2)
+    assert list(until) == [date(2025, 7, 2), date(2025, 7, 3), date(2025, 7, 4)]
+    # 07/03 wasn't logged, it doesn't count as a 0 calories day
+    assert averages[0] == 700 and averages[1] == 600 and averages[2] == 700
+
+    until, averages = store.select(start=date(2025, 7, 2)).rolling_average(
+        "calories", window=1
+    )
+    assert averages[0] == 600 and np.isnan(averages[1]) and averages[2] == 700
+
+
+def test_it_computes_ratios_and_trends(store: NutritionStore):
+    ratios = store.macro_ratios()
+    # 75 g of protein, 50 g of carbs, 20 g of fat
+    assert ratios == pytest.approx(
+        {"protein_g": 300 / 680, "carbs_g": 200 / 680, "fat_g": 180 / 680}
+    )
+    # 10 g, 25 g, then 40 g two days later
+    assert store.trend("protein_g") == pytest.approx(135 / 14)
+    assert store.select(end=date(2025, 7, 1)).trend("protein_g") == 0.0
+
+
+def test_it_loads_breakdowns_from_vault(tmp_path: Path, nutrition_dir: str):
+    data_dir = Path(__file__).parent / "data"
+    (tmp_path / "2025").mkdir()
+    notes_file = tmp_path / "2025" / "07 July.md"
+    shutil.copy(data_dir / "daily1.md", notes_file)
+    nm = NotesManipulator(str(notes_file), nutrition_dir)
+    jul_01 = nm.source_entries[0]
+    breakfast = next(s for s in jul_01.sections if s.is_meal)
+    breakdown = NBreakdownFactory.build()
+    nm.add_meal_breakdown(jul_01.date, breakfast, breakdown)
+    nm.write_notes(None)
+
+    store = NutritionStore.load(str(tmp_path), nutrition_dir)
+    assert len(store) == len(breakdown.entries)
+    assert list(store.meal_names) == ["breakfast"]
+    days, totals = store.daily_totals()
+    assert list(days) == [jul_01.date]
+    assert totals["calories"][0] == sum(e.calories for e in breakdown.entries)
+
+
+def test_it_exports_changed_months(tmp_path: Path, nutrition_dir: str):
+    data_dir = Path(__file__).parent / "data"
+    (tmp_path / "2025").mkdir()
+    notes_file = tmp_path / "2025" / "07 July.md"
+    shutil.copy(data_dir / "daily1.md", notes_file)
+    nm = NotesManipulator(str(notes_file), nutrition_dir)
+    jul_01 = nm.source_entries[0]
+    breakfast, snack, *_ = [s for s in jul_01.sections if s.is_meal]
+    nm.add_meal_breakdown(jul_01.date, breakfast, NBreakdownFactory.build())
+    nm.write_notes(None)
+
+    db_file = str(tmp_path / "n101.sqlite")
+    exporter = SQLiteExporter(db_file)
+    assert exporter.export(str(tmp_path), nutrition_dir) == ["2025-07"]
+    assert len(exporter) == 5
+    assert exporter.export(str(tmp_path), nutrition_dir) == []
+
+    nm = NotesManipulator(str(notes_file), nutrition_dir)
+    nm.add_meal_breakdown(jul_01.date, snack, NBreakdownFactory.build())
+    nm.write_notes(None)
+    assert exporter.export(str(tmp_path), nutrition_dir) == ["2025-07"]
+    exporter.close()
+
+    db = sqlite3.connect(db_file)
+    assert db.execute(
+        "SELECT meal_name, COUNT(*) FROM entries WHERE date = '2025-07-01' "
+        "GROUP BY meal_name ORDER BY meal_name"
+    ).fetchall() == [("breakfast", 5), ("snack", 5)]
+    db.close()
+
+    (tmp_path / "2025" / nutrition_dir / notes_file.name).unlink()
+    exporter = SQLiteExporter(db_file)
+    assert exporter.export(str(tmp_path), nutrition_dir) == []
+    assert len(exporter) == 0
+    exporter.close()
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+
+import pytest
+from flexmock import flexmock
+
+from nutrition101.obsidian import (
+    INotesWatcher,
+    InotifyNotesWatcher,
+    NotesManifest,
+    PollingNotesWatcher,
+    discover_notes_files,
+    watch_notes_files,
+)
+
+
+def test_it_discovers_daily_notes_files(tmp_path: Path):
+    for name in [
+        "2025/01 January.md",
+        "2024/12 December.md",
+        "2025/n101/knowledge_base.md",
+        "2025/n101/01 January.md",
+        "2025/Ideas.md",
+        "Templates/01 January.md",
+    ]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("")
+
+    assert discover_notes_files(str(tmp_path), "n101") == [
+        tmp_path / "2024/12 December.md",
+        tmp_path / "2025/01 January.md",
+    ]
+
+
+def test_it_tracks_changed_files(tmp_path: Path):
+    notes_file = tmp_path / "01 January.md"
+    notes_file.write_text("01/01/2025\n- 1 apple")
+    manifest_file = str(tmp_path / "manifest.json")
+
+    manifest = NotesManifest(manifest_file)
+    assert manifest.get_changed([notes_file]) == [notes_file]
+    manifest.record(notes_file)
+    manifest.save()
+
+    manifest = NotesManifest(manifest_file)
+    assert manifest.get_changed([notes_file]) == []
+
+    # touched, but the content is the same
+    stat = notes_file.stat()
+    os.utime(notes_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert manifest.get_changed([notes_file]) == []
+
+    notes_file.write_text("01/01/2025\n- 2 apples")
+    assert manifest.get_changed([notes_file]) == [notes_file]
+
+
+@pytest.fixture()
+def vault_dir(tmp_path: Path) -> Path:
+    (tmp_path / "2025/n101").mkdir(parents=True)
+    return tmp_path
+
+
+def test_inotify_watcher_sees_synced_files(vault_dir: Path):
+    try:
+        watcher = InotifyNotesWatcher(str(vault_dir), "n101")
+    except OSError:
+        pytest.skip("inotify isn't available")
+
+    with watcher:
+        assert watcher.get_changes(timeout=0) == set()
+
+        notes_file = vault_dir / "2025/01 January.md"
+        notes_file.write_text("01/01/2025")
+        # breakdowns and temporary files aren't daily notes
+        (vault_dir / "2025/n101/01 January.md").write_text("")
+        (vault_dir / "2025/.syncthing.02 February.md.tmp").write_text("")
+        assert watcher.get_changes(timeout=1) == {notes_file}
+
+        # Syncthing moves a fully synced file into place
+        (vault_dir / "2025/.syncthing.02 February.md.tmp").rename(
+            vault_dir / "2025/02 February.md"
+        )
+        assert watcher.get_changes(timeout=1) == {vault_dir / "2025/02 February.md"}
+
+        (vault_dir / "2026").mkdir()
+        assert watcher.get_changes(timeout=1) == set()
+        (vault_dir / "2026/01 January.md").write_text("01/01/2026")
+        assert watcher.get_changes(timeout=1) == {vault_dir / "2026/01 January.md"}
+
+
+def test_polling_watcher_sees_changed_files(vault_dir: Path):
+    notes_file = vault_dir / "2025/01 January.md"
+    notes_file.write_text("01/01/2025")
+
+    with PollingNotesWatcher(str(vault_dir), "n101", poll_interval=0.01) as watcher:
+        assert watcher.get_changes(timeout=0.05) == set()
+        notes_file.write_text("01/01/2025\n- 1 apple")
+        (vault_dir / "2025/02 February.md").write_text("02/01/2025")
+        assert watcher.get_changes(timeout=1) == {
+            notes_file,
+            vault_dir / "2025/02 February.md",
+        }
+
+
+def test_it_debounces_changes():
+    class BurstWatcher(INotesWatcher):
+        burst = [{Path("01 January.md")}, {Path("02 February.md")}, set()]
+
+        def get_changes(self, timeout: float | None) -> set[Path]:
+            return self.burst.pop(0)
+
+    watcher = flexmock(BurstWatcher("daily", "n101"))
+    watcher.should_call("get_changes").with_args(timeout=None).once()
+    watcher.should_call("get_changes").with_args(timeout=1).twice()
+
+    changes = watch_notes_files(watcher, debounce_seconds=1)
+    assert next(changes) == [Path("01 January.md"), Path("02 February.md")]